@@ -2,6 +2,13 @@
 from functools import wraps
 from flask import request, jsonify
 import os
+from api.services.key_store import get_key_store
+from api.services.usage import current_api_key
+from api.services.admission import current_priority, priority_for
+from config.settings import load_config
+
+# Se lee una vez: load_config() reconstruye toda la configuración en cada llamada
+DEFAULT_PRIORITY = load_config()['ADMISSION_DEFAULT_PRIORITY']
 
 def get_api_key():
     auth_header = request.headers.get('Authorization', '')
@@ -9,12 +16,29 @@ def get_api_key():
         return auth_header[7:]
     return request.args.get('api_key', '')
 
+def is_valid_api_key(api_key):
+    if not api_key:
+        return False
+    valid_keys = os.environ.get('API_KEYS', '').split(',')
+    if api_key in valid_keys:
+        current_api_key.set(api_key)
+        current_priority.set(DEFAULT_PRIORITY)
+        return True
+    # Keys creadas con APIManager: se cuenta la petición (volcado por lotes)
+    key_store = get_key_store()
+    key_data = key_store.get(api_key)
+    if key_data:
+        key_store.record_usage(api_key, requests=1)
+        current_api_key.set(api_key)
+        # Clase de la cola de admisión guardada con la key (interactive / batch)
+        current_priority.set(priority_for(key_data, DEFAULT_PRIORITY))
+        return True
+    return False
+
 def require_api_key(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        valid_keys = os.environ.get('API_KEYS', '').split(',')
-        api_key = get_api_key()
-        if not api_key or api_key not in valid_keys:
+        if not is_valid_api_key(get_api_key()):
             return jsonify({"error": "Invalid or missing API key"}), 401
         return f(*args, **kwargs)
     return decorated
@@ -1,27 +1,164 @@
 # Rate Limiting Middleware
-from flask import request, jsonify
+from collections import OrderedDict, namedtuple
+from functools import wraps
+from flask import request, jsonify, make_response
+import logging
+import math
+import threading
 import time
 
-# Simple in-memory rate limiter
-request_times = {}
-
-def check_rate_limit(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        key = request.headers.get('Authorization', 'anonymous')
-        now = time.time()
-        window = 60  # 1 minute
-        
-        if key not in request_times:
-            request_times[key] = []
-        
-        # Remove old requests
-        request_times[key] = [t for t in request_times[key] if now - t < window]
-        
-        # Check limit (100 requests per minute)
-        if len(request_times[key]) >= 100:
-            return jsonify({"error": "Rate limit exceeded"}), 429
-        
-        request_times[key].append(now)
-        return f(*args, **kwargs)
-    return decorated
+from api.middleware.auth import get_api_key
+from api.services.key_store import get_key_store
+from config.settings import load_config
+
+RateLimitResult = namedtuple('RateLimitResult', ['allowed', 'limit', 'remaining', 'reset', 'retry_after'])
+
+
+def _result(allowed, limit, window, tokens, cost=1):
+    rate = limit / window
+    return RateLimitResult(
+        allowed=allowed,
+        limit=limit,
+        remaining=int(tokens),
+        reset=math.ceil((limit - tokens) / rate),
+        retry_after=0 if allowed else math.ceil((cost - tokens) / rate)
+    )
+
+
+class TokenBucketLimiter:
+    """Token bucket en memoria: O(1) por petición y expulsión de keys inactivas"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def hit(self, key, limit, window, cost=1):
+        now = time.monotonic()
+        rate = limit / window
+        with self._lock:
+            tokens, last, _ = self._buckets.pop(key, (limit, now, window))
+            tokens = min(limit, tokens + (now - last) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now, window)
+
+            # Las entradas más antiguas están al principio; un bucket inactivo
+            # durante toda su ventana está lleno y equivale a no tenerlo
+            while self._buckets:
+                oldest_key, (_, oldest_last, oldest_window) = next(iter(self._buckets.items()))
+                if now - oldest_last < oldest_window:
+                    break
+                del self._buckets[oldest_key]
+        return _result(allowed, limit, window, tokens, cost)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class RedisTokenBucketLimiter:
+    """Mismo algoritmo en Redis (script Lua atómico) para compartir el límite entre workers"""
+
+    SCRIPT = """
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local rate = limit / window
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(data[1]) or limit
+local ts = tonumber(data[2]) or now
+tokens = math.min(limit, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(window * 1000))
+return {allowed, tostring(tokens)}
+"""
+
+    def __init__(self, redis_url, prefix='uaa:ratelimit:'):
+        import redis
+        self.redis = redis.Redis.from_url(redis_url, socket_timeout=0.1, socket_connect_timeout=0.1)
+        self.script = self.redis.register_script(self.SCRIPT)
+        self.prefix = prefix
+
+    def hit(self, key, limit, window, cost=1):
+        allowed, tokens = self.script(keys=[self.prefix + key], args=[limit, window, time.time(), cost])
+        return _result(bool(allowed), limit, window, float(tokens), cost)
+
+
+class RateLimiter:
+    """Aplica el límite de cada key (APIManager) o el de RATE_LIMIT_REQUESTS/RATE_LIMIT_WINDOW"""
+
+    def __init__(self, default_limit=100, window=60, redis_url=''):
+        self.default_limit = default_limit
+        self.window = window
+        self.local = TokenBucketLimiter()
+        self.shared = RedisTokenBucketLimiter(redis_url) if redis_url else None
+
+    def limit_for(self, api_key):
+        data = get_key_store().get(api_key)
+        if data and data.get('rate_limit'):
+            return int(data['rate_limit'])
+        return self.default_limit
+
+    def check(self, api_key, cost=1):
+        """cost: peticiones que cuenta esta llamada (elementos de un lote, n choices)"""
+        key = api_key or 'anonymous'
+        limit = self.limit_for(api_key)
+        # Un lote mayor que el límite nunca cabría en el bucket: se cobra el bucket entero
+        cost = min(cost, limit)
+        if self.shared is not None:
+            try:
+                return self.shared.hit(key, limit, self.window, cost)
+            except Exception as e:
+                # Sin Redis se sigue limitando, aunque solo por proceso
+                logging.warning(f"Rate limit en Redis no disponible: {e}")
+        return self.local.hit(key, limit, self.window, cost)
+
+
+def rate_limit_headers(result):
+    headers = {
+        'X-RateLimit-Limit': str(result.limit),
+        'X-RateLimit-Remaining': str(result.remaining),
+        'X-RateLimit-Reset': str(result.reset)
+    }
+    if not result.allowed:
+        headers['Retry-After'] = str(result.retry_after)
+    return headers
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            config = load_config()
+            _limiter = RateLimiter(
+                default_limit=config['RATE_LIMIT_REQUESTS'],
+                window=config['RATE_LIMIT_WINDOW'],
+                redis_url=config['RATE_LIMIT_REDIS_URL']
+            )
+    return _limiter
+
+
+def check_rate_limit(f=None, cost=None):
+    """@check_rate_limit o @check_rate_limit(cost=fn): fn() da las peticiones que cuenta"""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            result = get_rate_limiter().check(get_api_key(), cost() if cost else 1)
+            headers = rate_limit_headers(result)
+            if not result.allowed:
+                return jsonify({"error": "Rate limit exceeded"}), 429, headers
+            response = make_response(f(*args, **kwargs))
+            response.headers.extend(headers)
+            return response
+        return decorated
+    return decorator(f) if f else decorator
@@ -1,16 +1,41 @@
 # API Routes - Chat Completions (OpenAI Compatible)
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from api.services.router import AIRouter
+from api.services.cache import CompletionCache, get_completion_cache, is_cache_bypassed, is_deterministic
+from api.services.coalescing import get_single_flight
+from api.services.semantic_cache import get_semantic_cache
+from api.services.batch import (
+    batch_response, first_error, get_batch_executor, max_item_tokens, merge_choices, parse_batch, parse_choices,
+    replicate_choices
+)
+from api.services.backend_health import BackendUnavailable
+from api.services.admission import current_priority
+from api.services.cancellation import RequestAborted, current_scope, get_request_deadlines, socket_probe
 from api.middleware.auth import require_api_key
 from api.middleware.rate_limit import check_rate_limit
+from config.settings import load_config
 import logging
 
 chat_bp = Blueprint('chat', __name__)
 router = AIRouter()
+completion_cache = get_completion_cache()
+single_flight = get_single_flight()
+semantic_cache = get_semantic_cache()
+semantic_model = load_config()['SEMANTIC_CACHE_MODEL'] or None
+max_batch_items = load_config()['BATCH_MAX_ITEMS']
+deadlines = get_request_deadlines()
+
+def _request_cost():
+    """Cada elemento de un lote o cada choice (n) cuenta como una petición"""
+    data = request.get_json(silent=True) or {}
+    if isinstance(data.get('requests'), list):
+        return min(max(1, len(data['requests'])), max_batch_items)
+    n = data.get('n', 1)
+    return min(n, max_batch_items) if isinstance(n, int) and n > 1 else 1
 
 @chat_bp.route('/completions', methods=['POST'])
 @require_api_key
-@check_rate_limit
+@check_rate_limit(cost=_request_cost)
 def create_completion():
     """
     Endpoint compatible con OpenAI Chat Completions
@@ -38,25 +63,145 @@ def create_completion():
         if 'model' not in data:
             return jsonify({"error": "Missing 'model' parameter"}), 400
         
+        try:
+            n = parse_choices(data, max_batch_items)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
         model = data.get('model')
         messages = data.get('messages')
         temperature = data.get('temperature', 0.7)
         max_tokens = data.get('max_tokens', 2000)
         stream = data.get('stream', False)
+        # Plazo según max_tokens; si el cliente se va se corta la generación upstream
+        scope = deadlines.begin(max_tokens, socket_probe(request.environ))
+        
+        if n > 1 and not is_deterministic(temperature):
+            # n generaciones independientes en paralelo, acotadas por backend
+            outcomes = get_batch_executor(router).run(
+                [{"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}] * n
+            )
+            error = first_error(outcomes)
+            if error is not None:
+                raise error
+            return jsonify(merge_choices(outcomes)), 200
+        
+        # Las peticiones deterministas idénticas comparten caché y llamada upstream
+        request_key = CompletionCache.make_key(model, messages, temperature, max_tokens) if is_deterministic(temperature) else None
+        use_cache = completion_cache is not None and completion_cache.is_cacheable(temperature, stream)
+        bypass = is_cache_bypassed(request.headers)
+        if use_cache and not bypass:
+            cached = completion_cache.get(request_key)
+            if cached is not None:
+                if n > 1:
+                    cached = replicate_choices(cached, n)
+                return jsonify(cached), 200, {'X-Cache': 'HIT'}
+        
+        # Preguntas parecidas ya respondidas (embedding local + similitud)
+        probe = None
+        if semantic_cache is not None and not stream and not bypass:
+            probe = semantic_cache.probe(model, messages, lambda text: router.embed_text(text, semantic_model),
+                                         temperature, max_tokens)
+            if probe is not None and probe.response is not None:
+                cached = replicate_choices(probe.response, n) if n > 1 else probe.response
+                return jsonify(cached), 200, {'X-Cache': 'SEMANTIC', 'X-Cache-Similarity': f"{probe.similarity:.4f}"}
+        
+        def route():
+            return router.route_request(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=stream,
+                session=request.headers.get('X-Session-Id')
+            )
         
-        response = router.route_request(
-            model=model,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            stream=stream
-        )
+        if single_flight and request_key:
+            # La llamada compartida sigue aunque se vaya el cliente que la abrió
+            current_scope.set(scope.shared())
+            run = single_flight.do_stream if stream else single_flight.do
+            response, leader = run(f"{'stream' if stream else 'json'}:{request_key}", route)
+        else:
+            response, leader = route(), True
+        headers = {} if leader else {'X-Coalesced': 'true'}
         
-        return jsonify(response)
+        if stream:
+            return Response(
+                stream_with_context(scope.guard(response)),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', **headers}
+            )
         
+        if use_cache:
+            if leader:
+                completion_cache.set(request_key, response)
+            headers['X-Cache'] = 'BYPASS' if bypass else 'MISS'
+        if probe is not None and leader:
+            semantic_cache.store(probe, response)
+        
+        if n > 1:
+            response = replicate_choices(response, n)
+        return jsonify(response), 200, headers
+        
+    except BackendUnavailable as e:
+        return jsonify({"error": "Service unavailable", "message": str(e)}), 503, {'Retry-After': str(e.retry_after)}
+    
+    except RequestAborted as e:
+        return jsonify({"error": "Request aborted", "message": str(e)}), e.status
+    
     except Exception as e:
         logging.error(f"Error en completions: {e}")
         return jsonify({
             "error": "Internal server error",
             "message": str(e)
         }), 500
+
+
+@chat_bp.route('/batch', methods=['POST'])
+@require_api_key
+@check_rate_limit(cost=_request_cost)
+def create_batch():
+    """
+    Varias completions en una sola llamada, ejecutadas en paralelo
+    
+    POST /v1/chat/batch
+    {
+        "model": "qwen2.5:7b",
+        "temperature": 0,
+        "requests": [
+            {"messages": [{"role": "user", "content": "Resume: ..."}]},
+            {"messages": [{"role": "user", "content": "Traduce: ..."}], "max_tokens": 200}
+        ]
+    }
+    
+    Los resultados vuelven en el mismo orden; un fallo solo afecta a su elemento.
+    """
+    try:
+        requests = parse_batch(request.get_json(silent=True), max_batch_items)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    # Los elementos deterministas ya respondidos salen de la caché
+    outcomes = [None] * len(requests)
+    pending = []
+    for index, item in enumerate(requests):
+        if completion_cache is not None and completion_cache.is_cacheable(item['temperature']):
+            item_key = CompletionCache.make_key(item['model'], item['messages'], item['temperature'], item['max_tokens'])
+            outcomes[index] = completion_cache.get(item_key)
+        if outcomes[index] is None:
+            pending.append(index)
+    
+    # Los lotes nunca adelantan en la cola de Ollama a las peticiones interactivas
+    current_priority.set('batch')
+    # Los elementos van en paralelo: el plazo es el del más largo
+    deadlines.begin(max_item_tokens(requests), socket_probe(request.environ))
+    for index, outcome in zip(pending, get_batch_executor(router).run([requests[i] for i in pending])):
+        outcomes[index] = outcome
+        item = requests[index]
+        if completion_cache is not None and completion_cache.is_cacheable(item['temperature']) and isinstance(outcome, dict):
+            completion_cache.set(
+                CompletionCache.make_key(item['model'], item['messages'], item['temperature'], item['max_tokens']),
+                outcome
+            )
+    
+    return jsonify(batch_response(outcomes)), 200
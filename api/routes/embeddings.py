@@ -0,0 +1,51 @@
+# API Routes - Embeddings (OpenAI Compatible)
+from flask import Blueprint, request, jsonify
+from api.services.router import AIRouter
+from api.services.embeddings import embedding_response, parse_embedding_request
+from api.services.backend_health import BackendUnavailable
+from api.middleware.auth import require_api_key
+from api.middleware.rate_limit import check_rate_limit
+from config.settings import load_config
+import logging
+
+embeddings_bp = Blueprint('embeddings', __name__)
+router = AIRouter()
+max_inputs = load_config()['EMBEDDING_MAX_INPUTS']
+
+@embeddings_bp.route('/embeddings', methods=['POST'])
+@require_api_key
+@check_rate_limit
+def create_embeddings():
+    """
+    Endpoint compatible con OpenAI Embeddings (Ollama /api/embed)
+    
+    POST /v1/embeddings
+    {
+        "model": "nomic-embed-text",
+        "input": ["primer texto", "segundo texto"]
+    }
+    
+    Las peticiones concurrentes del mismo modelo se agrupan en una llamada a Ollama.
+    """
+    try:
+        params = parse_embedding_request(request.get_json(silent=True), max_inputs)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    model = router.resolve_embedding_model(params['model'])
+    if model is None:
+        return jsonify({"error": f"Model '{params['model']}' not found"}), 404
+    
+    try:
+        vectors, tokens = router.embed(model, params['input'], params['dimensions'])
+        return jsonify(embedding_response(model, vectors, tokens, params['encoding_format'])), 200
+    
+    except BackendUnavailable as e:
+        return jsonify({"error": "Service unavailable", "message": str(e)}), 503, {'Retry-After': str(e.retry_after)}
+    
+    except Exception as e:
+        logging.error(f"Error en embeddings: {e}")
+        return jsonify({
+            "error": "Internal server error",
+            "message": str(e)
+        }), 500
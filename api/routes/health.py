@@ -1,13 +1,105 @@
 # API Routes - Health Check
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request
+from api.services.http_client import upstream_stats
+from api.services.cache import get_completion_cache
+from api.services.backend_health import backend_health_stats
+from api.services.coalescing import get_single_flight
+from api.services.batch import batch_stats
+from api.services.ollama_pool import get_ollama_pool
+from api.services.hedging import get_hedge_policy
+from api.services.admission import get_admission_queue
+from api.services.embeddings import embedding_stats as batcher_stats
+from api.services.semantic_cache import get_semantic_cache
+from api.services.context_window import context_window_stats
+from api.services.residency import get_model_residency
+from api.services.journal import get_request_journal
+from api.services.cancellation import get_request_deadlines
+from api.services.health_prober import health_response, is_deep
 
 health_bp = Blueprint('health', __name__)
 
 @health_bp.route('', methods=['GET'])
 def health_check():
-    """Health check endpoint"""
-    return jsonify({
-        "status": "healthy",
+    """Health check endpoint: cached dependency probes (?deep=1 probes them now)"""
+    body, status = health_response({
         "service": "Unified AI API Gateway",
         "version": "1.0.0"
-    })
+    }, is_deep(request.args.get('deep')))
+    return jsonify(body), status
+
+@health_bp.route('/upstreams', methods=['GET'])
+def upstream_pools():
+    """Connection pool statistics per upstream backend"""
+    return jsonify({"upstreams": upstream_stats()})
+
+@health_bp.route('/cache', methods=['GET'])
+def cache_stats():
+    """Completion cache hit/miss counters"""
+    cache = get_completion_cache()
+    return jsonify({"cache": cache.stats() if cache else None})
+
+@health_bp.route('/backends', methods=['GET'])
+def backends():
+    """Observed latency, error rate and circuit state per backend"""
+    return jsonify({"backends": backend_health_stats()})
+
+@health_bp.route('/coalescing', methods=['GET'])
+def coalescing_stats():
+    """Identical in-flight requests served by a single upstream call"""
+    single_flight = get_single_flight()
+    return jsonify({"coalescing": single_flight.stats() if single_flight else None})
+
+@health_bp.route('/batch', methods=['GET'])
+def batch_executor():
+    """Queued and running batch items per backend"""
+    return jsonify({"batch": batch_stats()})
+
+@health_bp.route('/ollama', methods=['GET'])
+def ollama_nodes():
+    """Ollama nodes with their installed/loaded models and in-flight requests"""
+    return jsonify({"ollama": get_ollama_pool().stats()})
+
+@health_bp.route('/hedging', methods=['GET'])
+def hedging_stats():
+    """Hedged requests to DeepSeek, winners and the current first-token deadline"""
+    policy = get_hedge_policy()
+    return jsonify({"hedging": policy.stats() if policy else None})
+
+@health_bp.route('/admission', methods=['GET'])
+def admission_stats():
+    """Ollama admission queue: active generations, queued requests per priority, timeouts and shed"""
+    queue = get_admission_queue()
+    return jsonify({"admission": queue.stats() if queue else None})
+
+@health_bp.route('/embeddings', methods=['GET'])
+def embedding_stats():
+    """Embedding micro-batches: requests and texts merged per Ollama call"""
+    return jsonify({"embeddings": batcher_stats()})
+
+@health_bp.route('/semantic-cache', methods=['GET'])
+def semantic_cache_stats():
+    """Semantic cache hit rate, similarity distribution and lookup latency"""
+    cache = get_semantic_cache()
+    return jsonify({"semantic_cache": cache.stats() if cache else None})
+
+@health_bp.route('/context', methods=['GET'])
+def context_stats():
+    """Chat history compaction for Ollama: trimmed requests, num_ctx per model and summaries"""
+    return jsonify({"context": context_window_stats()})
+
+@health_bp.route('/residency', methods=['GET'])
+def residency_stats():
+    """Models loaded in each Ollama node, hot-model warmups and cold placements"""
+    residency = get_model_residency()
+    return jsonify({"residency": residency.stats() if residency else None})
+
+@health_bp.route('/journal', methods=['GET'])
+def journal_stats():
+    """Request journal writer: lines written, dropped and the current file"""
+    journal = get_request_journal()
+    return jsonify({"journal": journal.stats() if journal else None})
+
+@health_bp.route('/deadlines', methods=['GET'])
+def deadline_stats():
+    """Request deadlines and generations cut short by client disconnects or deadlines"""
+    return jsonify({"deadlines": get_request_deadlines().stats()})
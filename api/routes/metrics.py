@@ -0,0 +1,10 @@
+# API Routes - Prometheus Metrics
+from flask import Blueprint, Response
+from api.services.metrics import registry, CONTENT_TYPE
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('', methods=['GET'])
+def metrics():
+    """Prometheus text exposition, summed across gunicorn workers when METRICS_DIR is set"""
+    return Response(registry.render(), mimetype=None, content_type=CONTENT_TYPE)
@@ -1,21 +1,18 @@
 # API Routes - Models List
 from flask import Blueprint, jsonify
-import requests
+from api.services.model_registry import get_model_registry
 
 models_bp = Blueprint('models', __name__)
 
 @models_bp.route('/models', methods=['GET'])
 def list_models():
     """List available models"""
-    # Get local models from Ollama
-    try:
-        response = requests.get('http://localhost:11434/api/tags', timeout=5)
-        if response.status_code == 200:
-            local_models = response.json().get('models', [])
-        else:
-            local_models = []
-    except:
-        local_models = []
+    return jsonify(build_model_list())
+
+def build_model_list():
+    """Model list in OpenAI format (shared with the ASGI app)"""
+    # Local models from the shared Ollama inventory
+    local_models = get_model_registry().models()
     
     # Return model list in OpenAI format
     models = []
@@ -35,7 +32,7 @@ def list_models():
         "owned_by": "deepseek"
     })
     
-    return jsonify({
+    return {
         "object": "list",
         "data": models
-    })
+    }
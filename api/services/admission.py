@@ -0,0 +1,207 @@
+# Admission - Cola con prioridades delante de Ollama: límite de generaciones, plazos y descarte
+import asyncio
+import contextvars
+import math
+import threading
+import time
+from collections import deque
+
+from api.services.backend_health import BackendUnavailable
+from api.services.metrics import admission_active, admission_queue_depth, admission_rejected, admission_wait
+from config.settings import load_config
+
+# Orden de servicio: una petición interactiva en cola pasa antes que cualquier batch
+PRIORITIES = ('interactive', 'batch')
+
+# Prioridad de la petición en curso; la fija la autenticación según la key
+current_priority = contextvars.ContextVar('current_priority', default='interactive')
+
+
+def priority_for(key_data, default='interactive'):
+    """Clase de prioridad guardada con la key en api_keys.json (APIManager)"""
+    priority = (key_data or {}).get('priority') or default
+    return priority if priority in PRIORITIES else default
+
+
+class AdmissionTimeout(Exception):
+    """Se agotó el plazo de espera en cola; el router pasa a DeepSeek"""
+
+    def __init__(self, backend, priority, waited):
+        super().__init__(f"{backend}: {waited:.1f}s en cola ({priority}) sin turno")
+        self.backend = backend
+        self.priority = priority
+        self.waited = waited
+
+
+class _Waiter:
+    def __init__(self, priority, loop=None):
+        self.priority = priority
+        self.admitted = False
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+
+    def wake(self):
+        self.admitted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+
+class AdmissionQueue:
+    """Límite de generaciones simultáneas en Ollama con cola por prioridad
+
+    Sin cola en el gateway las peticiones de más esperan dentro de Ollama hasta
+    el timeout de lectura. Aquí esperan a que quede un hueco: primero las
+    interactivas y después las batch, cada una en orden de llegada. Si el plazo
+    de su clase vence se lanza AdmissionTimeout (fallback a DeepSeek) y si la
+    cola está llena BackendUnavailable (503 con Retry-After estimado).
+    El límite es por proceso.
+    """
+
+    def __init__(self, concurrency, max_queue, timeouts, backend='ollama', alpha=0.2):
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max_queue
+        self.timeouts = dict(timeouts)
+        self.backend = backend
+        self.alpha = alpha
+
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiting = {priority: deque() for priority in PRIORITIES}
+        self._hold = None
+        self._counters = {priority: {"admitted": 0, "timeouts": 0, "shed": 0} for priority in PRIORITIES}
+
+    def _queued(self):
+        return sum(len(waiters) for waiters in self._waiting.values())
+
+    def _retry_after(self):
+        # Tiempo para vaciar la cola actual con el uso medio observado de cada hueco
+        hold = self._hold if self._hold is not None else 1.0
+        return max(1, math.ceil((self._queued() + 1) * hold / self.concurrency))
+
+    def _enter(self, priority):
+        """Con el lock: el slot si hay hueco, un _Waiter en cola o BackendUnavailable"""
+        if self._active < self.concurrency and not self._queued():
+            self._active += 1
+            self._counters[priority]["admitted"] += 1
+            admission_active.inc()
+            admission_wait.observe(0.0, priority=priority, outcome='admitted')
+            return time.monotonic()
+        if self._queued() >= self.max_queue:
+            self._counters[priority]["shed"] += 1
+            admission_rejected.inc(priority=priority, reason='queue_full')
+            raise BackendUnavailable(self.backend, self._retry_after())
+        return None
+
+    def _queue(self, waiter):
+        self._waiting[waiter.priority].append(waiter)
+        admission_queue_depth.inc(priority=waiter.priority)
+
+    def _leave(self, waiter, started):
+        """Con el lock, al despertar: el slot si se le concedió o AdmissionTimeout"""
+        waited = time.monotonic() - started
+        if waiter.admitted:
+            self._counters[waiter.priority]["admitted"] += 1
+            admission_wait.observe(waited, priority=waiter.priority, outcome='admitted')
+            return time.monotonic()
+        self._waiting[waiter.priority].remove(waiter)
+        admission_queue_depth.dec(priority=waiter.priority)
+        self._counters[waiter.priority]["timeouts"] += 1
+        admission_wait.observe(waited, priority=waiter.priority, outcome='timeout')
+        admission_rejected.inc(priority=waiter.priority, reason='timeout')
+        raise AdmissionTimeout(self.backend, waiter.priority, waited)
+
+    def acquire(self, priority=None):
+        """Espera turno; devuelve el slot para release()"""
+        priority = priority if priority in PRIORITIES else PRIORITIES[0]
+        started = time.monotonic()
+        with self._lock:
+            slot = self._enter(priority)
+            if slot is not None:
+                return slot
+            waiter = _Waiter(priority)
+            self._queue(waiter)
+        waiter.event.wait(self.timeouts[priority])
+        with self._lock:
+            return self._leave(waiter, started)
+
+    async def acquire_async(self, priority=None):
+        """Equivalente asyncio; si la tarea se cancela en cola deja su sitio"""
+        priority = priority if priority in PRIORITIES else PRIORITIES[0]
+        started = time.monotonic()
+        with self._lock:
+            slot = self._enter(priority)
+            if slot is not None:
+                return slot
+            waiter = _Waiter(priority, asyncio.get_running_loop())
+            self._queue(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.timeouts[priority])
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.admitted:
+                    # El turno llegó justo al cancelar: se pasa al siguiente
+                    self._handover()
+                else:
+                    self._waiting[priority].remove(waiter)
+                    admission_queue_depth.dec(priority=priority)
+            raise
+        with self._lock:
+            return self._leave(waiter, started)
+
+    def release(self, slot):
+        """Libera el hueco o lo cede directamente al siguiente en cola"""
+        with self._lock:
+            held = time.monotonic() - slot
+            self._hold = held if self._hold is None else self._hold + self.alpha * (held - self._hold)
+            self._handover()
+
+    def _handover(self):
+        for priority in PRIORITIES:
+            if self._waiting[priority]:
+                waiter = self._waiting[priority].popleft()
+                admission_queue_depth.dec(priority=priority)
+                waiter.wake()
+                return
+        self._active -= 1
+        admission_active.dec()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "concurrency": self.concurrency,
+                "active": self._active,
+                "max_queue": self.max_queue,
+                "queued": {priority: len(waiters) for priority, waiters in self._waiting.items()},
+                "timeouts": self.timeouts,
+                "avg_hold_seconds": round(self._hold, 3) if self._hold is not None else None,
+                "classes": {priority: dict(counters) for priority, counters in self._counters.items()}
+            }
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_admission_queue():
+    """AdmissionQueue de Ollama compartida por proceso; None si ADMISSION_ENABLED=false"""
+    global _queue
+    config = load_config()
+    if not config['ADMISSION_ENABLED']:
+        return None
+    with _queue_lock:
+        if _queue is None:
+            _queue = AdmissionQueue(
+                config['ADMISSION_CONCURRENCY'] or config['OLLAMA_CONCURRENCY'],
+                config['ADMISSION_QUEUE_SIZE'],
+                {'interactive': config['ADMISSION_TIMEOUT_INTERACTIVE'], 'batch': config['ADMISSION_TIMEOUT_BATCH']}
+            )
+    return _queue
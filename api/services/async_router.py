@@ -0,0 +1,257 @@
+# Async API Router - Misma lógica que AIRouter con I/O no bloqueante (modo ASGI)
+import asyncio
+import logging
+import time
+from api.services.router import AIRouter, is_backend_failure, stream_closer
+from api.services.metrics import UpstreamCall
+from api.services.ollama_pool import affinity_key
+from api.services.http_client import get_async_upstream_client
+from api.services.streaming import OllamaChunkConverter, SSE_DONE, completion_from_chunks, track_async_stream
+from api.services.hedging import AsyncPrefetchedStream, prefetch_async
+from api.services.admission import AdmissionTimeout, current_priority
+from api.services.codec import JSON_HEADERS, RawCompletion, dumps, loads
+from api.services.embeddings import AsyncEmbeddingBatcher
+from api.services.usage import get_usage_recorder
+from api.services.backend_health import BackendUnavailable
+
+class AsyncAIRouter(AIRouter):
+    """AIRouter sobre httpx: cada generación en curso es una corrutina, no un hilo"""
+
+    def _embedding_batcher(self):
+        # El EmbeddingBatcher síncrono del proceso no se crea con la corrutina _embed_batch
+        return AsyncEmbeddingBatcher(
+            self._embed_batch, self.config['EMBEDDING_BATCH_SIZE'], self.config['EMBEDDING_BATCH_WAIT_MS'] / 1000
+        )
+
+    @property
+    def ollama(self):
+        return get_async_upstream_client('ollama')
+
+    @property
+    def deepseek(self):
+        return get_async_upstream_client('deepseek')
+
+    async def route_request(self, model, messages, temperature, max_tokens, stream, session=None):
+        decision, local_model = self.choose_backend(model, messages, max_tokens)
+        if decision.backend == 'ollama' and self.hedging:
+            return await self.hedged(local_model, model, messages, temperature, max_tokens, stream, session)
+        return await self.dispatch(decision, local_model, model, messages, temperature, max_tokens, stream, session)
+
+    async def dispatch(self, decision, local_model, model, messages, temperature, max_tokens, stream, session=None):
+        if decision.backend == 'ollama':
+            logging.info(f"Modelo local → Ollama ({local_model})")
+            return await self.call_ollama(local_model, messages, temperature, max_tokens, stream, session)
+
+        logging.info(f"{decision.reason} → DeepSeek")
+        return await self.call_deepseek(model, messages, temperature, max_tokens, stream)
+
+    async def hedged(self, local_model, model, messages, temperature, max_tokens, stream, session=None):
+        """Igual que AIRouter.hedged; la rama perdedora se cancela como tarea (corta la conexión)"""
+        async def ollama(leg):
+            events = await self.call_ollama(local_model, messages, temperature, max_tokens, True, session,
+                                            fallback=False, include_usage=not stream)
+            buffered = await prefetch_async(events, 2)
+            leg.first_token()
+            if stream:
+                return AsyncPrefetchedStream(buffered, events)
+            async for event in events:
+                buffered.append(event)
+            return completion_from_chunks(buffered)
+
+        async def deepseek(leg):
+            result = await self.fallback_to_deepseek(model, messages, temperature, max_tokens, stream)
+            if not stream:
+                return result
+            buffered = await prefetch_async(result, 1)
+            leg.first_token()
+            return AsyncPrefetchedStream(buffered, result)
+
+        return await self.hedging.run_async(ollama, deepseek, self.health['deepseek'].allow_request)
+
+    async def fallback_to_deepseek(self, model, messages, temperature, max_tokens, stream):
+        if not self.health['deepseek'].allow_request():
+            raise BackendUnavailable('deepseek', self.health['deepseek'].retry_after())
+        logging.info(f"Fallback → DeepSeek")
+        return await self.call_deepseek(model, messages, temperature, max_tokens, stream)
+
+    async def call_ollama(self, model, messages, temperature, max_tokens, stream, session=None,
+                          fallback=True, include_usage=False):
+        payload = self._ollama_payload(model, messages, temperature, max_tokens, stream)
+
+        # Turno en la cola de admisión antes de elegir nodo (la carga cambia mientras se espera)
+        try:
+            slot = await self.admission.acquire_async(current_priority.get()) if self.admission else None
+        except AdmissionTimeout as e:
+            logging.warning(f"Cola de Ollama: {e}")
+            if not fallback:
+                raise
+            return await self.fallback_to_deepseek(model, messages, temperature, max_tokens, stream)
+
+        node = self.pool.pick(model, affinity_key(messages, session))
+        if node is None:
+            self._release(None, slot)
+            logging.warning(f"Ningún nodo Ollama disponible con {model}")
+            if not fallback:
+                raise Exception(f"Ningún nodo Ollama disponible con {model}")
+            return await self.fallback_to_deepseek(model, messages, temperature, max_tokens, stream)
+
+        health = self.health['ollama'].node(node)
+        token = health.begin()
+        call = UpstreamCall('ollama', model)
+        self.pool.begin(node)
+        try:
+            response = await self.ollama.post(f"{node}/api/chat", content=dumps(payload), headers=JSON_HEADERS, stream=stream)
+        except asyncio.CancelledError:
+            # Rama perdedora de un hedge o cliente desconectado antes de la respuesta
+            health.cancel(token)
+            call.finish('cancelled')
+            self._release(node, slot)
+            raise
+        except Exception as e:
+            health.end(token, ok=False)
+            call.finish('error')
+            self._release(node, slot)
+            self.models.mark_down(node)
+            logging.warning(f"Ollama error ({node}): {e}")
+            if not fallback:
+                raise
+            return await self.fallback_to_deepseek(model, messages, temperature, max_tokens, stream)
+
+        if response.status_code == 200:
+            self.models.mark_loaded(node, model)
+            if stream:
+                return track_async_stream(
+                    self._stream_from_ollama(response, model, call, include_usage),
+                    stream_closer(health, token, call, lambda: self._release(node, slot))
+                )
+            try:
+                result = loads(response.content)
+            finally:
+                self._release(node, slot)
+            health.end(token, ok=True)
+            call.finish(200)
+            self._observe_ollama(result, model)
+            return self._convert_from_ollama(result, model)
+        else:
+            await response.aclose()
+            self._release(node, slot)
+            health.end(token, ok=not is_backend_failure(response.status_code))
+            call.finish(response.status_code)
+            if response.status_code == 404:
+                self.models.invalidate()
+            if not fallback:
+                raise Exception(f"Ollama API error: {response.status_code}")
+            return await self.fallback_to_deepseek(model, messages, temperature, max_tokens, stream)
+
+    async def embed_text(self, text, model=None):
+        local_model = self.resolve_embedding_model(model)
+        if local_model is None:
+            raise Exception(f"Modelo de embeddings no disponible: {model or self.config['EMBEDDING_MODEL']}")
+        vectors, _ = await self.embed(local_model, [text])
+        return vectors[0]
+
+    async def embed(self, model, inputs, dimensions=None):
+        vectors, tokens = await self.embeddings.embed_many(model, inputs, dimensions)
+        get_usage_recorder().record('ollama', model, tokens, 0)
+        return vectors, tokens
+
+    async def _embed_batch(self, model, inputs, dimensions=None):
+        self._embed_allowed()
+        try:
+            slot = await self.admission.acquire_async(current_priority.get()) if self.admission else None
+        except AdmissionTimeout as e:
+            raise self._embed_unavailable(e)
+        try:
+            node, payload = self._embed_target(model, inputs, dimensions)
+        except Exception:
+            self._release(None, slot)
+            raise
+        health = self.health['ollama'].node(node)
+        token = health.begin()
+        call = UpstreamCall('ollama', model)
+        try:
+            response = await self.ollama.post(f"{node}/api/embed", content=dumps(payload), headers=JSON_HEADERS)
+        except Exception:
+            health.end(token, ok=False)
+            call.finish('error')
+            self.models.mark_down(node)
+            raise
+        finally:
+            self._release(node, slot)
+        return self._embed_result(response.status_code, response.content, health, token, call)
+
+    async def call_deepseek(self, model, messages, temperature, max_tokens, stream):
+        payload = {
+            "model": "deepseek-chat",
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": stream
+        }
+        if stream:
+            payload["stream_options"] = {"include_usage": True}
+        headers = {"Authorization": f"Bearer {self.deepseek_key}", "Content-Type": "application/json"}
+        health = self.health['deepseek']
+        token = health.begin()
+        call = UpstreamCall('deepseek', payload['model'])
+        try:
+            response = await self.deepseek.post(self.deepseek_url, content=dumps(payload), headers=headers, stream=stream)
+        except asyncio.CancelledError:
+            health.cancel(token)
+            call.finish('cancelled')
+            raise
+        except Exception:
+            health.end(token, ok=False)
+            call.finish('error')
+            raise
+
+        if response.status_code == 200:
+            if stream:
+                return track_async_stream(self._stream_from_deepseek(response, call), stream_closer(health, token, call))
+            result = RawCompletion(response.content)
+            health.end(token, ok=True)
+            call.finish(200)
+            self._observe_deepseek(result, messages, time.monotonic() - token[0])
+            return result
+        else:
+            await response.aclose()
+            health.end(token, ok=not is_backend_failure(response.status_code))
+            call.finish(response.status_code)
+            raise Exception(f"DeepSeek API error: {response.status_code}")
+
+    async def _stream_from_ollama(self, response, original_model, call=None, include_usage=False):
+        converter = OllamaChunkConverter(original_model)
+        try:
+            yield converter.start()
+            async for line in response.aiter_lines():
+                events = converter.convert(line)
+                if events and call:
+                    call.first_token()
+                for event in events:
+                    yield event
+                if converter.done:
+                    break
+            if converter.final:
+                self._observe_ollama(converter.final, call.model if call else None)
+                if include_usage:
+                    yield converter.usage()
+            yield SSE_DONE
+        finally:
+            await response.aclose()
+
+    async def _stream_from_deepseek(self, response, call=None):
+        try:
+            async for line in response.aiter_lines():
+                if line:
+                    if call:
+                        call.first_token()
+                    if '"usage"' in line and line.startswith('data: {'):
+                        chunk = self._usage_chunk(line[len('data: '):])
+                        if chunk:
+                            self._observe_deepseek(chunk, [], time.monotonic() - call.started if call else 0)
+                            if not chunk.get('choices'):
+                                continue
+                    # httpx solo da líneas como str: el evento sale en bytes como en el resto de streams
+                    yield line.encode('utf-8') + b"\n\n"
+        finally:
+            await response.aclose()
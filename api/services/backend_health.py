@@ -0,0 +1,279 @@
+# Backend Health - Latencia, errores y circuit breaker por backend (y por nodo en Ollama)
+import threading
+import time
+
+from config.settings import load_config
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+def is_backend_failure(status_code):
+    """Errores atribuibles al backend (no a la petición) para el circuit breaker"""
+    return status_code >= 500 or status_code == 429
+
+
+class BackendUnavailable(Exception):
+    """No hay backend disponible para atender la petición (circuito abierto)"""
+
+    def __init__(self, backend, retry_after):
+        super().__init__(f"{backend} temporalmente no disponible")
+        self.backend = backend
+        self.retry_after = retry_after
+
+
+class BackendHealth:
+    """Salud observada de un backend con circuit breaker
+
+    - closed: tráfico normal; se abre si la tasa de error (EWMA) supera el umbral
+      con suficientes muestras o tras varios fallos consecutivos.
+    - open: el router lo salta durante open_seconds.
+    - half_open: deja pasar unas pocas peticiones de prueba; un éxito lo cierra
+      y un fallo lo vuelve a abrir.
+
+    Las sondas de health_prober también cuentan: si fallan el circuito se abre
+    sin esperar a que falle una petición, y mientras sigan fallando no se
+    reintenta; cuando vuelven a responder pasa a half_open sin esperar open_seconds.
+    """
+
+    def __init__(self, name, concurrency=4, error_threshold=0.5, min_samples=5,
+                 consecutive_failures=3, open_seconds=30, half_open_probes=1, alpha=0.2):
+        self.name = name
+        self.concurrency = concurrency
+        self.error_threshold = error_threshold
+        self.min_samples = min_samples
+        self.consecutive_failures = consecutive_failures
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.alpha = alpha
+
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.latency = None
+        self.error_rate = 0.0
+        self.samples = 0
+        self.failures_in_row = 0
+        self.in_flight = 0
+        self.probes_in_flight = 0
+        self.trips = 0
+        self.probe_down = False
+
+    def _maybe_half_open(self, now):
+        if self.state == OPEN and now - self.opened_at >= self.open_seconds:
+            self.state = HALF_OPEN
+            self.probes_in_flight = 0
+
+    def allow_request(self):
+        with self._lock:
+            self._maybe_half_open(time.monotonic())
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN:
+                return self.probes_in_flight < self.half_open_probes
+            return False
+
+    def retry_after(self):
+        with self._lock:
+            if self.state != OPEN:
+                return 1
+            return max(1, int(self.opened_at + self.open_seconds - time.monotonic()) + 1)
+
+    def begin(self):
+        """Marca el inicio de una petición; devuelve el token para end()"""
+        with self._lock:
+            self.in_flight += 1
+            probe = self.state == HALF_OPEN
+            if probe:
+                self.probes_in_flight += 1
+        return (time.monotonic(), probe)
+
+    def cancel(self, token):
+        """Petición abandonada por el gateway (perdedora de un hedge): no cuenta ni como éxito ni como fallo"""
+        _, probe = token
+        with self._lock:
+            self.in_flight -= 1
+            if probe and self.state == HALF_OPEN:
+                self.probes_in_flight -= 1
+
+    def end(self, token, ok):
+        started, probe = token
+        now = time.monotonic()
+        with self._lock:
+            self.in_flight -= 1
+            was_probe = probe and self.state == HALF_OPEN
+            if was_probe:
+                self.probes_in_flight -= 1
+
+            self.samples += 1
+            self.error_rate += self.alpha * ((0.0 if ok else 1.0) - self.error_rate)
+            if ok:
+                elapsed = now - started
+                self.latency = elapsed if self.latency is None else self.latency + self.alpha * (elapsed - self.latency)
+                self.failures_in_row = 0
+                if was_probe:
+                    self._close()
+            else:
+                self.failures_in_row += 1
+                if was_probe or self._should_trip():
+                    self._open(now)
+
+    def _should_trip(self):
+        if self.state != CLOSED:
+            return False
+        if self.failures_in_row >= self.consecutive_failures:
+            return True
+        return self.samples >= self.min_samples and self.error_rate >= self.error_threshold
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+        self.trips += 1
+
+    def _close(self):
+        self.state = CLOSED
+        self.error_rate = 0.0
+        self.failures_in_row = 0
+
+    def probe(self, ok):
+        """Resultado de una sonda activa del backend (no es una petición: no cuenta en la tasa de error)"""
+        now = time.monotonic()
+        with self._lock:
+            if not ok:
+                if self.state == OPEN:
+                    self.opened_at = now
+                else:
+                    self._open(now)
+                self.probe_down = True
+            elif self.probe_down:
+                self.probe_down = False
+                if self.state == OPEN:
+                    # Solo se adelanta la reapertura de un circuito que abrieron las sondas
+                    self.state = HALF_OPEN
+                    self.probes_in_flight = 0
+
+    def current_state(self):
+        with self._lock:
+            self._maybe_half_open(time.monotonic())
+            return self.state
+
+    def load(self):
+        """(peticiones en curso, latencia EWMA)"""
+        with self._lock:
+            return self.in_flight, self.latency
+
+    def queue_delay(self):
+        """Espera estimada por peticiones ya en curso por encima de la concurrencia del backend"""
+        return _queue_delay(*self.load(), self.concurrency)
+
+    def snapshot(self):
+        with self._lock:
+            self._maybe_half_open(time.monotonic())
+            return {
+                "state": self.state,
+                "latency": round(self.latency, 3) if self.latency is not None else None,
+                "error_rate": round(self.error_rate, 3),
+                "in_flight": self.in_flight,
+                "samples": self.samples,
+                "trips": self.trips,
+                "probe_down": self.probe_down
+            }
+
+
+def _queue_delay(in_flight, latency, concurrency):
+    if latency is None or in_flight < concurrency:
+        return 0.0
+    return (in_flight - concurrency + 1) / concurrency * latency
+
+
+class BackendNodes:
+    """Backend repartido en nodos (Ollama): un circuit breaker por nodo
+
+    Un nodo que devuelve 5xx/429 o no contesta abre solo su circuito: el pool
+    deja de elegirlo y el resto sigue atendiendo. El backend cuenta como
+    abierto únicamente cuando lo están todos sus nodos. `concurrency` es la
+    del backend entero (suma de los nodos), como en BackendHealth.
+    """
+
+    def __init__(self, name, concurrency=4, **circuit):
+        self.name = name
+        self.concurrency = concurrency
+        self.circuit = circuit
+        self._lock = threading.Lock()
+        self._nodes = {}
+
+    def node(self, url):
+        """BackendHealth del nodo (se crea al verlo por primera vez)"""
+        with self._lock:
+            health = self._nodes.get(url)
+            if health is None:
+                health = self._nodes[url] = BackendHealth(f"{self.name}:{url}", concurrency=self.concurrency,
+                                                          **self.circuit)
+            return health
+
+    def _nodes_list(self):
+        with self._lock:
+            return list(self._nodes.values())
+
+    @property
+    def state(self):
+        states = {node.current_state() for node in self._nodes_list()}
+        if not states or CLOSED in states:
+            return CLOSED
+        return HALF_OPEN if HALF_OPEN in states else OPEN
+
+    def allow_request(self):
+        nodes = self._nodes_list()
+        return not nodes or any(node.allow_request() for node in nodes)
+
+    def retry_after(self):
+        nodes = self._nodes_list()
+        return min(node.retry_after() for node in nodes) if nodes else 1
+
+    def queue_delay(self):
+        loads = [node.load() for node in self._nodes_list()]
+        latencies = [latency for _, latency in loads if latency is not None]
+        latency = sum(latencies) / len(latencies) if latencies else None
+        return _queue_delay(sum(in_flight for in_flight, _ in loads), latency, self.concurrency)
+
+    def snapshot(self):
+        with self._lock:
+            nodes = dict(self._nodes)
+        snapshots = {url: health.snapshot() for url, health in nodes.items()}
+        return {
+            "state": self.state,
+            "in_flight": sum(node["in_flight"] for node in snapshots.values()),
+            "trips": sum(node["trips"] for node in snapshots.values()),
+            "nodes": snapshots
+        }
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+# Backends con un circuito por nodo
+NODE_BACKENDS = ('ollama',)
+
+
+def get_backend_health(name):
+    """BackendHealth del backend; BackendNodes para los de NODE_BACKENDS"""
+    with _backends_lock:
+        if name not in _backends:
+            config = load_config()
+            kind = BackendNodes if name in NODE_BACKENDS else BackendHealth
+            _backends[name] = kind(
+                name,
+                concurrency=config[f'{name.upper()}_CONCURRENCY'],
+                error_threshold=config['CIRCUIT_ERROR_THRESHOLD'],
+                min_samples=config['CIRCUIT_MIN_SAMPLES'],
+                consecutive_failures=config['CIRCUIT_CONSECUTIVE_FAILURES'],
+                open_seconds=config['CIRCUIT_OPEN_SECONDS']
+            )
+        return _backends[name]
+
+
+def backend_health_stats():
+    with _backends_lock:
+        backends = dict(_backends)
+    return {name: health.snapshot() for name, health in backends.items()}
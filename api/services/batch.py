@@ -0,0 +1,229 @@
+# Batch - Varias completions en paralelo con concurrencia acotada por backend
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from api.services.backend_health import BackendUnavailable
+from api.services.cancellation import RequestAborted
+from config.settings import load_config
+
+BACKENDS = ('ollama', 'deepseek')
+
+
+def parse_batch(data, max_items):
+    """Normaliza el cuerpo de POST /v1/chat/batch
+
+    {"model": ..., "temperature": ..., "max_tokens": ..., "requests": [{"messages": [...]}, ...]}
+    Los parámetros de nivel superior son valores por defecto para cada elemento.
+    Lanza ValueError con el mensaje para el 400.
+    """
+    if not data:
+        raise ValueError("No input data provided")
+    items = data.get('requests')
+    if not isinstance(items, list) or not items:
+        raise ValueError("Missing 'requests' parameter")
+    if len(items) > max_items:
+        raise ValueError(f"Too many requests in batch (max {max_items})")
+
+    requests = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or 'messages' not in item:
+            raise ValueError(f"Missing 'messages' parameter in request {index}")
+        model = item.get('model', data.get('model'))
+        if not model:
+            raise ValueError(f"Missing 'model' parameter in request {index}")
+        requests.append({
+            "model": model,
+            "messages": item['messages'],
+            "temperature": item.get('temperature', data.get('temperature', 0.7)),
+            "max_tokens": item.get('max_tokens', data.get('max_tokens', 2000))
+        })
+    return requests
+
+
+def max_item_tokens(requests):
+    """El mayor max_tokens numérico del lote (plazo de la petición)"""
+    return max((item['max_tokens'] for item in requests
+                if isinstance(item['max_tokens'], (int, float)) and not isinstance(item['max_tokens'], bool)), default=0)
+
+
+def parse_choices(data, max_items):
+    """Valida el parámetro n de OpenAI; lanza ValueError con el mensaje para el 400"""
+    n = data.get('n', 1) if data else 1
+    if isinstance(n, bool) or not isinstance(n, int) or n < 1 or n > max_items:
+        raise ValueError(f"'n' must be an integer between 1 and {max_items}")
+    if n > 1 and data.get('stream'):
+        raise ValueError("'n' > 1 is not supported with stream")
+    return n
+
+
+def item_result(index, outcome):
+    """Elemento de la respuesta del lote: la completion o su error"""
+    if isinstance(outcome, BackendUnavailable):
+        return {"index": index, "status": 503, "error": {
+            "message": str(outcome), "type": "service_unavailable", "retry_after": outcome.retry_after
+        }}
+    if isinstance(outcome, RequestAborted):
+        return {"index": index, "status": outcome.status, "error": {"message": str(outcome), "type": outcome.reason}}
+    if isinstance(outcome, BaseException):
+        return {"index": index, "status": 500, "error": {"message": str(outcome), "type": "upstream_error"}}
+    return {"index": index, "status": 200, "response": outcome}
+
+
+def batch_response(outcomes):
+    results = [item_result(index, outcome) for index, outcome in enumerate(outcomes)]
+    failed = sum(1 for r in results if r["status"] != 200)
+    return {"object": "batch", "data": results, "succeeded": len(results) - failed, "failed": failed}
+
+
+def merge_choices(responses):
+    """Une n respuestas de una sola choice en una respuesta con n choices y el uso sumado"""
+    merged = dict(responses[0])
+    merged["choices"] = []
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    for index, response in enumerate(responses):
+        for choice in response.get("choices", [])[:1]:
+            merged["choices"].append({**choice, "index": index})
+        for name in usage:
+            usage[name] += (response.get("usage") or {}).get(name, 0)
+    merged["usage"] = usage
+    return merged
+
+
+def replicate_choices(response, n):
+    """temperature 0: las n choices serían idénticas, basta una llamada upstream"""
+    choice = response["choices"][0]
+    return {**response, "choices": [{**choice, "index": index} for index in range(n)]}
+
+
+def first_error(outcomes):
+    return next((o for o in outcomes if isinstance(o, BaseException)), None)
+
+
+class BatchExecutor:
+    """Lanza completions en paralelo con un pool de hilos por backend
+
+    Cada pool tiene tantos hilos como generaciones simultáneas admite su backend
+    (OLLAMA_CONCURRENCY, DEEPSEEK_CONCURRENCY) y se comparte entre todos los
+    lotes del proceso: un lote grande para Ollama no retrasa a los elementos
+    que van a DeepSeek ni satura la GPU.
+    """
+
+    def __init__(self, router, limits):
+        self.router = router
+        self.limits = dict(limits)
+        self._pools = {
+            name: ThreadPoolExecutor(max_workers=limit, thread_name_prefix=f"batch-{name}")
+            for name, limit in self.limits.items()
+        }
+        self._lock = threading.Lock()
+        self._counters = {name: {"queued": 0, "running": 0, "completed": 0, "failed": 0} for name in self.limits}
+
+    def _run(self, decision, local_model, request):
+        counters = self._counters[decision.backend]
+        with self._lock:
+            counters["queued"] -= 1
+            counters["running"] += 1
+        ok = False
+        try:
+            result = self.router.dispatch(decision, local_model, stream=False, **request)
+            ok = True
+            return result
+        finally:
+            with self._lock:
+                counters["running"] -= 1
+                counters["completed" if ok else "failed"] += 1
+
+    def submit(self, request):
+        """Decide el backend ya y encola en su pool; devuelve un Future"""
+        decision, local_model = self.router.choose_backend(request['model'], request['messages'], request['max_tokens'])
+        with self._lock:
+            self._counters[decision.backend]["queued"] += 1
+        # Copia del contexto: el uso se atribuye a la key de la petición del lote
+        context = contextvars.copy_context()
+        return self._pools[decision.backend].submit(context.run, self._run, decision, local_model, request)
+
+    def run(self, requests):
+        """Resultados en el orden de entrada: la respuesta o la excepción de cada elemento"""
+        futures = []
+        for request in requests:
+            try:
+                futures.append(self.submit(request))
+            except Exception as e:
+                futures.append(e)
+        outcomes = []
+        for future in futures:
+            if isinstance(future, Exception):
+                outcomes.append(future)
+                continue
+            try:
+                outcomes.append(future.result())
+            except Exception as e:
+                outcomes.append(e)
+        return outcomes
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: {"concurrency": self.limits[name], **counters}
+                for name, counters in self._counters.items()
+            }
+
+
+class AsyncBatchExecutor:
+    """Equivalente asyncio: un semáforo por backend en lugar de un pool de hilos"""
+
+    def __init__(self, router, limits):
+        self.router = router
+        self.limits = dict(limits)
+        self._slots = {name: asyncio.Semaphore(limit) for name, limit in self.limits.items()}
+        self._counters = {name: {"queued": 0, "running": 0, "completed": 0, "failed": 0} for name in self.limits}
+
+    async def _run(self, request):
+        decision, local_model = self.router.choose_backend(request['model'], request['messages'], request['max_tokens'])
+        counters = self._counters[decision.backend]
+        counters["queued"] += 1
+        async with self._slots[decision.backend]:
+            counters["queued"] -= 1
+            counters["running"] += 1
+            ok = False
+            try:
+                result = await self.router.dispatch(decision, local_model, stream=False, **request)
+                ok = True
+                return result
+            finally:
+                counters["running"] -= 1
+                counters["completed" if ok else "failed"] += 1
+
+    async def run(self, requests):
+        return await asyncio.gather(*(self._run(request) for request in requests), return_exceptions=True)
+
+    def stats(self):
+        return {name: {"concurrency": self.limits[name], **counters} for name, counters in self._counters.items()}
+
+
+def backend_limits(config):
+    return {name: config[f'{name.upper()}_CONCURRENCY'] for name in BACKENDS}
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_batch_executor(router):
+    """BatchExecutor compartido por proceso (los hilos no sobreviven a un fork)"""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = BatchExecutor(router, backend_limits(load_config()))
+            _executor_pid = os.getpid()
+    return _executor
+
+
+def batch_stats():
+    with _executor_lock:
+        executor = _executor if _executor_pid == os.getpid() else None
+    return executor.stats() if executor else None
@@ -0,0 +1,137 @@
+# Completion Cache - Respuestas de peticiones deterministas (LRU + TTL, Redis opcional)
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from config.settings import load_config
+
+
+def is_deterministic(temperature):
+    try:
+        return float(temperature) == 0
+    except (TypeError, ValueError):
+        return False
+
+
+class CompletionCache:
+    """Caché en proceso con expulsión LRU/TTL y segundo nivel opcional en Redis"""
+
+    def __init__(self, max_entries=1000, ttl=3600, redis_url='', prefix='uaa:completion:'):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.prefix = prefix
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._counters = {"hits": 0, "redis_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "redis_errors": 0}
+
+        self.redis = None
+        if redis_url:
+            import redis
+            self.redis = redis.Redis.from_url(redis_url, socket_timeout=0.1, socket_connect_timeout=0.1)
+
+    @staticmethod
+    def is_cacheable(temperature, stream=False):
+        """Solo las peticiones deterministas (temperature 0) y sin streaming"""
+        return not stream and is_deterministic(temperature)
+
+    @staticmethod
+    def make_key(model, messages, temperature, max_tokens):
+        """Hash canónico de los parámetros que determinan la respuesta"""
+        canonical = json.dumps(
+            {"model": model, "messages": messages, "temperature": float(temperature), "max_tokens": max_tokens},
+            sort_keys=True, separators=(',', ':'), ensure_ascii=False
+        )
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._counters["hits"] += 1
+                    return value
+                del self._entries[key]
+
+        if self.redis is not None:
+            try:
+                raw = self.redis.get(self.prefix + key)
+            except Exception as e:
+                logging.warning(f"Redis cache no disponible: {e}")
+                self._count("redis_errors")
+                raw = None
+            if raw is not None:
+                value = json.loads(raw)
+                self._store_local(key, value, now)
+                self._count("redis_hits")
+                return value
+
+        self._count("misses")
+        return None
+
+    def _store_local(self, key, value, now):
+        with self._lock:
+            self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def set(self, key, value):
+        self._store_local(key, value, time.time())
+        self._count("stores")
+        if self.redis is not None:
+            try:
+                self.redis.setex(self.prefix + key, self.ttl, json.dumps(value, ensure_ascii=False))
+            except Exception as e:
+                logging.warning(f"Redis cache no disponible: {e}")
+                self._count("redis_errors")
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            entries = len(self._entries)
+        lookups = counters["hits"] + counters["redis_hits"] + counters["misses"]
+        return {
+            **counters,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "redis": self.redis is not None,
+            "hit_rate": round((counters["hits"] + counters["redis_hits"]) / lookups, 4) if lookups else 0.0
+        }
+
+
+def is_cache_bypassed(headers):
+    """Cabecera X-Cache-Bypass: true fuerza una respuesta nueva"""
+    return headers.get('X-Cache-Bypass', '').lower() in ('1', 'true', 'yes')
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_completion_cache():
+    """Caché compartida por proceso; None si CACHE_ENABLED=false"""
+    global _cache
+    config = load_config()
+    if not config['CACHE_ENABLED']:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = CompletionCache(
+                max_entries=config['CACHE_MAX_ENTRIES'],
+                ttl=config['CACHE_TTL'],
+                redis_url=config['CACHE_REDIS_URL']
+            )
+    return _cache
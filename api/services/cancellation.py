@@ -0,0 +1,319 @@
+# Cancellation - Plazo por petición y corte del upstream cuando el cliente se desconecta
+import asyncio
+import contextvars
+import select
+import socket
+import threading
+import time
+
+from api.services.metrics import request_aborts
+from api.services.streaming import sse
+from config.settings import load_config
+
+# Ámbito de la petición en curso; lo consultan la cola de admisión y las llamadas upstream
+current_scope = contextvars.ContextVar('current_scope', default=None)
+
+
+class RequestAborted(Exception):
+    """La petición se abandona antes de terminar; el upstream ya se cerró"""
+
+    status = 500
+    reason = 'aborted'
+
+
+class RequestCancelled(RequestAborted):
+    """El cliente cerró la conexión: nadie va a leer la respuesta"""
+
+    status = 499
+    reason = 'disconnect'
+
+
+class DeadlineExceeded(RequestAborted):
+    """La petición superó su plazo (base + max_tokens a la velocidad mínima aceptable)"""
+
+    status = 504
+    reason = 'deadline'
+
+
+def socket_probe(environ):
+    """Función que dice si el cliente WSGI cerró su conexión (None si el servidor no expone el socket)
+
+    Mira el socket sin consumir nada: legible y con recv vacío significa que
+    llegó el FIN del cliente. werkzeug y gunicorn dejan el socket en el environ.
+    """
+    sock = environ.get('werkzeug.socket') or environ.get('gunicorn.socket')
+    if sock is None:
+        return None
+
+    def disconnected():
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            if not readable:
+                return False
+            return sock.recv(1, socket.MSG_PEEK) == b''
+        except (ValueError, OSError):
+            # Socket ya cerrado por el servidor o sin soporte para MSG_PEEK (TLS)
+            return sock.fileno() == -1
+    return disconnected
+
+
+async def wait_for_disconnect(receive):
+    """Termina cuando el servidor ASGI avisa de que el cliente se fue (cuerpo ya leído)"""
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+class RequestScope:
+    """Plazo de una petición y sonda de desconexión de su cliente
+
+    check() lanza RequestCancelled o DeadlineExceeded; la sonda es una
+    llamada al sistema, así que se consulta como mucho cada `interval` segundos.
+    """
+
+    __slots__ = ('deadlines', 'budget', 'deadline', 'probe', 'interval', '_checked', '_gone')
+
+    def __init__(self, deadlines, budget=None, probe=None, interval=0.25, deadline=None):
+        self.deadlines = deadlines
+        self.budget = budget
+        self.deadline = deadline if deadline is not None or budget is None else time.monotonic() + budget
+        self.probe = probe
+        self.interval = interval
+        self._checked = 0.0
+        self._gone = False
+
+    def remaining(self):
+        """Segundos hasta el plazo (None sin plazo)"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def disconnected(self):
+        if self._gone:
+            return True
+        if self.probe is None:
+            return False
+        now = time.monotonic()
+        if now - self._checked < self.interval:
+            return False
+        self._checked = now
+        self._gone = self.probe()
+        return self._gone
+
+    def deadline_error(self):
+        return DeadlineExceeded(f"Request deadline exceeded ({self.budget:.0f}s)")
+
+    def abort_reason(self):
+        """RequestCancelled / DeadlineExceeded si hay que dejar la petición, o None"""
+        if self.disconnected():
+            return RequestCancelled("Client disconnected")
+        if self.expired():
+            return self.deadline_error()
+        return None
+
+    def check(self, stage='upstream'):
+        error = self.abort_reason()
+        if error is not None:
+            self.deadlines.count(error, stage)
+            raise error
+
+    def timeout(self, default):
+        """Timeout de lectura upstream: el menor entre `default` y lo que queda de plazo"""
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        if remaining <= 0:
+            self.check()
+        return min(default, remaining) if default else remaining
+
+    def shared(self):
+        """Mismo plazo sin sonda: para llamadas que comparten varios clientes (coalescencia)"""
+        return RequestScope(self.deadlines, self.budget, None, self.interval, self.deadline)
+
+    def guard(self, stream):
+        """Reenvía un stream mientras el cliente siga conectado y quede plazo
+
+        Si el cliente se va el upstream se cancela (no cuenta como fallo del
+        backend); si vence el plazo el cliente recibe un evento de error.
+        """
+        try:
+            for event in stream:
+                error = self.abort_reason()
+                if error is not None:
+                    self.deadlines.count(error, 'stream')
+                    _cancel(stream)
+                    if isinstance(error, DeadlineExceeded):
+                        yield _error_event(error)
+                    return
+                yield event
+        except GeneratorExit:
+            # El servidor WSGI no pudo escribir: el cliente ya no está
+            self.deadlines.count(RequestCancelled(), 'stream')
+            _cancel(stream)
+            raise
+        finally:
+            close = getattr(stream, 'close', None)
+            if close:
+                close()
+
+    async def run(self, awaitable, receive=None):
+        """Espera awaitable; lo cancela (y con él la petición httpx) si el cliente se va o vence el plazo"""
+        task = asyncio.ensure_future(awaitable)
+        watcher = asyncio.ensure_future(wait_for_disconnect(receive)) if receive else None
+        try:
+            done, _ = await asyncio.wait([t for t in (task, watcher) if t], timeout=self.remaining(),
+                                         return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            if watcher:
+                watcher.cancel()
+        if task in done:
+            return task.result()
+        task.cancel()
+        try:
+            # La cancelación libera nodo, turno de admisión y conexión upstream
+            await task
+        except (asyncio.CancelledError, Exception):
+            pass
+        if watcher in done:
+            self._gone = True
+            error = RequestCancelled("Client disconnected")
+        else:
+            error = self.deadline_error()
+        self.deadlines.count(error, 'upstream')
+        raise error
+
+    async def guard_async(self, stream, receive=None):
+        """Equivalente asíncrono de guard(): la espera de cada evento compite con la desconexión y el plazo"""
+        watcher = asyncio.ensure_future(wait_for_disconnect(receive)) if receive else None
+        step = None
+        finished = False
+        try:
+            while True:
+                step = asyncio.ensure_future(stream.__anext__())
+                done, _ = await asyncio.wait([t for t in (step, watcher) if t], timeout=self.remaining(),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if step in done:
+                    try:
+                        event = step.result()
+                    except StopAsyncIteration:
+                        finished = True
+                        return
+                    step = None
+                    yield event
+                    continue
+                finished = True
+                if watcher in done:
+                    self._gone = True
+                    self.deadlines.count(RequestCancelled(), 'stream')
+                    return
+                error = self.deadline_error()
+                self.deadlines.count(error, 'stream')
+                yield _error_event(error)
+                return
+        finally:
+            if not finished:
+                # El servidor cerró la respuesta antes: el cliente ya no está
+                self.deadlines.count(RequestCancelled(), 'stream')
+            if watcher:
+                watcher.cancel()
+            # En su propia tarea: Starlette cancela la respuesta al detectar la desconexión
+            # y sin shield el cierre del upstream se interrumpiría a medias
+            await asyncio.shield(asyncio.ensure_future(_close_async(step, stream)))
+
+
+async def _close_async(step, stream):
+    if step is not None and not step.done():
+        # Cancelar la espera corta la petición httpx en curso
+        step.cancel()
+        try:
+            await step
+        except (asyncio.CancelledError, StopAsyncIteration, Exception):
+            pass
+    await stream.aclose()
+
+
+def _cancel(stream):
+    cancel = getattr(stream, 'cancel', None) or getattr(stream, 'close', None)
+    if cancel:
+        cancel()
+
+
+def _error_event(error):
+    return sse({"error": {"message": str(error), "type": "timeout"}})
+
+
+class RequestDeadlines:
+    """Plazos por petición según max_tokens y contadores de peticiones abandonadas
+
+    plazo = base + max_tokens / tokens_per_second, como mucho `maximum`
+    (base 0 = sin plazo). Con cancel_on_disconnect el gateway vigila el socket
+    del cliente y corta el upstream en cuanto se va.
+    """
+
+    def __init__(self, base=30, tokens_per_second=5, maximum=600, cancel_on_disconnect=True, interval=0.25):
+        self.base = base
+        self.tokens_per_second = tokens_per_second
+        self.maximum = maximum
+        self.cancel_on_disconnect = cancel_on_disconnect
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._counters = {"requests": 0, "disconnect": 0, "deadline": 0}
+
+    def budget(self, max_tokens):
+        """Segundos de plazo para una petición de `max_tokens` (None = sin plazo)"""
+        if not self.base:
+            return None
+        tokens = max_tokens if isinstance(max_tokens, (int, float)) and max_tokens > 0 else 0
+        seconds = self.base + (tokens / self.tokens_per_second if self.tokens_per_second else 0)
+        return min(seconds, self.maximum) if self.maximum else seconds
+
+    def begin(self, max_tokens, probe=None):
+        """Ámbito de la petición actual (contextvar); probe dice si el cliente se fue"""
+        scope = RequestScope(self, self.budget(max_tokens), probe if self.cancel_on_disconnect else None, self.interval)
+        current_scope.set(scope)
+        with self._lock:
+            self._counters["requests"] += 1
+        return scope
+
+    def count(self, error, stage):
+        with self._lock:
+            self._counters[error.reason] += 1
+        request_aborts.inc(reason=error.reason, stage=stage)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        return {
+            **counters,
+            "base": self.base,
+            "tokens_per_second": self.tokens_per_second,
+            "maximum": self.maximum,
+            "cancel_on_disconnect": self.cancel_on_disconnect
+        }
+
+
+_deadlines = None
+_deadlines_lock = threading.Lock()
+
+
+def get_request_deadlines():
+    """RequestDeadlines compartido por proceso"""
+    global _deadlines
+    with _deadlines_lock:
+        if _deadlines is None:
+            config = load_config()
+            _deadlines = RequestDeadlines(
+                base=config['REQUEST_DEADLINE_BASE'],
+                tokens_per_second=config['REQUEST_DEADLINE_TOKENS_PER_SECOND'],
+                maximum=config['REQUEST_DEADLINE_MAX'],
+                cancel_on_disconnect=config['CANCEL_ON_DISCONNECT'],
+                interval=config['DISCONNECT_CHECK_INTERVAL']
+            )
+    return _deadlines
@@ -0,0 +1,335 @@
+# Request Coalescing - Una sola llamada upstream para peticiones idénticas en curso
+import asyncio
+import contextvars
+import copy
+import threading
+
+from config.settings import load_config
+
+
+class _Call:
+    """Llamada en curso: el líder publica resultado o error y despierta a los seguidores"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class StreamBroadcast:
+    """Reparte un stream upstream entre varios clientes
+
+    Un hilo consume el stream del líder y guarda los eventos; cada suscriptor
+    los lee desde el principio, así que quien llega tarde recibe la respuesta
+    completa. Si todos los suscriptores se van, se corta el upstream.
+    """
+
+    def __init__(self, source, on_done):
+        self._source = source
+        self._on_done = on_done
+        self._cond = threading.Condition()
+        self._events = []
+        self._finished = False
+        self._error = None
+        self._subscribers = 0
+
+    def start(self):
+        # El hilo hereda el contexto del líder (key a la que se atribuye el uso)
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(self._pump,), name="stream-broadcast", daemon=True).start()
+
+    def _pump(self):
+        try:
+            for event in self._source:
+                with self._cond:
+                    if self._subscribers == 0:
+                        break
+                    self._events.append(event)
+                    self._cond.notify_all()
+        except Exception as e:
+            self._error = e
+        finally:
+            close = getattr(self._source, 'close', None)
+            if close:
+                close()
+            with self._cond:
+                self._finished = True
+                self._cond.notify_all()
+            self._on_done()
+
+    def subscribe(self):
+        with self._cond:
+            self._subscribers += 1
+        return self._iterate()
+
+    def _iterate(self):
+        index = 0
+        try:
+            while True:
+                with self._cond:
+                    while index >= len(self._events) and not self._finished:
+                        self._cond.wait()
+                    batch = self._events[index:]
+                    index = len(self._events)
+                    finished = self._finished
+                for event in batch:
+                    yield event
+                if finished and not batch:
+                    if self._error is not None:
+                        raise self._error
+                    return
+        finally:
+            with self._cond:
+                self._subscribers -= 1
+
+
+class SingleFlight:
+    """Coalescencia de peticiones deterministas idénticas (hilos / gevent)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._streams = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key, fn):
+        """Ejecuta fn una vez por clave en curso; devuelve (resultado, es_líder)"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            # Cada cliente recibe su copia (las rutas pueden modificar la respuesta)
+            return copy.deepcopy(call.result), False
+
+        try:
+            call.result = fn()
+            return call.result, True
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def do_stream(self, key, fn):
+        """Como do() pero fn devuelve un iterador SSE que se reparte entre todos"""
+        with self._lock:
+            entry = self._streams.get(key)
+            leader = entry is None
+            if leader:
+                entry = self._streams[key] = _Call()
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if not leader:
+            # Mientras el líder abre el upstream los seguidores esperan al broadcast
+            entry.event.wait()
+            if entry.error is not None:
+                raise entry.error
+            return entry.result.subscribe(), False
+
+        def done():
+            with self._lock:
+                if self._streams.get(key) is entry:
+                    del self._streams[key]
+
+        try:
+            source = fn()
+        except Exception as e:
+            entry.error = e
+            done()
+            entry.event.set()
+            raise
+
+        broadcast = StreamBroadcast(source, done)
+        subscription = broadcast.subscribe()
+        entry.result = broadcast
+        broadcast.start()
+        entry.event.set()
+        return subscription, True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "leaders": self.leaders,
+                "followers": self.followers,
+                "in_flight": len(self._calls) + len(self._streams)
+            }
+
+
+class AsyncStreamBroadcast:
+    """Equivalente asyncio de StreamBroadcast"""
+
+    def __init__(self, source, on_done):
+        self._source = source
+        self._on_done = on_done
+        self._cond = asyncio.Condition()
+        self._events = []
+        self._finished = False
+        self._error = None
+        self._subscribers = 0
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._pump())
+
+    async def _pump(self):
+        try:
+            async for event in self._source:
+                async with self._cond:
+                    if self._subscribers == 0:
+                        break
+                    self._events.append(event)
+                    self._cond.notify_all()
+        except Exception as e:
+            self._error = e
+        finally:
+            await self._source.aclose()
+            async with self._cond:
+                self._finished = True
+                self._cond.notify_all()
+            self._on_done()
+
+    def subscribe(self):
+        self._subscribers += 1
+        return self._iterate()
+
+    async def _iterate(self):
+        index = 0
+        try:
+            while True:
+                async with self._cond:
+                    await self._cond.wait_for(lambda: index < len(self._events) or self._finished)
+                    batch = self._events[index:]
+                    index = len(self._events)
+                    finished = self._finished
+                for event in batch:
+                    yield event
+                if finished and not batch:
+                    if self._error is not None:
+                        raise self._error
+                    return
+        finally:
+            self._subscribers -= 1
+
+
+def _leader_cancelled(future):
+    """El seguidor despertó por la cancelación del líder, no por la suya propia"""
+    task = asyncio.current_task()
+    return future.cancelled() and not (task is not None and task.cancelling())
+
+
+class AsyncSingleFlight:
+    """Coalescencia para el modo ASGI (un único event loop, sin locks)
+
+    Si el líder se cancela (su plazo vence o su cliente se va) los seguidores
+    no heredan la cancelación: el primero que despierta repite la llamada como
+    líder y el resto pasa a esperarle a él.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._streams = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key, fn):
+        while (future := self._calls.get(key)) is not None:
+            self.followers += 1
+            try:
+                result = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not _leader_cancelled(future):
+                    raise
+                self.followers -= 1
+                continue
+            return copy.deepcopy(result), False
+
+        self.leaders += 1
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result, True
+        except Exception as e:
+            future.set_exception(e)
+            # Evita el aviso de excepción no recuperada si nadie más esperaba
+            future.exception()
+            raise
+        except BaseException:
+            # Líder cancelado (plazo o cliente desconectado): los seguidores repiten la llamada
+            future.cancel()
+            raise
+        finally:
+            del self._calls[key]
+
+    async def do_stream(self, key, fn):
+        while (future := self._streams.get(key)) is not None:
+            self.followers += 1
+            try:
+                broadcast = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not _leader_cancelled(future):
+                    raise
+                self.followers -= 1
+                continue
+            return broadcast.subscribe(), False
+
+        self.leaders += 1
+        future = self._streams[key] = asyncio.get_running_loop().create_future()
+
+        def done():
+            if self._streams.get(key) is future:
+                del self._streams[key]
+
+        try:
+            source = await fn()
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            done()
+            raise
+        except BaseException:
+            future.cancel()
+            done()
+            raise
+
+        broadcast = AsyncStreamBroadcast(source, done)
+        subscription = broadcast.subscribe()
+        broadcast.start()
+        future.set_result(broadcast)
+        return subscription, True
+
+    def stats(self):
+        return {
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "in_flight": len(self._calls) + len(self._streams)
+        }
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight():
+    """SingleFlight compartido por proceso; None si COALESCE_ENABLED=false"""
+    global _single_flight
+    if not load_config()['COALESCE_ENABLED']:
+        return None
+    with _single_flight_lock:
+        if _single_flight is None:
+            _single_flight = SingleFlight()
+    return _single_flight
@@ -0,0 +1,69 @@
+# Codec - JSON rápido (orjson si está instalado) y reenvío de cuerpos upstream sin re-serializar
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson es opcional
+    orjson = None
+
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def loads(data):
+    """bytes/str JSON → objeto Python"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj, default=None):
+    """Objeto Python → bytes JSON compactos en UTF-8
+
+    Un RawCompletion se devuelve con los bytes tal como llegaron del upstream.
+    """
+    raw = getattr(obj, 'raw', None)
+    if raw is not None:
+        return raw
+    if orjson is not None:
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class RawCompletion(dict):
+    """Respuesta upstream ya compatible con OpenAI que conserva sus bytes originales
+
+    El gateway la lee como un dict (uso, caché, coalescencia) pero al cliente se
+    le envían los bytes recibidos, sin volver a serializar. Es de solo lectura:
+    merge_choices/replicate_choices crean dicts nuevos en lugar de modificarla.
+    """
+
+    __slots__ = ('raw',)
+
+    def __init__(self, raw):
+        super().__init__(loads(raw))
+        self.raw = raw
+
+    def __reduce__(self):
+        # copy/pickle (Redis, deepcopy) como dict normal
+        return dict, (dict(self),)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Proveedor JSON de Flask con orjson para request.json/jsonify
+
+    Sin orden alfabético de claves ni indentación: la respuesta se serializa en
+    el orden en que se construyó. app.json = FastJSONProvider(app)
+    """
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj, default=self.default).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj, default=self.default), mimetype=self.mimetype)
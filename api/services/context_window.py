@@ -0,0 +1,271 @@
+# Context Window - Ajusta el historial al contexto del modelo local y dimensiona num_ctx
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from api.services.metrics import context_compactions, context_num_ctx, context_prompt_tokens
+from api.services.routing_policy import estimate_prompt_tokens, estimate_tokens
+from config.settings import load_config
+
+SUMMARY_HEADER = "Resumen de la conversación anterior:"
+# Tokens de la plantilla de chat que no cuenta estimate_prompt_tokens
+TEMPLATE_MARGIN = 32
+
+
+def _message_tokens(message):
+    return estimate_tokens(message.get('content', '')) + 4
+
+
+def _text(content):
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        # Partes estilo OpenAI ({"type": "text", "text": ...})
+        return ' '.join(part.get('text', '') for part in content if isinstance(part, dict))
+    return str(content or '')
+
+
+class Compaction:
+    """Mensajes que se envían a Ollama y el num_ctx que necesitan"""
+
+    def __init__(self, messages, num_ctx, prompt_tokens, dropped=0, summarized=0):
+        self.messages = messages
+        self.num_ctx = num_ctx
+        self.prompt_tokens = prompt_tokens
+        self.dropped = dropped
+        self.summarized = summarized
+
+
+class ConversationSummaries:
+    """Resúmenes de los turnos que ya no caben, generados en segundo plano
+
+    La clave es un hash encadenado de los mensajes (modelo + rol + contenido),
+    así que el resumen de un prefijo sirve mientras la conversación crece: se
+    usa el del prefijo más largo disponible y se pide en segundo plano el del
+    prefijo actual partiendo de él. Ninguna petición espera a un resumen.
+    summarize(modelo, resumen_previo, mensajes) devuelve el texto.
+    """
+
+    def __init__(self, summarize, max_entries=512, max_pending=4):
+        self.summarize = summarize
+        self.max_entries = max_entries
+        self.max_pending = max_pending
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._pending = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='context-summary')
+        self._counters = {"hits": 0, "misses": 0, "scheduled": 0, "skipped": 0, "stored": 0, "errors": 0}
+
+    @staticmethod
+    def digests(model, messages):
+        """Hash de cada prefijo de `messages`"""
+        state = hashlib.sha256((model or '').encode('utf-8'))
+        digests = []
+        for message in messages:
+            state.update(b'\x00' + str(message.get('role', '')).encode('utf-8') + b'\x01')
+            state.update(_text(message.get('content')).encode('utf-8'))
+            digests.append(state.hexdigest())
+        return digests
+
+    def lookup(self, digests):
+        """(mensajes cubiertos, resumen) del prefijo más largo ya resumido"""
+        with self._lock:
+            for covered in range(len(digests), 0, -1):
+                summary = self._entries.get(digests[covered - 1])
+                if summary is not None:
+                    self._entries.move_to_end(digests[covered - 1])
+                    self._counters["hits"] += 1
+                    return covered, summary
+            self._counters["misses"] += 1
+        return 0, None
+
+    def schedule(self, model, messages, digests, covered, previous):
+        """Pide el resumen de todo `messages` si no existe ni está en curso"""
+        key = digests[-1]
+        with self._lock:
+            if covered == len(messages) or key in self._pending:
+                return False
+            if len(self._pending) >= self.max_pending:
+                self._counters["skipped"] += 1
+                return False
+            self._pending.add(key)
+            self._counters["scheduled"] += 1
+        self._executor.submit(self._run, key, model, previous, messages[covered:])
+        return True
+
+    def _run(self, key, model, previous, messages):
+        try:
+            summary = (self.summarize(model, previous, messages) or '').strip()
+            if summary:
+                self.store(key, summary)
+        except Exception as e:
+            logging.warning(f"No se pudo resumir el historial: {e}")
+            with self._lock:
+                self._counters["errors"] += 1
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def store(self, key, summary):
+        with self._lock:
+            self._entries[key] = summary
+            self._entries.move_to_end(key)
+            self._counters["stored"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {**self._counters, "entries": len(self._entries), "pending": len(self._pending)}
+
+
+class ContextWindow:
+    """Recorta las conversaciones largas antes de enviarlas a Ollama
+
+    Se conservan los system prompts y los turnos más recientes que caben en el
+    contexto del modelo (MODEL_CONTEXT_SIZES, o el que informa /api/show, con
+    max_context como techo) descontando la respuesta pedida; los turnos que
+    sobran se quitan o, con `summaries`, se sustituyen por un resumen ya
+    generado. num_ctx se redondea a potencias de dos desde min_context y solo
+    baja tras `sticky` segundos sin usarse: Ollama recarga el modelo cada vez
+    que cambia num_ctx.
+    """
+
+    def __init__(self, default_context=4096, max_context=8192, min_context=2048, sizes=None,
+                 sticky=300, summaries=None):
+        self.default_context = default_context
+        self.max_context = max_context
+        self.min_context = min_context
+        self.sizes = {model: int(size) for model, size in (sizes or {}).items()}
+        self.sticky = sticky
+        self.summaries = summaries
+
+        self._lock = threading.Lock()
+        self._num_ctx = {}
+        self._counters = {"requests": 0, "trimmed": 0, "summarized": 0, "dropped_messages": 0}
+
+    def limit(self, model, context_length=None):
+        """Tokens de contexto disponibles para el modelo"""
+        size = self.sizes.get(model) or context_length or self.default_context
+        return min(size, self.max_context)
+
+    def compact(self, model, messages, max_tokens, context_length=None):
+        limit = self.limit(model, context_length)
+        output = min(max_tokens or limit // 4, limit // 2)
+        budget = limit - output - TEMPLATE_MARGIN
+
+        system = [m for m in messages if m.get('role') == 'system']
+        turns = [m for m in messages if m.get('role') != 'system']
+        used = estimate_prompt_tokens(system)
+        kept = 0
+        for message in reversed(turns):
+            cost = _message_tokens(message)
+            # El último mensaje va siempre, aunque no quepa (Ollama lo truncará)
+            if kept and used + cost > budget:
+                break
+            used += cost
+            kept += 1
+        start = len(turns) - kept
+        # El historial conservado empieza en un turno del usuario
+        while start and kept > 1 and turns[start].get('role') != 'user':
+            used -= _message_tokens(turns[start])
+            start += 1
+            kept -= 1
+
+        dropped, summarized = turns[:start], 0
+        if dropped:
+            compacted = turns[start:]
+            if self.summaries:
+                digests = self.summaries.digests(model, dropped)
+                summarized, summary = self.summaries.lookup(digests)
+                note = f"{SUMMARY_HEADER}\n{summary}" if summary else None
+                if note and used + estimate_tokens(note) + 2 <= budget:
+                    system = self._with_summary(system, note)
+                else:
+                    summarized = 0
+                self.summaries.schedule(model, dropped, digests, summarized, summary)
+            messages = system + compacted
+
+        prompt_tokens = estimate_prompt_tokens(messages)
+        num_ctx = self.num_ctx(model, prompt_tokens + output + TEMPLATE_MARGIN, limit)
+        with self._lock:
+            self._counters["requests"] += 1
+            if dropped:
+                self._counters["trimmed"] += 1
+                self._counters["dropped_messages"] += len(dropped)
+            if summarized:
+                self._counters["summarized"] += 1
+        context_compactions.inc(model=model, result='summarized' if summarized else 'trimmed' if dropped else 'fits')
+        context_prompt_tokens.observe(prompt_tokens, model=model)
+        context_num_ctx.observe(num_ctx, model=model)
+        return Compaction(messages, num_ctx, prompt_tokens, len(dropped), summarized)
+
+    @staticmethod
+    def _with_summary(system, note):
+        """System prompt con el resumen al final (Ollama recibe un único system)"""
+        if not system:
+            return [{"role": "system", "content": note}]
+        last = system[-1]
+        return system[:-1] + [{**last, "content": f"{_text(last.get('content'))}\n\n{note}"}]
+
+    def num_ctx(self, model, needed, limit):
+        """Potencia de dos (desde min_context) que cubre `needed`, sin pasar de `limit`"""
+        size = min(self.min_context, limit)
+        while size < needed and size < limit:
+            size = min(size * 2, limit)
+        now = time.monotonic()
+        with self._lock:
+            current, used_at = self._num_ctx.get(model, (0, 0.0))
+            if size <= current <= limit and now - used_at < self.sticky:
+                # Ya cargado con un contexto suficiente: reducirlo forzaría una recarga
+                size = current
+            self._num_ctx[model] = (size, now)
+        return size
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            num_ctx = {model: size for model, (size, _) in self._num_ctx.items()}
+        return {
+            **counters,
+            "num_ctx": num_ctx,
+            "default_context": self.default_context,
+            "max_context": self.max_context,
+            "min_context": self.min_context,
+            "summaries": self.summaries.stats() if self.summaries else None
+        }
+
+
+_window = None
+_window_lock = threading.Lock()
+
+
+def get_context_window(summarize=None):
+    """ContextWindow compartida por proceso (el primer AIRouter aporta summarize); None si está desactivada"""
+    global _window
+    config = load_config()
+    if not config['CONTEXT_COMPACTION']:
+        return None
+    with _window_lock:
+        if _window is None:
+            summaries = None
+            if config['CONTEXT_SUMMARY_ENABLED'] and summarize is not None:
+                summaries = ConversationSummaries(summarize)
+            _window = ContextWindow(
+                default_context=config['CONTEXT_DEFAULT_TOKENS'],
+                max_context=config['CONTEXT_MAX_TOKENS'],
+                min_context=config['CONTEXT_MIN_TOKENS'],
+                sizes=config['MODEL_CONTEXT_SIZES'],
+                sticky=config['CONTEXT_STICKY_SECONDS'],
+                summaries=summaries
+            )
+    return _window
+
+
+def context_window_stats():
+    with _window_lock:
+        return _window.stats() if _window else None
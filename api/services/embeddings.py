@@ -0,0 +1,231 @@
+# Embeddings - /v1/embeddings con micro-lotes entre peticiones concurrentes hacia Ollama
+import asyncio
+import base64
+import sys
+import threading
+from array import array
+
+from api.services.metrics import embedding_batch_inputs, embedding_batch_requests
+from config.settings import load_config
+
+ENCODING_FORMATS = ('float', 'base64')
+
+
+def parse_embedding_request(data, max_inputs):
+    """Normaliza el cuerpo de POST /v1/embeddings; lanza ValueError con el mensaje para el 400"""
+    if not data:
+        raise ValueError("No input data provided")
+    if 'input' not in data:
+        raise ValueError("Missing 'input' parameter")
+    inputs = data['input']
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    if not isinstance(inputs, list) or not inputs or not all(isinstance(text, str) for text in inputs):
+        # Los arrays de tokens de OpenAI no sirven: Ollama tokeniza con su propio modelo
+        raise ValueError("'input' must be a string or a list of strings")
+    if not all(inputs):
+        raise ValueError("'input' cannot contain empty strings")
+    if len(inputs) > max_inputs:
+        raise ValueError(f"Too many inputs (max {max_inputs})")
+    encoding_format = data.get('encoding_format') or 'float'
+    if encoding_format not in ENCODING_FORMATS:
+        raise ValueError(f"'encoding_format' must be one of {', '.join(ENCODING_FORMATS)}")
+    dimensions = data.get('dimensions')
+    if dimensions is not None and (isinstance(dimensions, bool) or not isinstance(dimensions, int) or dimensions < 1):
+        raise ValueError("'dimensions' must be a positive integer")
+    return {"model": data.get('model'), "input": inputs, "encoding_format": encoding_format, "dimensions": dimensions}
+
+
+def _encode(vector, encoding_format):
+    if encoding_format != 'base64':
+        return vector
+    # float32 little-endian, como la API de OpenAI
+    packed = array('f', vector)
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return base64.b64encode(packed.tobytes()).decode('ascii')
+
+
+def embedding_response(model, vectors, prompt_tokens, encoding_format='float'):
+    return {
+        "object": "list",
+        "data": [
+            {"object": "embedding", "index": index, "embedding": _encode(vector, encoding_format)}
+            for index, vector in enumerate(vectors)
+        ],
+        "model": model,
+        "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens}
+    }
+
+
+class _Batch:
+    def __init__(self, event):
+        self.inputs = []
+        self.requests = 0
+        self.full = event()
+        self.done = event()
+        self.vectors = None
+        self.tokens = 0
+        self.error = None
+
+
+class _Batcher:
+    """Estado compartido de los micro-lotes (un lote abierto por modelo y dimensiones)"""
+
+    def __init__(self, embed, max_batch=32, max_wait=0.005):
+        self.embed = embed
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._open = {}
+        self._counters = {"requests": 0, "inputs": 0, "batches": 0, "errors": 0}
+
+    def _join(self, key, inputs, event):
+        """Añade las entradas al lote abierto (o abre uno); devuelve (lote, posición, abierto_ahora)"""
+        with self._lock:
+            self._counters["requests"] += 1
+            self._counters["inputs"] += len(inputs)
+            batch = self._open.get(key)
+            if batch is not None and len(batch.inputs) + len(inputs) > self.max_batch:
+                # No cabe: el lote abierto sale ya y esta petición empieza otro
+                self._close(key, batch)
+                batch = None
+            opened = batch is None
+            if opened:
+                batch = self._open[key] = _Batch(event)
+            start = len(batch.inputs)
+            batch.inputs.extend(inputs)
+            batch.requests += 1
+            if len(batch.inputs) >= self.max_batch:
+                self._close(key, batch)
+            return batch, start, opened
+
+    def _close(self, key, batch):
+        if self._open.get(key) is batch:
+            del self._open[key]
+        batch.full.set()
+
+    def _finish(self, key, batch, vectors, tokens):
+        """Guarda el resultado del lote para repartirlo"""
+        if len(vectors) != len(batch.inputs):
+            raise Exception(f"Ollama devolvió {len(vectors)} embeddings para {len(batch.inputs)} textos")
+        batch.vectors, batch.tokens = vectors, tokens
+        with self._lock:
+            self._counters["batches"] += 1
+        embedding_batch_inputs.observe(len(batch.inputs), model=key[0])
+        embedding_batch_requests.observe(batch.requests, model=key[0])
+
+    def _fail(self, batch, error):
+        batch.error = error
+        with self._lock:
+            self._counters["errors"] += 1
+
+    @staticmethod
+    def _share(batch, start, count):
+        """Vectores de una petición y su parte de los tokens del lote (proporcional al texto)"""
+        if batch.error is not None:
+            raise batch.error
+        inputs = batch.inputs[start:start + count]
+        total = sum(len(text) for text in batch.inputs)
+        tokens = round(batch.tokens * sum(len(text) for text in inputs) / total) if total else 0
+        return batch.vectors[start:start + count], tokens
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            open_batches = len(self._open)
+        return {
+            **counters,
+            "open_batches": open_batches,
+            "max_batch": self.max_batch,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+            "avg_inputs_per_batch": round(counters["inputs"] / counters["batches"], 2) if counters["batches"] else None,
+            "avg_requests_per_batch": round(counters["requests"] / counters["batches"], 2) if counters["batches"] else None
+        }
+
+
+class EmbeddingBatcher(_Batcher):
+    """Agrupa las peticiones de embeddings concurrentes en una sola llamada a Ollama
+
+    La primera petición de cada modelo abre un lote y espera hasta max_wait o a
+    que reúna max_batch textos; las que llegan mientras tanto se suman y cada
+    una recibe su parte del resultado. embed(model, inputs, dimensions)
+    devuelve (vectores, tokens del prompt). Hilos / gevent.
+    """
+
+    def embed_many(self, model, inputs, dimensions=None):
+        """Vectores de `inputs` en orden y los tokens que les corresponden"""
+        key = (model, dimensions)
+        batch, start, opened = self._join(key, inputs, threading.Event)
+        if opened:
+            batch.full.wait(self.max_wait)
+            with self._lock:
+                if self._open.get(key) is batch:
+                    del self._open[key]
+            try:
+                vectors, tokens = self.embed(model, batch.inputs, dimensions)
+                self._finish(key, batch, vectors, tokens)
+            except Exception as e:
+                self._fail(batch, e)
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+        return self._share(batch, start, len(inputs))
+
+
+class AsyncEmbeddingBatcher(_Batcher):
+    """Equivalente asyncio; embed es una corrutina
+
+    El lote se envía desde su propia tarea: si el cliente que lo abrió se
+    desconecta, el resto de peticiones del lote siguen recibiendo respuesta.
+    """
+
+    def __init__(self, embed, max_batch=32, max_wait=0.005):
+        super().__init__(embed, max_batch, max_wait)
+        self._tasks = set()
+
+    async def embed_many(self, model, inputs, dimensions=None):
+        key = (model, dimensions)
+        batch, start, opened = self._join(key, inputs, asyncio.Event)
+        if opened:
+            task = asyncio.ensure_future(self._flush(key, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        await asyncio.shield(batch.done.wait())
+        return self._share(batch, start, len(inputs))
+
+    async def _flush(self, key, batch):
+        try:
+            await asyncio.wait_for(batch.full.wait(), self.max_wait)
+        except asyncio.TimeoutError:
+            pass
+        with self._lock:
+            if self._open.get(key) is batch:
+                del self._open[key]
+        try:
+            vectors, tokens = await self.embed(key[0], batch.inputs, key[1])
+            self._finish(key, batch, vectors, tokens)
+        except Exception as e:
+            self._fail(batch, e)
+        finally:
+            batch.done.set()
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_embedding_batcher(embed):
+    """EmbeddingBatcher compartido por proceso (el primer AIRouter aporta embed)"""
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            config = load_config()
+            _batcher = EmbeddingBatcher(embed, config['EMBEDDING_BATCH_SIZE'], config['EMBEDDING_BATCH_WAIT_MS'] / 1000)
+    return _batcher
+
+
+def embedding_stats():
+    with _batcher_lock:
+        return _batcher.stats() if _batcher else None
@@ -0,0 +1,240 @@
+# Health Prober - Sondas en paralelo y en segundo plano de Ollama, DeepSeek y otras dependencias
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+
+from config.settings import load_config
+from api.services.backend_health import get_backend_health, is_backend_failure
+from api.services.http_client import get_upstream_client
+from api.services.metrics import health_probes
+from api.services.model_registry import get_model_registry
+
+UP = 'up'
+DOWN = 'down'
+
+# backend: 'ollama' / 'deepseek' (alimentan el router) o None para las URLs extra; node: URL del nodo Ollama
+Probe = namedtuple('Probe', 'name backend url headers node')
+
+
+def parse_probe_urls(value):
+    """'nginx=http://localhost/health, otra=http://...' → {nombre: url}"""
+    urls = {}
+    for item in value.replace('\n', ',').split(','):
+        name, _, url = item.partition('=')
+        if name.strip() and url.strip():
+            urls[name.strip()] = url.strip()
+    return urls
+
+
+def models_url(deepseek_url):
+    """GET /models de la API de DeepSeek a partir de la URL de chat (no gasta tokens)"""
+    base = deepseek_url.rstrip('/')
+    if base.endswith('/chat/completions'):
+        base = base[:-len('/chat/completions')]
+    return f"{base}/models"
+
+
+class HealthProber:
+    """Estado de las dependencias del gateway, comprobado fuera del camino de las peticiones
+
+    Cada `interval` segundos lanza a la vez una sonda por nodo Ollama
+    (/api/version), otra a DeepSeek (/models) y una por URL extra, cada una con
+    `timeout`: una dependencia caída cuesta `timeout`, no la suma de todas.
+    El resultado (estado, latencia, instante y error) queda en memoria y /health
+    lo sirve sin esperar. También alimenta al router: un nodo que no contesta
+    sale del reparto, uno que vuelve se reincorpora en el siguiente inventario,
+    y el circuito de cada nodo Ollama y de DeepSeek se abre o se reintenta
+    según sus sondas.
+    """
+
+    def __init__(self, registry, deepseek_url='', deepseek_key='', extra=None, interval=10, timeout=2,
+                 workers=8, min_deep_interval=1.0):
+        self.registry = registry
+        self.deepseek_url = models_url(deepseek_url) if deepseek_url else ''
+        self.deepseek_key = deepseek_key
+        self.extra = dict(extra or {})
+        self.interval = interval
+        self.timeout = timeout
+        self.workers = workers
+        self.min_deep_interval = min_deep_interval
+
+        self._lock = threading.Lock()
+        self._round_lock = threading.Lock()
+        self._results = {}
+        self._round_at = None
+        self._rounds = 0
+        self._executor = None
+        self._session = requests.Session()
+        self._pid = None
+
+    def start(self):
+        """Arranca las rondas en segundo plano (una vez por proceso)"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            # Tras un fork los hilos del pool no existen
+            self._executor = None
+        thread = threading.Thread(target=self._run, name="health-prober", daemon=True)
+        thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.probe_all()
+            except Exception as e:
+                logging.warning(f"Sondas de salud: {e}")
+            time.sleep(self.interval)
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='health-probe')
+            return self._executor
+
+    def targets(self):
+        probes = [
+            Probe(f"ollama:{url}", 'ollama', f"{url}/api/version", None, url)
+            for url in self.registry.urls()
+        ]
+        if self.deepseek_url:
+            headers = {"Authorization": f"Bearer {self.deepseek_key}"} if self.deepseek_key else None
+            probes.append(Probe('deepseek', 'deepseek', self.deepseek_url, headers, None))
+        probes.extend(Probe(name, None, url, None, None) for name, url in self.extra.items())
+        return probes
+
+    def _probe(self, probe):
+        started = time.monotonic()
+        try:
+            client = get_upstream_client(probe.backend) if probe.backend else self._session
+            response = client.get(probe.url, headers=probe.headers, timeout=self.timeout)
+            # Un backend que responde 4xx está vivo (es la petición la que sobra); una URL extra no
+            ok = not is_backend_failure(response.status_code) if probe.backend else response.status_code < 400
+            error = None if ok else f"HTTP {response.status_code}"
+        except Exception as e:
+            ok, error = False, f"{type(e).__name__}: {e}"[:200]
+        return {
+            "status": UP if ok else DOWN,
+            "latency": round(time.monotonic() - started, 4),
+            "checked_at": round(time.time(), 3),
+            "error": error
+        }
+
+    def probe_all(self, max_age=None):
+        """Una ronda de sondas en paralelo; con max_age reutiliza una ronda más reciente que eso"""
+        with self._round_lock:
+            with self._lock:
+                if max_age is not None and self._round_at is not None and time.monotonic() - self._round_at < max_age:
+                    return dict(self._results)
+            probes = self.targets()
+            futures = {self._pool().submit(self._probe, probe): probe for probe in probes}
+            done, _ = wait(futures, timeout=self.timeout + 1)
+            results = {}
+            for future, probe in futures.items():
+                if future in done:
+                    results[probe.name] = future.result()
+                else:
+                    results[probe.name] = {"status": DOWN, "latency": None, "checked_at": round(time.time(), 3),
+                                           "error": "timeout"}
+            with self._lock:
+                self._results = results
+                self._round_at = time.monotonic()
+                self._rounds += 1
+        self._feed(probes, results)
+        return results
+
+    def _feed(self, probes, results):
+        """Lleva el resultado de las sondas al reparto de nodos y a los circuit breakers del router"""
+        nodes = self.registry.snapshot()
+        backends = {}
+        for probe in probes:
+            up = results[probe.name]["status"] == UP
+            health_probes.inc(dependency=probe.backend or probe.name, result=results[probe.name]["status"])
+            if probe.node:
+                # Circuito del nodo: uno caído no corta el tráfico al resto
+                get_backend_health(probe.backend).node(probe.node).probe(up)
+            elif probe.backend:
+                backends[probe.backend] = backends.get(probe.backend, False) or up
+            if probe.node and probe.node in nodes:
+                if not up and nodes[probe.node]["healthy"]:
+                    self.registry.mark_down(probe.node)
+                elif up and not nodes[probe.node]["healthy"]:
+                    # Vuelve a contestar: inventario nuevo para que entre otra vez en el reparto
+                    self.registry.invalidate()
+        for backend, up in backends.items():
+            get_backend_health(backend).probe(up)
+
+    def status(self, deep=False):
+        """Resumen para /health; deep lanza una ronda ahora (compartida si llegan varias seguidas)"""
+        if deep:
+            self.probe_all(max_age=self.min_deep_interval)
+        with self._lock:
+            results = dict(self._results)
+            age = time.monotonic() - self._round_at if self._round_at is not None else None
+            rounds = self._rounds
+        backends = [result for name, result in results.items() if name == 'deepseek' or name.startswith('ollama:')]
+        if not results:
+            status = 'starting'
+        elif all(result["status"] == UP for result in results.values()):
+            status = 'healthy'
+        elif any(result["status"] == UP for result in backends):
+            status = 'degraded'
+        else:
+            status = 'unhealthy'
+        return {
+            "status": status,
+            "age": round(age, 3) if age is not None else None,
+            "rounds": rounds,
+            "checks": results
+        }
+
+
+_prober = None
+_prober_lock = threading.Lock()
+
+
+def get_health_prober():
+    """HealthProber compartido por proceso; None si HEALTH_PROBE_ENABLED=false"""
+    global _prober
+    config = load_config()
+    if not config['HEALTH_PROBE_ENABLED']:
+        return None
+    with _prober_lock:
+        if _prober is None:
+            _prober = HealthProber(
+                get_model_registry(),
+                deepseek_url=config['DEEPSEEK_URL'],
+                deepseek_key=config['DEEPSEEK_API_KEY'],
+                extra=parse_probe_urls(config['HEALTH_PROBE_URLS']),
+                interval=config['HEALTH_PROBE_INTERVAL'],
+                timeout=config['HEALTH_PROBE_TIMEOUT']
+            )
+    return _prober
+
+
+def start_health_prober():
+    """Arranca las sondas de este proceso al montar la app (run.py, app/main.py, lifespan de asgi.py)"""
+    prober = get_health_prober()
+    if prober is not None:
+        prober.start()
+    return prober
+
+
+def is_deep(value):
+    """?deep=1 en /health"""
+    return (value or '').lower() in ('1', 'true', 'yes')
+
+
+def health_response(body, deep=False):
+    """(cuerpo, código HTTP) de /health: 503 solo si no queda ningún backend que conteste"""
+    body = {"status": "healthy", **body}
+    prober = get_health_prober()
+    if prober is None:
+        return body, 200
+    body.update(prober.status(deep))
+    return body, 503 if body["status"] == 'unhealthy' else 200
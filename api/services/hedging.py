@@ -0,0 +1,364 @@
+# Hedging - Segunda llamada a DeepSeek cuando Ollama tarda en dar el primer token
+import asyncio
+import contextvars
+import queue
+import threading
+import time
+from collections import deque
+
+from api.services.cancellation import RequestAborted
+from api.services.metrics import hedge_wins, hedges
+from config.settings import load_config
+
+PRIMARY = 'ollama'
+SECONDARY = 'deepseek'
+
+
+class HedgeCancelled(Exception):
+    """La rama perdió la carrera; quien la ejecuta debe cerrar su upstream"""
+
+
+def prefetch(stream, count):
+    """Lee los primeros `count` eventos de un stream (menos si termina antes)"""
+    buffered = []
+    for event in stream:
+        buffered.append(event)
+        if len(buffered) >= count:
+            break
+    return buffered
+
+
+async def prefetch_async(stream, count):
+    buffered = []
+    async for event in stream:
+        buffered.append(event)
+        if len(buffered) >= count:
+            break
+    return buffered
+
+
+class PrefetchedStream:
+    """Stream cuyos primeros eventos ya se leyeron para decidir la carrera"""
+
+    def __init__(self, buffered, stream):
+        self._buffered = deque(buffered)
+        self._stream = stream
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._buffered:
+            return self._buffered.popleft()
+        return next(self._stream)
+
+    def close(self):
+        self._stream.close()
+
+    def cancel(self):
+        self._stream.cancel()
+
+
+class AsyncPrefetchedStream:
+    def __init__(self, buffered, stream):
+        self._buffered = deque(buffered)
+        self._stream = stream
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._buffered:
+            return self._buffered.popleft()
+        return await self._stream.__anext__()
+
+    async def aclose(self):
+        await self._stream.aclose()
+
+
+def _discard(result):
+    cancel = getattr(result, 'cancel', None) or getattr(result, 'close', None)
+    if cancel:
+        cancel()
+
+
+class _Leg:
+    """Una rama de la carrera ejecutada en su propio hilo
+
+    fn(leg) abre la llamada, avisa con leg.first_token() y devuelve el resultado
+    listo para el cliente. Las ramas perdedoras se cierran desde su propio hilo
+    (leg.check()) o, si ya terminaron, al descartar su resultado.
+    """
+
+    def __init__(self, name, fn, events):
+        self.name = name
+        self.fn = fn
+        self.events = events
+        self.cancelled = False
+        self.result = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        # El hilo hereda el contexto de la petición (key a la que se atribuye el uso)
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(self._run,), name=f"hedge-{self.name}", daemon=True).start()
+        return self
+
+    def _run(self):
+        try:
+            result = self.fn(self)
+        except Exception as e:
+            self.events.put(('error', self, e))
+            return
+        with self._lock:
+            if not self.cancelled:
+                self.result = result
+                self.events.put(('ready', self, result))
+                return
+        _discard(result)
+
+    def check(self):
+        if self.cancelled:
+            raise HedgeCancelled()
+
+    def first_token(self):
+        self.check()
+        self.events.put(('first_token', self, None))
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            result, self.result = self.result, None
+        if result is not None:
+            _discard(result)
+
+
+class _AsyncLeg:
+    """Equivalente asyncio: la rama es una tarea y cancelarla corta la petición httpx"""
+
+    def __init__(self, name, fn, events):
+        self.name = name
+        self.fn = fn
+        self.events = events
+        self.result = None
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.ensure_future(self._run())
+        return self
+
+    async def _run(self):
+        try:
+            self.result = await self.fn(self)
+        except Exception as e:
+            self.events.put_nowait(('error', self, e))
+            return
+        self.events.put_nowait(('ready', self, self.result))
+
+    def first_token(self):
+        self.events.put_nowait(('first_token', self, None))
+
+    async def cancel(self):
+        if not self.task.done():
+            self.task.cancel()
+            return
+        result, self.result = self.result, None
+        if result is not None and hasattr(result, 'aclose'):
+            await result.aclose()
+
+
+class _Race:
+    """Estado de una carrera; decide qué hacer con cada evento de las ramas"""
+
+    def __init__(self, policy, can_hedge):
+        self.policy = policy
+        self.can_hedge = can_hedge
+        self.started = time.monotonic()
+        self.deadline = self.started + policy.delay()
+        self.waiting_first_token = True
+        self.hedged = False
+        self.primary_first_token = None
+        self.legs = []
+        self.failed = set()
+        self.error = None
+
+    def timeout(self):
+        if not self.waiting_first_token:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def on_timeout(self):
+        """Plazo vencido sin primer token: True si hay que lanzar DeepSeek"""
+        self.waiting_first_token = False
+        if not self.can_hedge():
+            return False
+        self.hedged = True
+        self.policy.count('hedged')
+        hedges.inc()
+        return True
+
+    def on_first_token(self, leg):
+        if leg.name == PRIMARY and self.primary_first_token is None:
+            self.primary_first_token = time.monotonic() - self.started
+            self.policy.observe(self.primary_first_token)
+            self.waiting_first_token = False
+
+    def on_error(self, leg, error):
+        """True si hay que lanzar DeepSeek como fallback; lanza el error si no queda ninguna rama"""
+        self.failed.add(leg.name)
+        self.error = error
+        if isinstance(error, RequestAborted):
+            # Cliente desconectado o plazo vencido: no tiene sentido probar con la otra rama
+            raise error
+        if leg.name == PRIMARY and SECONDARY not in (l.name for l in self.legs):
+            self.waiting_first_token = False
+            self.policy.count('fallbacks')
+            return True
+        if len(self.failed) == len(self.legs):
+            raise error
+        return False
+
+    def on_ready(self, leg):
+        if self.hedged:
+            self.policy.win(leg.name)
+            if leg.name == SECONDARY and self.primary_first_token is None:
+                # Ollama no llegó: el tiempo hasta aquí es una cota inferior de su primer token
+                self.policy.observe(time.monotonic() - self.started)
+
+
+class HedgePolicy:
+    """Plazo del hedge y contadores para ajustarlo frente al gasto en DeepSeek
+
+    El plazo es HEDGE_DELAY o, con HEDGE_PERCENTILE, ese percentil del tiempo
+    hasta el primer token de Ollama en las últimas `window` peticiones.
+    """
+
+    def __init__(self, delay=2.0, percentile=0, min_samples=20, window=200):
+        self.fixed_delay = delay
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._counters = {"requests": 0, "hedged": 0, "fallbacks": 0}
+        self._wins = {PRIMARY: 0, SECONDARY: 0}
+
+    def delay(self):
+        with self._lock:
+            if not self.percentile or len(self._samples) < self.min_samples:
+                return self.fixed_delay
+            ordered = sorted(self._samples)
+        rank = -(-self.percentile * len(ordered) // 100)
+        return ordered[max(0, min(len(ordered), int(rank)) - 1)]
+
+    def observe(self, first_token_seconds):
+        with self._lock:
+            self._samples.append(first_token_seconds)
+
+    def count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def win(self, backend):
+        with self._lock:
+            self._wins[backend] += 1
+        hedge_wins.inc(backend=backend)
+
+    def run(self, primary, secondary, can_hedge):
+        """Carrera Ollama/DeepSeek en hilos; devuelve el resultado de la rama ganadora
+
+        primary y secondary son fn(leg). DeepSeek solo arranca si Ollama no da
+        el primer token antes del plazo (y can_hedge() lo permite) o si falla.
+        Si Ollama aún no ha enviado cabeceras al perder, la conexión se corta en
+        cuanto llegan: requests no puede abortar una petición bloqueada.
+        """
+        self.count('requests')
+        events = queue.Queue()
+        race = _Race(self, can_hedge)
+        race.legs.append(_Leg(PRIMARY, primary, events).start())
+        while True:
+            try:
+                kind, leg, value = events.get(timeout=race.timeout())
+            except queue.Empty:
+                if race.on_timeout():
+                    race.legs.append(_Leg(SECONDARY, secondary, events).start())
+                continue
+            if kind == 'first_token':
+                race.on_first_token(leg)
+            elif kind == 'error':
+                try:
+                    fallback = race.on_error(leg, value)
+                except RequestAborted:
+                    for other in race.legs:
+                        other.cancel()
+                    raise
+                if fallback:
+                    race.legs.append(_Leg(SECONDARY, secondary, events).start())
+            else:
+                race.on_ready(leg)
+                for other in race.legs:
+                    if other is not leg:
+                        other.cancel()
+                return value
+
+    async def run_async(self, primary, secondary, can_hedge):
+        """Equivalente asyncio de run(); primary y secondary son corrutinas fn(leg)"""
+        self.count('requests')
+        events = asyncio.Queue()
+        race = _Race(self, can_hedge)
+        race.legs.append(_AsyncLeg(PRIMARY, primary, events).start())
+        try:
+            while True:
+                try:
+                    kind, leg, value = await asyncio.wait_for(events.get(), race.timeout())
+                except asyncio.TimeoutError:
+                    if race.on_timeout():
+                        race.legs.append(_AsyncLeg(SECONDARY, secondary, events).start())
+                    continue
+                if kind == 'first_token':
+                    race.on_first_token(leg)
+                elif kind == 'error':
+                    if race.on_error(leg, value):
+                        race.legs.append(_AsyncLeg(SECONDARY, secondary, events).start())
+                else:
+                    race.on_ready(leg)
+                    race.legs.remove(leg)
+                    return value
+        finally:
+            # Ganador, error o cliente desconectado: ninguna otra rama sigue consumiendo
+            for other in race.legs:
+                await other.cancel()
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            wins = dict(self._wins)
+            samples = len(self._samples)
+        requests = counters["requests"]
+        return {
+            **counters,
+            "hedge_rate": round(counters["hedged"] / requests, 4) if requests else 0.0,
+            "wins": wins,
+            "delay": round(self.delay(), 3),
+            "percentile": self.percentile or None,
+            "samples": samples
+        }
+
+
+_policy = None
+_policy_lock = threading.Lock()
+
+
+def get_hedge_policy():
+    """HedgePolicy compartida por proceso; None si HEDGE_ENABLED=false"""
+    global _policy
+    config = load_config()
+    if not config['HEDGE_ENABLED']:
+        return None
+    with _policy_lock:
+        if _policy is None:
+            _policy = HedgePolicy(
+                delay=config['HEDGE_DELAY'],
+                percentile=config['HEDGE_PERCENTILE'],
+                min_samples=config['HEDGE_MIN_SAMPLES']
+            )
+    return _policy
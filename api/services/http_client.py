@@ -0,0 +1,195 @@
+# Upstream HTTP Clients - Sesiones persistentes con pool de conexiones por backend
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config.settings import load_config
+
+
+class UpstreamClient:
+    """Sesión keep-alive hacia un backend (Ollama, DeepSeek) con contadores de uso"""
+
+    def __init__(self, name, pool_size=10, connect_timeout=5, read_timeout=120):
+        self.name = name
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        self.session = requests.Session()
+        # pool_block=False: si se supera el pool se abre una conexión extra que no se conserva
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+        self._in_flight = 0
+
+    def _timeout(self, timeout):
+        if timeout is None:
+            return (self.connect_timeout, self.read_timeout)
+        if isinstance(timeout, tuple):
+            return timeout
+        return (min(self.connect_timeout, timeout), timeout)
+
+    def request(self, method, url, timeout=None, **kwargs):
+        with self._lock:
+            self._requests += 1
+            self._in_flight += 1
+        try:
+            return self.session.request(method, url, timeout=self._timeout(timeout), **kwargs)
+        except Exception:
+            with self._lock:
+                self._errors += 1
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        """Estado del pool: conexiones abiertas, ociosas y reutilización"""
+        pools = []
+        for key in list(self.adapter.poolmanager.pools.keys()):
+            pool = self.adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            idle = sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0
+            pools.append({
+                "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                "connections_opened": pool.num_connections,
+                "requests": pool.num_requests,
+                "idle": idle
+            })
+        with self._lock:
+            return {
+                "pool_size": self.pool_size,
+                "timeouts": {"connect": self.connect_timeout, "read": self.read_timeout},
+                "requests": self._requests,
+                "errors": self._errors,
+                "in_flight": self._in_flight,
+                "pools": pools
+            }
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncUpstreamClient:
+    """Equivalente asíncrono de UpstreamClient sobre httpx (modo ASGI)"""
+
+    def __init__(self, name, pool_size=10, connect_timeout=5, read_timeout=120):
+        import httpx
+
+        self.name = name
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._httpx = httpx
+        # Sin tope de conexiones: las generaciones largas no deben esperar turno en el pool
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+        )
+
+        self._requests = 0
+        self._errors = 0
+        self._in_flight = 0
+
+    def _timeout(self, timeout):
+        if timeout is None:
+            return self._httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+        if isinstance(timeout, tuple):
+            return self._httpx.Timeout(timeout[1], connect=timeout[0])
+        return self._httpx.Timeout(timeout, connect=min(self.connect_timeout, timeout))
+
+    async def request(self, method, url, timeout=None, stream=False, **kwargs):
+        """Con stream=True el cuerpo queda pendiente y hay que cerrar con aclose()"""
+        request = self.client.build_request(method, url, timeout=self._timeout(timeout), **kwargs)
+        self._requests += 1
+        self._in_flight += 1
+        try:
+            return await self.client.send(request, stream=stream)
+        except Exception:
+            self._errors += 1
+            raise
+        finally:
+            self._in_flight -= 1
+
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    def stats(self):
+        return {
+            "pool_size": self.pool_size,
+            "timeouts": {"connect": self.connect_timeout, "read": self.read_timeout},
+            "requests": self._requests,
+            "errors": self._errors,
+            "in_flight": self._in_flight
+        }
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_clients = {}
+_async_clients = {}
+_clients_pid = None
+_clients_lock = threading.Lock()
+
+
+def _client_settings(name):
+    config = load_config()
+    return {
+        "pool_size": config[f'{name.upper()}_POOL_SIZE'],
+        "connect_timeout": config['UPSTREAM_CONNECT_TIMEOUT'],
+        "read_timeout": config['UPSTREAM_READ_TIMEOUT']
+    }
+
+
+def get_upstream_client(name):
+    """Cliente compartido por proceso para 'ollama' o 'deepseek'"""
+    global _clients_pid
+    with _clients_lock:
+        # Tras un fork (gunicorn --preload) las conexiones heredadas no son válidas
+        if _clients_pid != os.getpid():
+            _clients.clear()
+            _clients_pid = os.getpid()
+        if name not in _clients:
+            _clients[name] = UpstreamClient(name, **_client_settings(name))
+        return _clients[name]
+
+
+def get_async_upstream_client(name):
+    """Cliente asíncrono compartido; debe usarse desde un único event loop"""
+    if name not in _async_clients:
+        _async_clients[name] = AsyncUpstreamClient(name, **_client_settings(name))
+    return _async_clients[name]
+
+
+async def close_async_upstream_clients():
+    clients = list(_async_clients.values())
+    _async_clients.clear()
+    for client in clients:
+        await client.aclose()
+
+
+def upstream_stats():
+    """Estadísticas de todos los clientes creados en este proceso"""
+    with _clients_lock:
+        clients = dict(_clients) if _clients_pid == os.getpid() else {}
+    stats = {name: client.stats() for name, client in clients.items()}
+    for name, client in list(_async_clients.items()):
+        stats[f"{name}_async"] = client.stats()
+    return stats
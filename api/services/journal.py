@@ -0,0 +1,269 @@
+# Journal - Registro JSONL de cada petición /v1/ (escritura en lotes en segundo plano y rotación)
+import atexit
+import contextvars
+import glob
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+
+from api.services.codec import dumps, loads
+from config.settings import load_config
+
+PATH_PREFIX = '/v1/'
+
+# Traza de la petición en curso; la completan usage.record y UpstreamCall.first_token
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+
+def key_id(api_key):
+    """Identificador estable de la key sin guardarla en claro"""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12] if api_key else None
+
+
+class Trace:
+    """Lo que se sabe de una petición mientras se atiende"""
+
+    __slots__ = ('ts', 'started', 'method', 'path', 'body', 'backend', 'upstream_model', 'generations',
+                 'prompt_tokens', 'completion_tokens', 'ttft', 'finished')
+
+    def __init__(self, method, path, body=None):
+        self.ts = time.time()
+        self.started = time.monotonic()
+        self.method = method
+        self.path = path
+        self.body = body
+        self.backend = None
+        self.upstream_model = None
+        self.generations = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.ttft = None
+        self.finished = False
+
+    def generation(self, backend, model, prompt_tokens, completion_tokens):
+        """Una generación upstream atribuida a la petición (varias con n, lotes o hedging)"""
+        self.generations += 1
+        self.backend = backend if self.backend in (None, backend) else 'mixed'
+        self.upstream_model = model
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+
+    def first_token(self):
+        if self.ttft is None:
+            self.ttft = time.monotonic() - self.started
+
+
+def _request_fields(body):
+    """Metadatos del cuerpo de la petición (y el cuerpo ya parseado)"""
+    try:
+        data = loads(body) if body else None
+    except ValueError:
+        return {}, None
+    if not isinstance(data, dict):
+        return {}, None
+    fields = {"model": data.get('model')}
+    for name in ('stream', 'max_tokens', 'temperature', 'n'):
+        if name in data:
+            fields[name] = data[name]
+    if isinstance(data.get('messages'), list):
+        fields["messages"] = len(data['messages'])
+    if isinstance(data.get('requests'), list):
+        fields["items"] = len(data['requests'])
+    if 'input' in data:
+        fields["inputs"] = len(data['input']) if isinstance(data['input'], list) else 1
+    return fields, data
+
+
+class RequestJournal:
+    """Escribe una línea JSON por petición sin bloquear a quien la atiende
+
+    finish() solo encola la traza; un hilo la serializa y escribe en lotes
+    (hasta `batch_size` líneas o `flush_interval` segundos). Si la cola se
+    llena las trazas se descartan y se cuentan. Cada proceso escribe en su
+    propio fichero requests-<fecha>-<pid>-<n>.jsonl, que rota al llegar a
+    `max_bytes`; se conservan los `max_files` más recientes del directorio.
+    Los cuerpos de las peticiones solo se guardan con include_bodies.
+    """
+
+    def __init__(self, directory, include_bodies=False, max_bytes=64 * 2 ** 20, max_files=20,
+                 flush_interval=1.0, batch_size=256, queue_size=10000):
+        self.directory = directory
+        self.include_bodies = include_bodies
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._pid = None
+        self._file = None
+        self._path = None
+        self._size = 0
+        self._sequence = 0
+        self._counters = {"written": 0, "dropped": 0, "errors": 0, "rotations": 0}
+
+    @staticmethod
+    def journaled(path):
+        return path.startswith(PATH_PREFIX)
+
+    def begin(self, method, path, body=None):
+        """Traza de la petición (None si la ruta no se registra); body puede ser una función"""
+        trace = None
+        if self.journaled(path):
+            trace = Trace(method, path, body() if callable(body) else body)
+        current_trace.set(trace)
+        return trace
+
+    def finish(self, trace, status, api_key='', priority=None, cache=None):
+        """Encola la traza completa; nunca espera a disco"""
+        if trace is None or trace.finished:
+            return
+        trace.finished = True
+        latency = time.monotonic() - trace.started
+        self._start()
+        try:
+            self._queue.put_nowait((trace, status, api_key, priority, cache, latency))
+        except queue.Full:
+            with self._lock:
+                self._counters["dropped"] += 1
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._file = None
+        threading.Thread(target=self._run, name="request-journal", daemon=True).start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def flush(self):
+        """Escribe lo que quede en cola (al salir del proceso y en los tests)"""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._write(batch)
+
+    def entry(self, trace, status, api_key, priority, cache, latency):
+        fields, data = _request_fields(trace.body)
+        entry = {
+            "ts": round(trace.ts, 6),
+            "method": trace.method,
+            "path": trace.path,
+            "status": status,
+            "key": key_id(api_key),
+            "priority": priority,
+            **fields,
+            "backend": trace.backend,
+            "upstream_model": trace.upstream_model,
+            "generations": trace.generations,
+            "prompt_tokens": trace.prompt_tokens,
+            "completion_tokens": trace.completion_tokens,
+            "ttft": round(trace.ttft, 6) if trace.ttft is not None else None,
+            "latency": round(latency, 6),
+            "cache": cache
+        }
+        if self.include_bodies and data is not None:
+            entry["body"] = data
+        return entry
+
+    def _write(self, batch):
+        lines = []
+        for item in batch:
+            try:
+                lines.append(dumps(self.entry(*item)) + b'\n')
+            except Exception as e:
+                logging.warning(f"Traza no serializable en el journal: {e}")
+        data = b''.join(lines)
+        with self._write_lock:
+            try:
+                if self._file is None or self._size >= self.max_bytes:
+                    self._rotate()
+                self._file.write(data)
+                self._file.flush()
+                self._size += len(data)
+            except OSError as e:
+                logging.error(f"Error escribiendo el journal: {e}")
+                with self._lock:
+                    self._counters["errors"] += len(lines)
+                return
+        with self._lock:
+            self._counters["written"] += len(lines)
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+            with self._lock:
+                self._counters["rotations"] += 1
+        os.makedirs(self.directory, exist_ok=True)
+        self._sequence += 1
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        self._path = os.path.join(self.directory, f"requests-{stamp}-{os.getpid()}-{self._sequence}.jsonl")
+        self._file = open(self._path, 'ab')
+        self._size = self._file.tell()
+        self._prune()
+
+    def _prune(self):
+        files = sorted(glob.glob(os.path.join(self.directory, 'requests-*.jsonl')), key=os.path.getmtime)
+        for path in files[:max(0, len(files) - self.max_files)]:
+            if path != self._path:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        return {
+            **counters,
+            "queued": self._queue.qsize(),
+            "file": self._path,
+            "directory": self.directory,
+            "include_bodies": self.include_bodies
+        }
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_request_journal():
+    """RequestJournal compartido por proceso; None si JOURNAL_ENABLED=false"""
+    global _journal
+    config = load_config()
+    if not config['JOURNAL_ENABLED']:
+        return None
+    with _journal_lock:
+        if _journal is None:
+            _journal = RequestJournal(
+                config['JOURNAL_DIR'],
+                include_bodies=config['JOURNAL_INCLUDE_BODIES'],
+                max_bytes=int(config['JOURNAL_MAX_MB'] * 2 ** 20),
+                max_files=config['JOURNAL_MAX_FILES'],
+                flush_interval=config['JOURNAL_FLUSH_INTERVAL'],
+                queue_size=config['JOURNAL_QUEUE_SIZE']
+            )
+    return _journal
@@ -0,0 +1,165 @@
+# API Key Store - Índice en memoria de api_keys.json con contadores por lotes
+import atexit
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from config.settings import load_config
+
+
+@contextmanager
+def _file_lock(path):
+    """Lock exclusivo entre procesos (workers de gunicorn, APIManager)"""
+    with open(f"{path}.lock", 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _read_keys(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _write_keys(path, keys):
+    """Escritura atómica: fichero temporal + os.replace"""
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.api_keys.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(keys, f, indent=2)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def update_keys_file(path, mutate):
+    """Lee, modifica y reescribe el fichero de keys bajo lock; devuelve las keys resultantes"""
+    with _file_lock(path):
+        keys = _read_keys(path)
+        mutate(keys)
+        _write_keys(path, keys)
+    return keys
+
+
+class KeyStore:
+    """Búsqueda exacta de keys en memoria; los contadores se vuelcan en lotes"""
+
+    def __init__(self, path, flush_interval=5, reload_interval=1):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.reload_interval = reload_interval
+
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._stat = None
+        self._checked_at = 0.0
+        self._pending = {}
+        self._pid = None
+
+    def _file_stat(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            return None
+
+    def _reload_if_changed(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        stat = self._file_stat()
+        if stat == self._stat:
+            return
+        try:
+            keys = _read_keys(self.path)
+        except Exception as e:
+            # Fichero a medio escribir por otro proceso: se reintenta en la próxima comprobación
+            logging.error(f"Error leyendo keys: {e}")
+            return
+        with self._lock:
+            self._keys = keys
+            self._stat = stat
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._pending = {}
+        threading.Thread(target=self._run, name="key-store-flush", daemon=True).start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def get(self, key):
+        """Datos de la key si existe y está activa; None en caso contrario"""
+        if not key:
+            return None
+        self._start()
+        self._reload_if_changed()
+        data = self._keys.get(key)
+        if data is None or not data.get('active', False):
+            return None
+        return data
+
+    def record_usage(self, key, requests=0, tokens=0):
+        """Acumula uso en memoria; flush() lo persiste"""
+        with self._lock:
+            pending = self._pending.setdefault(key, {"requests": 0, "tokens": 0})
+            pending["requests"] += requests
+            pending["tokens"] += tokens
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        def apply(keys):
+            for key, usage in pending.items():
+                if key in keys:
+                    keys[key]['requests'] = keys[key].get('requests', 0) + usage["requests"]
+                    keys[key]['tokens'] = keys[key].get('tokens', 0) + usage["tokens"]
+
+        try:
+            keys = update_keys_file(self.path, apply)
+        except Exception as e:
+            logging.error(f"Error guardando uso de keys: {e}")
+            # Devolver los contadores para el siguiente intento
+            with self._lock:
+                for key, usage in pending.items():
+                    current = self._pending.setdefault(key, {"requests": 0, "tokens": 0})
+                    current["requests"] += usage["requests"]
+                    current["tokens"] += usage["tokens"]
+            return
+        with self._lock:
+            self._keys = keys
+            self._stat = self._file_stat()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_key_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            config = load_config()
+            _store = KeyStore(config['API_KEYS_FILE'], flush_interval=config['KEYS_FLUSH_INTERVAL'])
+    return _store
@@ -0,0 +1,352 @@
+# Metrics - Contadores, gauges e histogramas en formato Prometheus, agregados entre workers
+import atexit
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from api.services.journal import current_trace
+from config.settings import load_config
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TTFT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+TPS_BUCKETS = (1, 5, 10, 20, 40, 80, 160, 320)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+SIMILARITY_BUCKETS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.92, 0.94, 0.96, 0.98, 0.99, 1)
+CONTEXT_BUCKETS = (256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072)
+LOOKUP_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry, name, help, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _reset(self):
+        self._values = {}
+
+    def snapshot(self):
+        return {
+            "type": self.kind,
+            "help": self.help,
+            "labelnames": list(self.labelnames),
+            "values": [[list(key), value] for key, value in self._values.items()]
+        }
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.registry.ensure_process()
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Valor actual; entre workers se suma (p. ej. peticiones en curso)"""
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.registry.ensure_process()
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.registry.ensure_process()
+            # [cuenta por bucket (no acumulada)..., suma, total]
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            entry[-2] += value
+            entry[-1] += 1
+
+    def snapshot(self):
+        data = super().snapshot()
+        data["buckets"] = list(self.buckets)
+        data["values"] = [[key, list(value)] for key, value in data["values"]]
+        return data
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _merge(target, snapshot, include_gauges=True):
+    for name, metric in snapshot.items():
+        if metric["type"] == 'gauge' and not include_gauges:
+            continue
+        current = target.setdefault(name, {**metric, "values": {}})
+        for key, value in metric["values"]:
+            key = tuple(key)
+            if metric["type"] == 'histogram':
+                existing = current["values"].get(key)
+                current["values"][key] = [a + b for a, b in zip(existing, value)] if existing else list(value)
+            else:
+                current["values"][key] = current["values"].get(key, 0) + value
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, key)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return repr(value)
+    return str(value)
+
+
+class MetricsRegistry:
+    """Métricas del proceso con volcado opcional a un directorio compartido
+
+    Con gunicorn cada worker tiene su propia memoria: si directory está definido
+    (METRICS_DIR) cada proceso escribe sus valores en metrics-<pid>.json y
+    /metrics suma los de todos. Los contadores de workers ya terminados se
+    conservan para que los totales no retrocedan; sus gauges se descartan.
+    El directorio debe vaciarse al arrancar el servicio.
+    """
+
+    def __init__(self, directory='', flush_interval=5):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self._metrics = {}
+        self._pid = None
+
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(self, name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Gauge(self, name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(self, name, help, labelnames, buckets))
+
+    def ensure_process(self):
+        """Llamado con self.lock: tras un fork se empieza de cero y se arranca el volcado"""
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        for metric in self._metrics.values():
+            metric._reset()
+        if self.directory:
+            threading.Thread(target=self._run, name="metrics-dump", daemon=True).start()
+            atexit.register(self.dump)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.dump()
+
+    def snapshot(self):
+        with self.lock:
+            return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def dump(self):
+        """Escritura atómica de los valores de este proceso"""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.metrics.', suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, os.path.join(self.directory, f"metrics-{os.getpid()}.json"))
+        except Exception as e:
+            logging.warning(f"No se pudieron volcar las métricas: {e}")
+
+    def collect(self):
+        """Valores de este proceso más los volcados del resto de workers"""
+        merged = {}
+        _merge(merged, self.snapshot())
+        if self.directory:
+            own = os.path.join(self.directory, f"metrics-{os.getpid()}.json")
+            for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+                if path == own:
+                    continue
+                try:
+                    pid = int(os.path.basename(path)[len('metrics-'):-len('.json')])
+                    with open(path) as f:
+                        snapshot = json.load(f)
+                except (ValueError, OSError):
+                    continue
+                _merge(merged, snapshot, include_gauges=_pid_alive(pid))
+        return merged
+
+    def render(self):
+        """Formato de exposición de texto de Prometheus"""
+        lines = []
+        for name, metric in sorted(self.collect().items()):
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            labelnames = metric["labelnames"]
+            for key, value in sorted(metric["values"].items()):
+                if metric["type"] != 'histogram':
+                    lines.append(f"{name}{_format_labels(labelnames, key)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric["buckets"], value):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labelnames, key, ('le', _format_value(bound)))} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labelnames, key, ('le', '+Inf'))} {value[-1]}")
+                lines.append(f"{name}_sum{_format_labels(labelnames, key)} {_format_value(value[-2])}")
+                lines.append(f"{name}_count{_format_labels(labelnames, key)} {value[-1]}")
+        return '\n'.join(lines) + '\n'
+
+
+_config = load_config()
+registry = MetricsRegistry(_config['METRICS_DIR'], _config['METRICS_FLUSH_INTERVAL'])
+
+http_requests = registry.counter(
+    'gateway_http_requests_total', 'HTTP requests served by the gateway', ('method', 'route', 'status'))
+http_latency = registry.histogram(
+    'gateway_http_request_duration_seconds', 'Time to produce the HTTP response (headers for streams)', ('route',))
+routing_decisions = registry.counter(
+    'gateway_routing_decisions_total', 'Routing decisions by chosen backend and reason', ('backend', 'reason'))
+upstream_requests = registry.counter(
+    'gateway_upstream_requests_total', 'Upstream calls by backend, model and status code', ('backend', 'model', 'status'))
+upstream_latency = registry.histogram(
+    'gateway_upstream_duration_seconds', 'Upstream call duration until the last byte', ('backend', 'model'))
+upstream_in_flight = registry.gauge(
+    'gateway_upstream_in_flight', 'Upstream calls currently in progress', ('backend', 'model'))
+time_to_first_token = registry.histogram(
+    'gateway_time_to_first_token_seconds', 'Time until the first streamed token', ('backend', 'model'), TTFT_BUCKETS)
+tokens_per_second = registry.histogram(
+    'gateway_tokens_per_second', 'Generation speed reported by each completion', ('backend', 'model'), TPS_BUCKETS)
+tokens = registry.counter(
+    'gateway_tokens_total', 'Prompt and completion tokens processed', ('backend', 'model', 'type'))
+hedges = registry.counter(
+    'gateway_hedges_total', 'DeepSeek calls started because Ollama missed the first-token deadline')
+hedge_wins = registry.counter(
+    'gateway_hedge_wins_total', 'Hedged requests by the backend that answered first', ('backend',))
+admission_active = registry.gauge(
+    'gateway_admission_active', 'Local generations admitted by the gateway and still running')
+admission_queue_depth = registry.gauge(
+    'gateway_admission_queue_depth', 'Requests waiting for a local generation slot', ('priority',))
+admission_wait = registry.histogram(
+    'gateway_admission_wait_seconds', 'Time spent in the admission queue', ('priority', 'outcome'))
+admission_rejected = registry.counter(
+    'gateway_admission_rejected_total', 'Requests not admitted to Ollama (queue full or wait deadline)',
+    ('priority', 'reason'))
+embedding_batch_inputs = registry.histogram(
+    'gateway_embedding_batch_inputs', 'Texts per Ollama embed call after micro-batching', ('model',),
+    BATCH_SIZE_BUCKETS)
+embedding_batch_requests = registry.histogram(
+    'gateway_embedding_batch_requests', 'Client requests merged into each Ollama embed call', ('model',),
+    BATCH_SIZE_BUCKETS)
+semantic_cache_lookups = registry.counter(
+    'gateway_semantic_cache_lookups_total', 'Semantic cache lookups by result (hit, miss, error)', ('result',))
+semantic_cache_similarity = registry.histogram(
+    'gateway_semantic_cache_similarity', 'Best cosine similarity found per semantic cache lookup', (),
+    SIMILARITY_BUCKETS)
+semantic_cache_seconds = registry.histogram(
+    'gateway_semantic_cache_lookup_seconds', 'Semantic cache lookup time including the prompt embedding', (),
+    LOOKUP_BUCKETS)
+model_placements = registry.counter(
+    'gateway_model_placements_total',
+    'Local model residency at routing time (resident, equivalent, cold, unknown)', ('result',))
+model_warmups = registry.counter(
+    'gateway_model_warmups_total', 'Background model loads into Ollama by result', ('result',))
+context_compactions = registry.counter(
+    'gateway_context_compactions_total', 'Ollama prompts by history compaction result (fits, trimmed, summarized)',
+    ('model', 'result'))
+context_prompt_tokens = registry.histogram(
+    'gateway_context_prompt_tokens', 'Estimated prompt tokens sent to Ollama after compaction', ('model',),
+    CONTEXT_BUCKETS)
+context_num_ctx = registry.histogram(
+    'gateway_context_num_ctx', 'num_ctx requested from Ollama', ('model',), CONTEXT_BUCKETS)
+request_aborts = registry.counter(
+    'gateway_request_aborts_total', 'Requests abandoned before completion (client disconnect or deadline)',
+    ('reason', 'stage'))
+health_probes = registry.counter(
+    'gateway_health_probes_total', 'Background dependency probes by result (up, down)', ('dependency', 'result'))
+
+
+class UpstreamCall:
+    """Mide una llamada upstream: en curso, TTFT, duración y código de respuesta"""
+
+    def __init__(self, backend, model):
+        self.backend = backend
+        self.model = model
+        self.started = time.monotonic()
+        self._first_token = False
+        self._finished = False
+        upstream_in_flight.inc(backend=backend, model=model)
+
+    def first_token(self):
+        if not self._first_token:
+            self._first_token = True
+            time_to_first_token.observe(time.monotonic() - self.started, backend=self.backend, model=self.model)
+            trace = current_trace.get()
+            if trace is not None:
+                trace.first_token()
+
+    def finish(self, status):
+        """status: código HTTP o 'error' si no hubo respuesta; solo cuenta la primera vez"""
+        if self._finished:
+            return
+        self._finished = True
+        upstream_in_flight.dec(backend=self.backend, model=self.model)
+        upstream_requests.inc(backend=self.backend, model=self.model, status=str(status))
+        upstream_latency.observe(time.monotonic() - self.started, backend=self.backend, model=self.model)
+
+
+def observe_generation(backend, model, prompt_tokens, completion_tokens, decode_seconds):
+    if prompt_tokens:
+        tokens.inc(prompt_tokens, backend=backend, model=model, type='prompt')
+    if completion_tokens:
+        tokens.inc(completion_tokens, backend=backend, model=model, type='completion')
+        if decode_seconds and decode_seconds > 0:
+            tokens_per_second.observe(completion_tokens / decode_seconds, backend=backend, model=model)
+
+
+def observe_http(method, route, status, seconds):
+    http_requests.inc(method=method, route=route, status=str(status))
+    http_latency.observe(seconds, route=route)
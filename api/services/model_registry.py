@@ -0,0 +1,301 @@
+# Model Registry - Inventario de modelos locales de Ollama
+import logging
+import os
+import threading
+import time
+
+from config.settings import load_config
+from api.services.http_client import get_upstream_client
+
+
+def parse_nodes(value):
+    """'http://a:11434, http://b:11434' (o una URL por línea) → lista sin duplicados"""
+    nodes = []
+    for item in value.replace('\n', ',').split(','):
+        item = item.split('#', 1)[0].strip().rstrip('/')
+        if item and item not in nodes:
+            nodes.append(item)
+    return nodes
+
+
+class ModelRegistry:
+    """Inventario de los nodos Ollama, refrescado en segundo plano
+
+    Por cada nodo se guardan los modelos instalados (/api/tags) y los cargados
+    en memoria (/api/ps); de cada modelo nuevo, su contexto máximo (/api/show). La lista de nodos sale de nodes_file si existe (se
+    relee al cambiar, sin reiniciar el gateway) o de la lista fija recibida.
+    """
+
+    def __init__(self, nodes, ttl=30, timeout=5, aliases=None, nodes_file='', reload_interval=1):
+        self.static_nodes = parse_nodes(nodes) if isinstance(nodes, str) else list(nodes)
+        self.ttl = ttl
+        self.timeout = timeout
+        self.aliases = dict(aliases or {})
+        self.nodes_file = nodes_file
+        self.reload_interval = reload_interval
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._ready = threading.Event()
+        self._nodes = {url: self._empty_node() for url in self.static_nodes}
+        self._nodes_stat = None
+        self._nodes_checked_at = 0.0
+        self._models = []
+        self._index = {}
+        self._contexts = {}
+        self._fetched_at = 0.0
+        self._pid = None
+
+    @staticmethod
+    def _empty_node():
+        return {"models": [], "names": set(), "loaded": set(), "ps": False, "healthy": False, "refreshed_at": 0.0}
+
+    def start(self):
+        """Arranca el refresco en segundo plano (una vez por proceso)"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        thread = threading.Thread(target=self._run, name="model-registry", daemon=True)
+        thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.clear()
+            self.refresh()
+            self._ready.set()
+            self._wakeup.wait(self.ttl)
+
+    def reload_nodes(self):
+        """Relee nodes_file si cambió; devuelve True si la lista de nodos es distinta"""
+        self._nodes_checked_at = time.monotonic()
+        if not self.nodes_file:
+            return False
+        try:
+            stat = os.stat(self.nodes_file)
+            current = (stat.st_mtime_ns, stat.st_size)
+            if current == self._nodes_stat:
+                return False
+            with open(self.nodes_file) as f:
+                urls = parse_nodes(f.read())
+        except FileNotFoundError:
+            current, urls = None, self.static_nodes
+            if self._nodes_stat is None:
+                return False
+        except OSError as e:
+            logging.warning(f"No se pudo leer {self.nodes_file}: {e}")
+            return False
+
+        with self._lock:
+            self._nodes_stat = current
+            if urls == list(self._nodes):
+                return False
+            self._nodes = {url: self._nodes.get(url) or self._empty_node() for url in urls}
+        logging.info(f"Nodos Ollama: {', '.join(urls) or '(ninguno)'}")
+        self._rebuild_index()
+        return True
+
+    def _reload_nodes_if_due(self):
+        if self.nodes_file and time.monotonic() - self._nodes_checked_at >= self.reload_interval:
+            if self.reload_nodes():
+                # Inventario de los nodos nuevos cuanto antes
+                self.invalidate()
+
+    def _fetch(self, url, path):
+        response = get_upstream_client('ollama').get(f"{url}{path}", timeout=self.timeout)
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} devolvió {response.status_code}")
+        return response.json().get('models', [])
+
+    def _refresh_node(self, url):
+        try:
+            models = self._fetch(url, '/api/tags')
+        except Exception as e:
+            logging.warning(f"No se pudo refrescar el inventario de Ollama en {url}: {e}")
+            with self._lock:
+                if url in self._nodes:
+                    self._nodes[url]["healthy"] = False
+            return False
+        try:
+            loaded, ps = {m.get('name') or m.get('model') for m in self._fetch(url, '/api/ps')}, True
+        except Exception:
+            # Versiones antiguas de Ollama sin /api/ps
+            loaded, ps = set(), False
+
+        with self._lock:
+            unknown = {m['name'] for m in models} - set(self._contexts)
+        for name in unknown:
+            self._fetch_context(url, name)
+
+        with self._lock:
+            if url in self._nodes:
+                self._nodes[url] = {
+                    "models": models,
+                    "names": {m['name'] for m in models},
+                    "loaded": loaded,
+                    "ps": ps,
+                    "healthy": True,
+                    "refreshed_at": time.time()
+                }
+        return True
+
+    def _fetch_context(self, url, name):
+        try:
+            response = get_upstream_client('ollama').post(
+                f"{url}/api/show", json={"model": name, "name": name}, timeout=self.timeout)
+            if response.status_code != 200:
+                return
+            info = response.json().get('model_info') or {}
+        except Exception as e:
+            logging.debug(f"Sin /api/show de {name} en {url}: {e}")
+            return
+        # p.ej. "qwen2.context_length"; 0 si el modelo no lo informa (no se vuelve a preguntar)
+        length = next((v for k, v in info.items() if k.endswith('.context_length') and isinstance(v, int)), 0)
+        with self._lock:
+            self._contexts[name] = length
+
+    def _rebuild_index(self):
+        with self._lock:
+            nodes = list(self._nodes.values())
+        models = {}
+        for node in nodes:
+            for m in node["models"]:
+                models.setdefault(m['name'], m)
+
+        index = {}
+        for name in models:
+            index[name] = name
+            if name.endswith(':latest'):
+                index.setdefault(name[:-len(':latest')], name)
+        for alias, target in self.aliases.items():
+            if target in index:
+                index.setdefault(alias, index[target])
+
+        with self._lock:
+            self._models = list(models.values())
+            self._index = index
+
+    def refresh(self):
+        """Consulta todos los nodos; un nodo que falla conserva su último inventario"""
+        self.reload_nodes()
+        with self._lock:
+            urls = list(self._nodes)
+        results = [self._refresh_node(url) for url in urls]
+        self._rebuild_index()
+        if any(results):
+            self._fetched_at = time.time()
+        return any(results)
+
+    def refresh_loaded(self):
+        """Solo /api/ps de los nodos sanos: qué modelos siguen en memoria (más barato que refresh)"""
+        with self._lock:
+            urls = [url for url, node in self._nodes.items() if node["healthy"] and node["ps"]]
+        for url in urls:
+            try:
+                loaded = {m.get('name') or m.get('model') for m in self._fetch(url, '/api/ps')}
+            except Exception as e:
+                logging.debug(f"/api/ps de {url}: {e}")
+                continue
+            with self._lock:
+                if url in self._nodes:
+                    self._nodes[url]["loaded"] = loaded
+
+    def mark_loaded(self, url, model):
+        """El nodo acaba de responder con el modelo: ya está en memoria"""
+        with self._lock:
+            node = self._nodes.get(url)
+            if node is not None:
+                node["loaded"].add(model)
+
+    def residency(self, model):
+        """True si algún nodo sano tiene el modelo en memoria, False si no, None si no se sabe (sin /api/ps)"""
+        with self._lock:
+            nodes = [node for node in self._nodes.values() if node["healthy"] and model in node["names"]]
+        if any(model in node["loaded"] for node in nodes):
+            return True
+        if any(node["ps"] for node in nodes):
+            return False
+        return None
+
+    def invalidate(self):
+        """Fuerza un refresco inmediato en segundo plano (p.ej. tras un 404 de Ollama)"""
+        self._wakeup.set()
+
+    def mark_down(self, url):
+        """El nodo no responde: fuera del reparto hasta que vuelva a contestar a /api/tags"""
+        with self._lock:
+            if url in self._nodes:
+                self._nodes[url]["healthy"] = False
+        self.invalidate()
+
+    def urls(self):
+        """URLs de los nodos configurados, sanos o no"""
+        with self._lock:
+            return list(self._nodes)
+
+    def wait_ready(self, timeout=None):
+        """Espera al primer intento de refresco (con o sin éxito)"""
+        return self._ready.wait(self.timeout + 1 if timeout is None else timeout)
+
+    def _ensure_loaded(self):
+        # Solo el primer uso espera al primer refresco; después se sirve de memoria
+        self.start()
+        self.wait_ready()
+
+    def resolve(self, model):
+        """Devuelve el nombre real del modelo en Ollama, o None si no está disponible"""
+        self._ensure_loaded()
+        return self._index.get(model)
+
+    def is_local(self, model):
+        return self.resolve(model) is not None
+
+    def models(self):
+        """Lista de modelos (unión de todos los nodos) tal como la devuelve /api/tags"""
+        self._ensure_loaded()
+        return list(self._models)
+
+    def context_length(self, model):
+        """Contexto máximo del modelo (nombre ya resuelto) según Ollama, o None si no se conoce"""
+        return self._contexts.get(model) or None
+
+    def nodes_for(self, model):
+        """Nodos sanos que tienen el modelo (nombre ya resuelto): [(url, cargado en memoria)]"""
+        self._reload_nodes_if_due()
+        with self._lock:
+            return [
+                (url, model in node["loaded"])
+                for url, node in self._nodes.items()
+                if node["healthy"] and model in node["names"]
+            ]
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                url: {
+                    "healthy": node["healthy"],
+                    "models": sorted(node["names"]),
+                    "loaded": sorted(node["loaded"]),
+                    "refreshed_at": node["refreshed_at"]
+                }
+                for url, node in self._nodes.items()
+            }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_model_registry():
+    """Registro compartido por el router y los endpoints de listado"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            config = load_config()
+            _registry = ModelRegistry(
+                config['OLLAMA_NODES'] or config['OLLAMA_URL'],
+                ttl=config['OLLAMA_MODELS_TTL'],
+                aliases=config['MODEL_ALIASES'],
+                nodes_file=config['OLLAMA_NODES_FILE']
+            )
+    return _registry
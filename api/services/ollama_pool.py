@@ -0,0 +1,118 @@
+# Ollama Pool - Reparto entre nodos Ollama por carga y afinidad de conversación
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from config.settings import load_config
+from api.services.backend_health import get_backend_health
+from api.services.model_registry import get_model_registry
+
+
+def affinity_key(messages, session=None):
+    """Identifica la conversación: cabecera de sesión o hash del inicio de los mensajes
+
+    El system prompt y el primer mensaje de usuario no cambian entre turnos, así
+    que todos los turnos de una conversación caen en el mismo nodo y Ollama
+    reutiliza su caché de prompt.
+    """
+    if session:
+        return f"session:{session}"
+    if not messages:
+        return None
+    prefix = json.dumps(messages[:2], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(prefix.encode('utf-8')).hexdigest()
+
+
+class OllamaPool:
+    """Elige el nodo para cada petición
+
+    Entre los nodos sanos que tienen el modelo gana el de menos peticiones en
+    curso y, a igualdad, el que ya lo tiene cargado en memoria. Un nodo que
+    tendría que cargarlo cuenta `cold_penalty` peticiones más: esperar a un
+    nodo caliente suele ser más rápido que cargar los pesos. Si la
+    conversación ya pasó por un nodo se repite, salvo que esté más de `slack`
+    peticiones por encima del nodo menos cargado. Con `health` (BackendNodes)
+    se saltan los nodos con el circuito abierto.
+    """
+
+    def __init__(self, registry, affinity=True, affinity_ttl=600, affinity_slack=2, max_affinity=10000,
+                 cold_penalty=0, health=None):
+        self.registry = registry
+        self.health = health
+        self.affinity = affinity
+        self.affinity_ttl = affinity_ttl
+        self.affinity_slack = affinity_slack
+        self.max_affinity = max_affinity
+        self.cold_penalty = cold_penalty
+
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._pins = OrderedDict()
+        self._counters = {"picks": 0, "affinity_hits": 0, "no_node": 0, "circuit_skips": 0}
+
+    def pick(self, model, key=None):
+        """URL del nodo elegido, o None si ningún nodo sano tiene el modelo"""
+        candidates = self.registry.nodes_for(model)
+        allowed = [c for c in candidates if self.health.node(c[0]).allow_request()] if self.health else candidates
+        now = time.monotonic()
+        with self._lock:
+            self._counters["picks"] += 1
+            self._counters["circuit_skips"] += len(candidates) - len(allowed)
+            candidates = allowed
+            if not candidates:
+                self._counters["no_node"] += 1
+                return None
+
+            loads = {
+                url: self._in_flight.get(url, 0) + (0 if loaded else self.cold_penalty)
+                for url, loaded in candidates
+            }
+            url = min(candidates, key=lambda c: (loads[c[0]], not c[1]))[0]
+
+            if self.affinity and key:
+                pinned = self._pins.pop(key, None)
+                if pinned and now - pinned[1] < self.affinity_ttl and pinned[0] in loads:
+                    if loads[pinned[0]] - loads[url] <= self.affinity_slack:
+                        url = pinned[0]
+                        self._counters["affinity_hits"] += 1
+                self._pins[key] = (url, now)
+                while len(self._pins) > self.max_affinity:
+                    self._pins.popitem(last=False)
+            return url
+
+    def begin(self, url):
+        with self._lock:
+            self._in_flight[url] = self._in_flight.get(url, 0) + 1
+
+    def end(self, url):
+        with self._lock:
+            self._in_flight[url] = max(0, self._in_flight.get(url, 0) - 1)
+
+    def stats(self):
+        nodes = self.registry.snapshot()
+        with self._lock:
+            for url, node in nodes.items():
+                node["in_flight"] = self._in_flight.get(url, 0)
+            return {**self._counters, "pinned_conversations": len(self._pins), "nodes": nodes}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_ollama_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            config = load_config()
+            _pool = OllamaPool(
+                get_model_registry(),
+                affinity=config['OLLAMA_AFFINITY'],
+                affinity_ttl=config['OLLAMA_AFFINITY_TTL'],
+                affinity_slack=config['OLLAMA_AFFINITY_SLACK'],
+                cold_penalty=config['OLLAMA_COLD_PENALTY'],
+                health=get_backend_health('ollama')
+            )
+    return _pool
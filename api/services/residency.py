@@ -0,0 +1,208 @@
+# Model Residency - Modelos calientes en Ollama: precarga, keep_alive y rutas sin cargas en frío
+import logging
+import os
+import threading
+import time
+
+from api.services.codec import JSON_HEADERS, dumps
+from api.services.http_client import get_upstream_client
+from api.services.metrics import model_placements, model_warmups
+from api.services.model_registry import get_model_registry
+from config.settings import load_config
+
+COLD_POLICIES = ('load', 'deepseek')
+
+
+def parse_keep_alive(value):
+    """'-1' / '3600' → número (segundos, negativo = sin caducidad); '10m' se deja como duración"""
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def parse_equivalents(mapping):
+    """{'a': 'b|c'} → {'a': ['b', 'c']}"""
+    return {model: [name.strip() for name in targets.split('|') if name.strip()] for model, targets in mapping.items()}
+
+
+class ModelResidency:
+    """Qué modelos están en memoria en Ollama y qué hacer con los que no
+
+    Los modelos `hot` se precargan al arrancar en cada nodo que los tiene y se
+    vuelven a cargar si Ollama los expulsa (como mucho una vez cada
+    `warm_interval` por nodo), con su keep_alive (-1 si no se indica otro).
+    Un hilo consulta /api/ps cada `interval` segundos. place() cambia un modelo
+    frío por un equivalente ya cargado; con cold_policy='deepseek' el router
+    envía a DeepSeek lo que obligaría a cargar pesos.
+    """
+
+    def __init__(self, registry, hot=(), keep_alive=None, default_keep_alive='', equivalents=None,
+                 cold_policy='load', interval=5, warm_interval=60, load_timeout=300):
+        self.registry = registry
+        self.hot = list(hot)
+        self.keep_alive = dict(keep_alive or {})
+        self.default_keep_alive = default_keep_alive
+        self.equivalents = dict(equivalents or {})
+        self.cold_policy = cold_policy if cold_policy in COLD_POLICIES else COLD_POLICIES[0]
+        self.interval = interval
+        self.warm_interval = warm_interval
+        self.load_timeout = load_timeout
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._warming = set()
+        self._warmed_at = {}
+        self._pid = None
+        self._counters = {"resident": 0, "equivalent": 0, "cold": 0, "unknown": 0, "warmups": 0, "warmup_errors": 0}
+
+    def _resolve(self, name):
+        return self.registry.resolve(name) or name
+
+    def hot_models(self):
+        """Nombres reales en Ollama de los modelos calientes instalados"""
+        return [model for model in (self.registry.resolve(name) for name in self.hot) if model]
+
+    def keep_alive_for(self, model):
+        """keep_alive para las peticiones del modelo (nombre ya resuelto), o None para el de Ollama"""
+        for name, value in self.keep_alive.items():
+            if self._resolve(name) == model:
+                return parse_keep_alive(value)
+        if model in self.hot_models():
+            return -1
+        return parse_keep_alive(self.default_keep_alive)
+
+    @property
+    def avoid_cold(self):
+        return self.cold_policy == 'deepseek'
+
+    def place(self, model):
+        """(modelo a usar, resultado): resident, equivalent (otro ya cargado), cold o unknown (sin /api/ps)"""
+        state = self.registry.residency(model)
+        result, placed = ('unknown' if state is None else 'resident' if state else 'cold'), model
+        if result == 'cold':
+            for name, targets in self.equivalents.items():
+                if self._resolve(name) != model:
+                    continue
+                for target in targets:
+                    candidate = self.registry.resolve(target)
+                    if candidate and candidate != model and self.registry.residency(candidate):
+                        result, placed = 'equivalent', candidate
+                        break
+                break
+            if result == 'cold' and model in self.hot_models():
+                # Caliente pero expulsado: recargar ya en segundo plano
+                self._wakeup.set()
+        with self._lock:
+            self._counters[result] += 1
+        model_placements.inc(result=result)
+        return placed, result
+
+    def start(self):
+        """Arranca el sondeo de /api/ps y la precarga (una vez por proceso)"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        thread = threading.Thread(target=self._run, name="model-residency", daemon=True)
+        thread.start()
+
+    def _run(self):
+        self.registry.start()
+        self.registry.wait_ready()
+        while True:
+            self._wakeup.clear()
+            try:
+                self.registry.refresh_loaded()
+                self.warm_missing()
+            except Exception as e:
+                logging.warning(f"Residencia de modelos: {e}")
+            self._wakeup.wait(self.interval)
+
+    def warm_missing(self):
+        """Carga los modelos calientes en los nodos que no los tienen en memoria"""
+        now = time.monotonic()
+        started = []
+        for model in self.hot_models():
+            for url, loaded in self.registry.nodes_for(model):
+                key = (url, model)
+                with self._lock:
+                    if loaded or key in self._warming or now - self._warmed_at.get(key, -self.warm_interval) < self.warm_interval:
+                        continue
+                    self._warming.add(key)
+                    self._warmed_at[key] = now
+                thread = threading.Thread(target=self.warm, args=(url, model), name="model-warmup", daemon=True)
+                thread.start()
+                started.append(key)
+        return started
+
+    def warm(self, url, model):
+        """Carga el modelo en el nodo sin generar nada (/api/generate sin prompt)"""
+        payload = {"model": model, "keep_alive": self.keep_alive_for(model)}
+        client = get_upstream_client('ollama')
+        try:
+            response = client.post(f"{url}/api/generate", data=dumps(payload), headers=JSON_HEADERS,
+                                   timeout=self.load_timeout)
+            if response.status_code == 400:
+                # Modelos solo de embeddings: no admiten generate
+                response = client.post(f"{url}/api/embed", data=dumps({**payload, "input": ""}),
+                                       headers=JSON_HEADERS, timeout=self.load_timeout)
+            ok = response.status_code == 200
+            if not ok:
+                logging.warning(f"No se pudo precargar {model} en {url}: {response.status_code}")
+        except Exception as e:
+            logging.warning(f"No se pudo precargar {model} en {url}: {e}")
+            ok = False
+        with self._lock:
+            self._warming.discard((url, model))
+            self._counters["warmups" if ok else "warmup_errors"] += 1
+        model_warmups.inc(result='ok' if ok else 'error')
+        if ok:
+            self.registry.mark_loaded(url, model)
+        return ok
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            warming = sorted(f"{model}@{url}" for url, model in self._warming)
+        return {
+            **counters,
+            "hot": self.hot,
+            "keep_alive": self.keep_alive,
+            "cold_policy": self.cold_policy,
+            "equivalents": self.equivalents,
+            "warming": warming,
+            "loaded": {url: node["loaded"] for url, node in self.registry.snapshot().items()}
+        }
+
+
+_residency = None
+_residency_lock = threading.Lock()
+
+
+def get_model_residency():
+    """ModelResidency compartida por proceso (arranca el sondeo); None si OLLAMA_RESIDENCY=false"""
+    global _residency
+    config = load_config()
+    if not config['OLLAMA_RESIDENCY']:
+        return None
+    with _residency_lock:
+        if _residency is None:
+            _residency = ModelResidency(
+                get_model_registry(),
+                hot=[name.strip() for name in config['OLLAMA_PRELOAD_MODELS'].split(',') if name.strip()],
+                keep_alive=config['OLLAMA_KEEP_ALIVE'],
+                default_keep_alive=config['OLLAMA_KEEP_ALIVE_DEFAULT'],
+                equivalents=parse_equivalents(config['MODEL_EQUIVALENTS']),
+                cold_policy=config['OLLAMA_COLD_POLICY'],
+                interval=config['OLLAMA_PS_INTERVAL'],
+                warm_interval=config['OLLAMA_WARM_INTERVAL']
+            )
+    _residency.start()
+    return _residency
@@ -1,66 +1,441 @@
 # API Router - Decide entre modelo local o remoto
-import requests
-import json
 import logging
+import time
+import uuid
 from config.settings import load_config
+from api.services.model_registry import get_model_registry
+from api.services.http_client import get_upstream_client
+from api.services.streaming import OllamaChunkConverter, SSE_DONE, TrackedStream, completion_from_chunks
+from api.services.routing_policy import build_routing_policy, estimate_prompt_tokens, log_decision, RoutingDecision
+from api.services.backend_health import get_backend_health, is_backend_failure, BackendUnavailable
+from api.services.metrics import UpstreamCall, observe_generation
+from api.services.usage import get_usage_recorder
+from api.services.ollama_pool import affinity_key, get_ollama_pool
+from api.services.hedging import HedgeCancelled, PrefetchedStream, get_hedge_policy, prefetch
+from api.services.admission import AdmissionTimeout, current_priority, get_admission_queue
+from api.services.codec import JSON_HEADERS, RawCompletion, dumps, loads
+from api.services.embeddings import get_embedding_batcher
+from api.services.context_window import SUMMARY_HEADER, get_context_window
+from api.services.residency import get_model_residency
+from api.services.cancellation import RequestAborted, current_scope
+
+SUMMARY_PROMPT = (
+    "Resume la conversación en pocas frases: hechos, decisiones, datos y preguntas pendientes "
+    "que hagan falta para continuarla. Responde solo con el resumen."
+)
+
+def stream_closer(health, token, call, release=None):
+    """on_close de un stream: cierra la medición del circuit breaker y de métricas"""
+    def on_close(ok):
+        if ok is None:
+            # Cancelado por el gateway (hedge perdido): no es un fallo del backend
+            health.cancel(token)
+            call.finish('cancelled')
+        else:
+            health.end(token, ok)
+            call.finish(200 if ok else 'stream_error')
+        if release:
+            release()
+    return on_close
 
 class AIRouter:
     """Decide qué modelo usar basado en complejidad y disponibilidad"""
     
     def __init__(self):
         self.config = load_config()
-        self.ollama_url = self.config.get('OLLAMA_URL', 'http://localhost:11434')
         self.deepseek_url = self.config.get('DEEPSEEK_URL', 'https://api.deepseek.com/chat/completions')
         self.deepseek_key = self.config.get('DEEPSEEK_API_KEY', '')
+        self.models = get_model_registry()
+        self.pool = get_ollama_pool()
         
         self.remote_models = ['deepseek', 'reasoner', 'coder']
-        self.complexity_threshold = 500
+        self.policy = build_routing_policy(self.config)
+        self.health = {name: get_backend_health(name) for name in ('ollama', 'deepseek')}
+        self.hedging = get_hedge_policy()
+        self.admission = get_admission_queue()
+        self.embeddings = self._embedding_batcher()
+        self.context = get_context_window(self._summarize)
+        self.residency = get_model_residency()
+    
+    def _embedding_batcher(self):
+        """EmbeddingBatcher compartido del proceso (AsyncAIRouter usa el suyo, asyncio)"""
+        return get_embedding_batcher(self._embed_batch)
     
-    def is_complex_request(self, messages):
-        total_chars = sum(len(str(m.get('content', ''))) for m in messages)
-        return total_chars > self.complexity_threshold
+    @property
+    def ollama(self):
+        return get_upstream_client('ollama')
+    
+    @property
+    def deepseek(self):
+        return get_upstream_client('deepseek')
     
     def is_local_model_available(self, model):
-        try:
-            response = requests.get(f"{self.ollama_url}/api/tags", timeout=5)
-            if response.status_code == 200:
-                models = response.json().get('models', [])
-                model_names = [m['name'] for m in models]
-                return any(model in name for name in model_names)
-        except:
-            pass
-        return False
-    
-    def route_request(self, model, messages, temperature, max_tokens, stream):
+        return self.models.is_local(model)
+    
+    def choose_backend(self, model, messages, max_tokens):
+        """Devuelve (decisión, modelo de Ollama resuelto o None)"""
         if any(rm in model.lower() for rm in self.remote_models):
-            return self.call_deepseek(model, messages, temperature, max_tokens, stream)
+            decision = RoutingDecision('deepseek', 'remote_model', {"model": model})
+            local_model = None
+        else:
+            local_model = self.models.resolve(model)
+            placement = None
+            if local_model and self.residency:
+                # Mejor un equivalente ya en memoria que esperar a que Ollama cargue pesos
+                local_model, placement = self.residency.place(local_model)
+            if local_model and not self.health['ollama'].allow_request():
+                # Ollama degradado: fallback inmediato en lugar de esperar al timeout
+                decision = RoutingDecision('deepseek', 'circuit_open', {"model": model})
+            elif placement == 'cold' and self.residency.avoid_cold and self.health['deepseek'].allow_request():
+                decision = RoutingDecision('deepseek', 'cold_model', {"model": model, "local_model": local_model})
+            else:
+                decision = self.policy.decide(model, messages, max_tokens, local_model, self.health)
+        
+        if decision.backend == 'deepseek' and not self.health['deepseek'].allow_request():
+            if local_model and self.health['ollama'].allow_request():
+                decision = RoutingDecision('ollama', 'remote_circuit_open', {"model": model})
+            else:
+                log_decision(RoutingDecision('none', 'circuit_open', {"model": model}))
+                raise BackendUnavailable('deepseek', self.health['deepseek'].retry_after())
         
-        if self.is_complex_request(messages):
-            logging.info(f"Solicitud compleja → DeepSeek")
-            return self.call_deepseek(model, messages, temperature, max_tokens, stream)
+        log_decision(decision)
+        return decision, local_model
+    
+    def route_request(self, model, messages, temperature, max_tokens, stream, session=None):
+        decision, local_model = self.choose_backend(model, messages, max_tokens)
+        if decision.backend == 'ollama' and self.hedging:
+            return self.hedged(local_model, model, messages, temperature, max_tokens, stream, session)
+        return self.dispatch(decision, local_model, model, messages, temperature, max_tokens, stream, session)
+    
+    def dispatch(self, decision, local_model, model, messages, temperature, max_tokens, stream, session=None):
+        """Ejecuta una decisión de choose_backend (los lotes la toman antes de esperar turno)"""
+        if decision.backend == 'ollama':
+            logging.info(f"Modelo local → Ollama ({local_model})")
+            return self.call_ollama(local_model, messages, temperature, max_tokens, stream, session)
         
-        if self.is_local_model_available(model):
-            logging.info(f"Modelo local → Ollama ({model})")
-            return self.call_ollama(model, messages, temperature, max_tokens, stream)
+        logging.info(f"{decision.reason} → DeepSeek")
+        return self.call_deepseek(model, messages, temperature, max_tokens, stream)
+    
+    def hedged(self, local_model, model, messages, temperature, max_tokens, stream, session=None):
+        """Ollama con DeepSeek en paralelo si el primer token no llega a tiempo
+
+        Ollama se pide siempre en streaming para ver su primer token y poder
+        cortarlo; sin stream la respuesta se reconstruye de los chunks. Gana la
+        primera rama en dar un token (stream) o la respuesta completa (sin stream).
+        """
+        scope = current_scope.get()
         
+        def ollama(leg):
+            events = self.call_ollama(local_model, messages, temperature, max_tokens, True, session,
+                                      fallback=False, include_usage=not stream)
+            try:
+                # El primer evento (rol) no espera al modelo; el segundo es el primer token
+                buffered = prefetch(events, 2)
+                leg.first_token()
+                if stream:
+                    return PrefetchedStream(buffered, events)
+                for event in events:
+                    leg.check()
+                    if scope is not None:
+                        scope.check()
+                    buffered.append(event)
+                return completion_from_chunks(buffered)
+            except (HedgeCancelled, RequestAborted):
+                events.cancel()
+                raise
+        
+        def deepseek(leg):
+            result = self.fallback_to_deepseek(model, messages, temperature, max_tokens, stream)
+            if not stream:
+                return result
+            try:
+                buffered = prefetch(result, 1)
+                leg.first_token()
+            except HedgeCancelled:
+                result.cancel()
+                raise
+            return PrefetchedStream(buffered, result)
+        
+        return self.hedging.run(ollama, deepseek, self.health['deepseek'].allow_request)
+    
+    def fallback_to_deepseek(self, model, messages, temperature, max_tokens, stream):
+        if not self.health['deepseek'].allow_request():
+            raise BackendUnavailable('deepseek', self.health['deepseek'].retry_after())
         logging.info(f"Fallback → DeepSeek")
         return self.call_deepseek(model, messages, temperature, max_tokens, stream)
     
-    def call_ollama(self, model, messages, temperature, max_tokens, stream):
-        ollama_messages = self._convert_to_ollama(messages)
-        payload = {
-            "model": model,
-            "messages": ollama_messages,
-            "options": {"temperature": temperature, "num_predict": max_tokens},
-            "stream": stream
-        }
+    def call_ollama(self, model, messages, temperature, max_tokens, stream, session=None,
+                    fallback=True, include_usage=False):
+        """Genera en un nodo Ollama; si falla pasa a DeepSeek (o lanza la excepción con fallback=False)
+
+        Si se vigila la conexión del cliente, sin stream Ollama se pide igualmente
+        en streaming y la respuesta se arma de los chunks: así se puede cortar la
+        generación en cuanto el cliente se va o vence el plazo.
+        """
+        scope = current_scope.get()
+        collect = not stream and scope is not None and scope.probe is not None
+        payload = self._ollama_payload(model, messages, temperature, max_tokens, stream or collect)
         
-        response = requests.post(f"{self.ollama_url}/api/chat", json=payload, timeout=120)
+        # Turno en la cola de admisión antes de elegir nodo (la carga cambia mientras se espera)
+        try:
+            slot = self.admission.acquire(current_priority.get()) if self.admission else None
+        except AdmissionTimeout as e:
+            logging.warning(f"Cola de Ollama: {e}")
+            if not fallback:
+                raise
+            return self.fallback_to_deepseek(model, messages, temperature, max_tokens, stream)
+        
+        # Quien esperaba turno puede haberse ido o agotado su plazo mientras tanto
+        try:
+            timeout = self._upstream_timeout(scope, stream, self.ollama, 'admission')
+        except RequestAborted:
+            self._release(None, slot)
+            raise
+        
+        node = self.pool.pick(model, affinity_key(messages, session))
+        if node is None:
+            self._release(None, slot)
+            logging.warning(f"Ningún nodo Ollama disponible con {model}")
+            if not fallback:
+                raise Exception(f"Ningún nodo Ollama disponible con {model}")
+            return self.fallback_to_deepseek(model, messages, temperature, max_tokens, stream)
+        
+        health = self.health['ollama'].node(node)
+        token = health.begin()
+        call = UpstreamCall('ollama', model)
+        self.pool.begin(node)
+        try:
+            response = self.ollama.post(f"{node}/api/chat", data=dumps(payload), headers=JSON_HEADERS,
+                                        stream=stream or collect, timeout=timeout)
+        except Exception as e:
+            if scope is not None and scope.expired():
+                # Plazo de la petición, no un fallo del nodo
+                health.cancel(token)
+                call.finish('cancelled')
+                self._release(node, slot)
+                scope.check()
+            health.end(token, ok=False)
+            call.finish('error')
+            self._release(node, slot)
+            self.models.mark_down(node)
+            logging.warning(f"Ollama error ({node}): {e}")
+            if not fallback:
+                raise
+            return self.fallback_to_deepseek(model, messages, temperature, max_tokens, stream)
         
         if response.status_code == 200:
-            return self._convert_from_ollama(response.json(), model)
+            self.models.mark_loaded(node, model)
+            if stream:
+                return TrackedStream(
+                    self._stream_from_ollama(response, model, call, include_usage),
+                    stream_closer(health, token, call, lambda: self._release(node, slot))
+                )
+            try:
+                result = self._collect_from_ollama(response, scope) if collect else loads(response.content)
+            except RequestAborted:
+                health.cancel(token)
+                call.finish('cancelled')
+                raise
+            except Exception:
+                health.end(token, ok=False)
+                call.finish('stream_error')
+                raise
+            finally:
+                self._release(node, slot)
+            health.end(token, ok=True)
+            call.finish(200)
+            self._observe_ollama(result, model)
+            return self._convert_from_ollama(result, model)
         else:
-            return self.call_deepseek(model, messages, temperature, max_tokens, stream)
+            response.close()
+            self._release(node, slot)
+            health.end(token, ok=not is_backend_failure(response.status_code))
+            call.finish(response.status_code)
+            if response.status_code == 404:
+                # El modelo ya no existe en Ollama: refrescar el inventario
+                self.models.invalidate()
+            if not fallback:
+                raise Exception(f"Ollama API error: {response.status_code}")
+            return self.fallback_to_deepseek(model, messages, temperature, max_tokens, stream)
+    
+    @staticmethod
+    def _upstream_timeout(scope, stream, client, stage='upstream'):
+        """Timeout de lectura upstream acotado por el plazo de la petición (los streams se vigilan por evento)"""
+        if scope is None:
+            return None
+        scope.check(stage)
+        return None if stream else scope.timeout(client.read_timeout)
+    
+    @staticmethod
+    def _collect_from_ollama(response, scope):
+        """La respuesta sin stream de Ollama armada de su NDJSON; se corta si el cliente se va o vence el plazo"""
+        content = []
+        try:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                scope.check()
+                data = loads(line)
+                if data.get('error'):
+                    raise Exception(f"Ollama error: {data['error']}")
+                content.append(data.get('message', {}).get('content', ''))
+                if data.get('done'):
+                    data['message'] = {"role": "assistant", "content": ''.join(content)}
+                    return data
+            raise Exception("Ollama stream ended without a final chunk")
+        finally:
+            response.close()
+    
+    def _ollama_payload(self, model, messages, temperature, max_tokens, stream):
+        """Cuerpo de /api/chat con el historial ajustado al contexto del modelo y su num_ctx"""
+        options = {"temperature": temperature, "num_predict": max_tokens}
+        if self.context:
+            compaction = self.context.compact(model, messages, max_tokens, self.models.context_length(model))
+            messages = compaction.messages
+            options["num_ctx"] = compaction.num_ctx
+        payload = {"model": model, "messages": self._convert_to_ollama(messages), "options": options, "stream": stream}
+        self._keep_alive(payload)
+        return payload
+    
+    def _keep_alive(self, payload):
+        keep_alive = self.residency.keep_alive_for(payload["model"]) if self.residency else None
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+    
+    def _summarize(self, model, previous, messages):
+        """Resumen de los turnos recortados (hilo de fondo de ContextWindow)
+
+        Siempre síncrono, también bajo ASGI, y con turno batch en la cola de
+        admisión para no quitar hueco a las peticiones interactivas.
+        """
+        if self.config['CONTEXT_SUMMARY_MODEL']:
+            model = self.models.resolve(self.config['CONTEXT_SUMMARY_MODEL'])
+            if model is None:
+                raise Exception(f"Modelo de resúmenes no disponible: {self.config['CONTEXT_SUMMARY_MODEL']}")
+        transcript = '\n'.join(f"{m.get('role', 'user')}: {m.get('content', '')}" for m in messages)
+        if previous:
+            transcript = f"{SUMMARY_HEADER}\n{previous}\n\n{transcript}"
+        payload = self._ollama_payload(
+            model, [{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": transcript}],
+            0.2, self.config['CONTEXT_SUMMARY_TOKENS'], False
+        )
+        
+        slot = self.admission.acquire('batch') if self.admission else None
+        node = self.pool.pick(model)
+        if node is None:
+            self._release(None, slot)
+            raise Exception(f"Ningún nodo Ollama disponible con {model}")
+        health = self.health['ollama'].node(node)
+        token = health.begin()
+        call = UpstreamCall('ollama', model)
+        self.pool.begin(node)
+        try:
+            response = get_upstream_client('ollama').post(f"{node}/api/chat", data=dumps(payload), headers=JSON_HEADERS)
+            body = response.content
+        except Exception:
+            health.end(token, ok=False)
+            call.finish('error')
+            raise
+        finally:
+            self._release(node, slot)
+        health.end(token, ok=not is_backend_failure(response.status_code))
+        call.finish(response.status_code)
+        if response.status_code != 200:
+            raise Exception(f"Ollama API error: {response.status_code}")
+        result = loads(body)
+        self._observe_ollama(result, model)
+        return result.get('message', {}).get('content', '')
+    
+    def resolve_embedding_model(self, model):
+        """Modelo de Ollama para /v1/embeddings; los nombres de OpenAI usan EMBEDDING_MODEL"""
+        return (model and self.models.resolve(model)) or self.models.resolve(self.config['EMBEDDING_MODEL'])
+    
+    def embed_text(self, text, model=None):
+        """Vector de un texto con el modelo de embeddings de Ollama (caché semántica)"""
+        local_model = self.resolve_embedding_model(model)
+        if local_model is None:
+            raise Exception(f"Modelo de embeddings no disponible: {model or self.config['EMBEDDING_MODEL']}")
+        vectors, _ = self.embed(local_model, [text])
+        return vectors[0]
+    
+    def embed(self, model, inputs, dimensions=None):
+        """Embeddings de Ollama (modelo ya resuelto) agrupados con las peticiones concurrentes
+
+        Devuelve (vectores, tokens del prompt atribuidos a esta petición).
+        """
+        vectors, tokens = self.embeddings.embed_many(model, inputs, dimensions)
+        get_usage_recorder().record('ollama', model, tokens, 0)
+        return vectors, tokens
+    
+    def _embed_batch(self, model, inputs, dimensions=None):
+        """Una llamada a /api/embed con el lote completo
+
+        Ocupa turno en la cola de admisión y cuenta en el nodo como una
+        generación: Ollama reparte los mismos huecos (OLLAMA_NUM_PARALLEL).
+        """
+        self._embed_allowed()
+        try:
+            slot = self.admission.acquire(current_priority.get()) if self.admission else None
+        except AdmissionTimeout as e:
+            raise self._embed_unavailable(e)
+        try:
+            node, payload = self._embed_target(model, inputs, dimensions)
+        except Exception:
+            self._release(None, slot)
+            raise
+        health = self.health['ollama'].node(node)
+        token = health.begin()
+        call = UpstreamCall('ollama', model)
+        try:
+            response = self.ollama.post(f"{node}/api/embed", data=dumps(payload), headers=JSON_HEADERS)
+            body = response.content
+        except Exception:
+            health.end(token, ok=False)
+            call.finish('error')
+            self.models.mark_down(node)
+            raise
+        finally:
+            self._release(node, slot)
+        return self._embed_result(response.status_code, body, health, token, call)
+    
+    def _embed_allowed(self):
+        health = self.health['ollama']
+        if not health.allow_request():
+            raise BackendUnavailable('ollama', health.retry_after())
+    
+    def _embed_unavailable(self, error):
+        """Sin DeepSeek de reserva (no tiene embeddings): agotar la espera en cola es un 503"""
+        logging.warning(f"Cola de Ollama (embeddings): {error}")
+        return BackendUnavailable('ollama', self.health['ollama'].retry_after())
+    
+    def _embed_target(self, model, inputs, dimensions):
+        """Nodo (ya contado en el pool) y payload de /api/embed"""
+        node = self.pool.pick(model)
+        if node is None:
+            raise BackendUnavailable('ollama', self.health['ollama'].retry_after())
+        self.pool.begin(node)
+        payload = {"model": model, "input": inputs}
+        if dimensions:
+            payload["dimensions"] = dimensions
+        self._keep_alive(payload)
+        return node, payload
+    
+    def _embed_result(self, status_code, body, health, token, call):
+        health.end(token, ok=not is_backend_failure(status_code))
+        call.finish(status_code)
+        if status_code != 200:
+            if status_code == 404:
+                self.models.invalidate()
+            raise Exception(f"Ollama API error: {status_code}")
+        result = loads(body)
+        return result.get('embeddings') or [], result.get('prompt_eval_count', 0)
+    
+    def _release(self, node, slot):
+        """Devuelve el nodo al pool y el hueco a la cola de admisión"""
+        if node:
+            self.pool.end(node)
+        if slot is not None:
+            self.admission.release(slot)
     
     def call_deepseek(self, model, messages, temperature, max_tokens, stream):
         payload = {
@@ -70,14 +445,78 @@ class AIRouter:
             "max_tokens": max_tokens,
             "stream": stream
         }
+        if stream:
+            # Último chunk con usage para contabilizar tokens (no se reenvía al cliente)
+            payload["stream_options"] = {"include_usage": True}
         headers = {"Authorization": f"Bearer {self.deepseek_key}", "Content-Type": "application/json"}
-        response = requests.post(self.deepseek_url, json=payload, headers=headers, timeout=120)
+        scope = current_scope.get()
+        timeout = self._upstream_timeout(scope, stream, self.deepseek)
+        health = self.health['deepseek']
+        token = health.begin()
+        call = UpstreamCall('deepseek', payload['model'])
+        try:
+            response = self.deepseek.post(self.deepseek_url, data=dumps(payload), headers=headers, stream=stream,
+                                          timeout=timeout)
+        except Exception:
+            if scope is not None and scope.expired():
+                health.cancel(token)
+                call.finish('cancelled')
+                scope.check()
+            health.end(token, ok=False)
+            call.finish('error')
+            raise
         
         if response.status_code == 200:
-            return response.json()
+            if stream:
+                return TrackedStream(self._stream_from_deepseek(response, call), stream_closer(health, token, call))
+            # Ya es compatible con OpenAI: el cliente recibe estos mismos bytes
+            result = RawCompletion(response.content)
+            health.end(token, ok=True)
+            call.finish(200)
+            self._observe_deepseek(result, messages, time.monotonic() - token[0])
+            return result
         else:
+            response.close()
+            health.end(token, ok=not is_backend_failure(response.status_code))
+            call.finish(response.status_code)
             raise Exception(f"DeepSeek API error: {response.status_code}")
     
+    def _observe_ollama(self, result, model=None):
+        """Contabiliza el uso y alimenta la política de routing con los tiempos que informa Ollama"""
+        model = model or result.get('model', '')
+        get_usage_recorder().record('ollama', model, result.get('prompt_eval_count', 0), result.get('eval_count', 0))
+        if not result.get('eval_count'):
+            return
+        observe_generation(
+            'ollama', model, result.get('prompt_eval_count', 0), result['eval_count'],
+            result.get('eval_duration', 0) / 1e9
+        )
+        self.policy.observe(
+            'ollama',
+            prompt_tokens=result.get('prompt_eval_count', 0),
+            completion_tokens=result['eval_count'],
+            elapsed=result.get('total_duration', 0) / 1e9,
+            prefill_seconds=result.get('prompt_eval_duration', 0) / 1e9,
+            decode_seconds=result.get('eval_duration', 0) / 1e9
+        )
+    
+    def _observe_deepseek(self, result, messages, elapsed):
+        usage = result.get('usage') or {}
+        get_usage_recorder().record(
+            'deepseek', result.get('model', 'deepseek-chat'), usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0)
+        )
+        if not usage.get('completion_tokens'):
+            return
+        observe_generation(
+            'deepseek', result.get('model', 'deepseek-chat'), usage.get('prompt_tokens', 0), usage['completion_tokens'], elapsed
+        )
+        self.policy.observe(
+            'deepseek',
+            prompt_tokens=usage.get('prompt_tokens') or estimate_prompt_tokens(messages),
+            completion_tokens=usage['completion_tokens'],
+            elapsed=elapsed
+        )
+    
     def _convert_to_ollama(self, messages):
         ollama_messages = []
         system_prompt = None
@@ -91,15 +530,71 @@ class AIRouter:
         return ollama_messages
     
     def _convert_from_ollama(self, response, original_model):
+        prompt_tokens = response.get('prompt_eval_count', 0)
+        completion_tokens = response.get('eval_count', 0)
         return {
-            "id": f"chatcmpl-{response.get('id', 'local')}",
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
             "object": "chat.completion",
-            "created": 1234567890,
+            "created": int(time.time()),
             "model": original_model,
             "choices": [{
                 "index": 0,
                 "message": {"role": "assistant", "content": response.get('message', {}).get('content', '')},
-                "finish_reason": "stop"
+                "finish_reason": 'length' if response.get('done_reason') == 'length' else 'stop'
             }],
-            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
         }
+    
+    @staticmethod
+    def _usage_chunk(payload):
+        """Chunk SSE de DeepSeek que trae el bloque usage, o None"""
+        try:
+            data = loads(payload)
+        except ValueError:
+            return None
+        return data if data.get('usage') else None
+    
+    def _stream_from_ollama(self, response, original_model, call=None, include_usage=False):
+        """Convierte el NDJSON de Ollama en eventos SSE chat.completion.chunk"""
+        converter = OllamaChunkConverter(original_model)
+        try:
+            yield converter.start()
+            for line in response.iter_lines():
+                events = converter.convert(line)
+                if events and call:
+                    call.first_token()
+                yield from events
+                if converter.done:
+                    break
+            if converter.final:
+                self._observe_ollama(converter.final, call.model if call else None)
+                if include_usage:
+                    yield converter.usage()
+            yield SSE_DONE
+        finally:
+            response.close()
+    
+    def _stream_from_deepseek(self, response, call=None):
+        """Reenvía los eventos SSE de DeepSeek tal cual llegan
+
+        El bloque usage se contabiliza; un chunk que solo trae usage no se
+        reenvía porque el cliente no pidió stream_options.include_usage.
+        """
+        try:
+            for line in response.iter_lines():
+                if line:
+                    if call:
+                        call.first_token()
+                    if b'"usage"' in line and line.startswith(b'data: {'):
+                        chunk = self._usage_chunk(line[len(b'data: '):])
+                        if chunk:
+                            self._observe_deepseek(chunk, [], time.monotonic() - call.started if call else 0)
+                            if not chunk.get('choices'):
+                                continue
+                    yield line + b"\n\n"
+        finally:
+            response.close()
@@ -0,0 +1,186 @@
+# Routing Policy - Decide entre Ollama y DeepSeek según tokens, rendimiento y coste
+import json
+import logging
+import math
+import re
+import threading
+
+from api.services.metrics import routing_decisions
+
+routing_logger = logging.getLogger('routing')
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text):
+    """Aproximación rápida a un tokenizador BPE
+
+    Palabras ASCII ~4 caracteres por token, texto no ASCII ~3 bytes UTF-8 por
+    token (acentos, CJK) y cada signo de puntuación cuenta como un token, lo que
+    encarece correctamente los prompts con mucho código.
+    """
+    if not text:
+        return 0
+    if not isinstance(text, str):
+        text = json.dumps(text, ensure_ascii=False)
+    tokens = 0
+    for piece in _TOKEN_RE.findall(text):
+        if piece.isascii():
+            tokens += max(1, math.ceil(len(piece) / 4))
+        else:
+            tokens += max(1, math.ceil(len(piece.encode('utf-8')) / 3))
+    return tokens
+
+
+def estimate_prompt_tokens(messages):
+    # ~4 tokens de formato por mensaje (rol y separadores de la plantilla de chat)
+    return sum(estimate_tokens(m.get('content', '')) + 4 for m in messages)
+
+
+class BackendProfile:
+    """Rendimiento observado de un backend (medias exponenciales)"""
+
+    def __init__(self, name, overhead, prefill_tps, decode_tps, input_cost=0.0, output_cost=0.0, alpha=0.2):
+        self.name = name
+        self.overhead = overhead
+        self.prefill_tps = prefill_tps
+        self.decode_tps = decode_tps
+        self.input_cost = input_cost
+        self.output_cost = output_cost
+        self.alpha = alpha
+        self.samples = 0
+        self._lock = threading.Lock()
+
+    def _ewma(self, current, value):
+        return current + self.alpha * (value - current)
+
+    def expected_seconds(self, prompt_tokens, output_tokens):
+        return self.overhead + prompt_tokens / self.prefill_tps + output_tokens / self.decode_tps
+
+    def expected_cost(self, prompt_tokens, output_tokens):
+        """Coste en USD (precios por millón de tokens)"""
+        return (prompt_tokens * self.input_cost + output_tokens * self.output_cost) / 1_000_000
+
+    def observe(self, prompt_tokens, completion_tokens, elapsed,
+                prefill_seconds=None, decode_seconds=None):
+        """Actualiza el perfil con una respuesta real
+
+        Si el backend no informa de tiempos de prefill/decodificación (DeepSeek)
+        se atribuye al decode todo lo que no explican la latencia base y el prefill.
+        """
+        with self._lock:
+            if prefill_seconds and prompt_tokens:
+                self.prefill_tps = self._ewma(self.prefill_tps, prompt_tokens / prefill_seconds)
+            if decode_seconds is None and completion_tokens:
+                decode_seconds = elapsed - self.overhead - prompt_tokens / self.prefill_tps
+            if decode_seconds and decode_seconds > 0 and completion_tokens:
+                self.decode_tps = self._ewma(self.decode_tps, completion_tokens / decode_seconds)
+                if prefill_seconds is not None:
+                    self.overhead = self._ewma(self.overhead, max(0.0, elapsed - prefill_seconds - decode_seconds))
+            self.samples += 1
+
+    def snapshot(self):
+        return {
+            "overhead": round(self.overhead, 3),
+            "prefill_tps": round(self.prefill_tps, 1),
+            "decode_tps": round(self.decode_tps, 1),
+            "samples": self.samples
+        }
+
+
+class RoutingDecision:
+    def __init__(self, backend, reason, inputs=None):
+        self.backend = backend
+        self.reason = reason
+        self.inputs = inputs or {}
+
+    def as_dict(self):
+        return {"backend": self.backend, "reason": self.reason, **self.inputs}
+
+
+class ThresholdPolicy:
+    """Política original: más de N caracteres de prompt → DeepSeek"""
+
+    def __init__(self, threshold=500):
+        self.threshold = threshold
+
+    def decide(self, model, messages, max_tokens, local_model, health=None):
+        total_chars = sum(len(str(m.get('content', ''))) for m in messages)
+        inputs = {"model": model, "prompt_chars": total_chars, "threshold": self.threshold}
+        if total_chars > self.threshold:
+            return RoutingDecision('deepseek', 'complex', inputs)
+        if local_model:
+            return RoutingDecision('ollama', 'local', inputs)
+        return RoutingDecision('deepseek', 'not_local', inputs)
+
+    def observe(self, backend, **kwargs):
+        pass
+
+
+class CostModelPolicy:
+    """Elige el backend con menor tiempo esperado dentro del presupuesto de coste"""
+
+    def __init__(self, profiles, max_cost=0.01, output_ratio=0.5):
+        self.profiles = profiles
+        self.max_cost = max_cost
+        self.output_ratio = output_ratio
+
+    def decide(self, model, messages, max_tokens, local_model, health=None):
+        """health: BackendHealth por backend; la cola observada se suma al tiempo esperado"""
+        prompt_tokens = estimate_prompt_tokens(messages)
+        output_tokens = int((max_tokens or 0) * self.output_ratio)
+        inputs = {"model": model, "prompt_tokens": prompt_tokens, "expected_output_tokens": output_tokens}
+
+        candidates = ['ollama', 'deepseek'] if local_model else ['deepseek']
+        estimates = {}
+        for name in candidates:
+            profile = self.profiles[name]
+            queue_delay = health[name].queue_delay() if health and name in health else 0.0
+            estimates[name] = {
+                "seconds": round(profile.expected_seconds(prompt_tokens, output_tokens) + queue_delay, 3),
+                "queue_delay": round(queue_delay, 3),
+                "cost": round(profile.expected_cost(prompt_tokens, output_tokens), 6)
+            }
+        inputs["estimates"] = estimates
+
+        if not local_model:
+            return RoutingDecision('deepseek', 'not_local', inputs)
+
+        within_budget = [name for name in candidates if estimates[name]["cost"] <= self.max_cost]
+        if not within_budget:
+            return RoutingDecision('ollama', 'over_budget', inputs)
+        backend = min(within_budget, key=lambda name: estimates[name]["seconds"])
+        return RoutingDecision(backend, 'fastest', inputs)
+
+    def observe(self, backend, **kwargs):
+        if backend in self.profiles:
+            self.profiles[backend].observe(**kwargs)
+
+
+def build_routing_policy(config):
+    """ROUTING_POLICY=cost (por defecto) o threshold"""
+    if config['ROUTING_POLICY'] == 'threshold':
+        return ThresholdPolicy(config['ROUTING_COMPLEXITY_THRESHOLD'])
+    profiles = {
+        'ollama': BackendProfile(
+            'ollama',
+            overhead=config['OLLAMA_OVERHEAD_SECONDS'],
+            prefill_tps=config['OLLAMA_PREFILL_TPS'],
+            decode_tps=config['OLLAMA_DECODE_TPS']
+        ),
+        'deepseek': BackendProfile(
+            'deepseek',
+            overhead=config['DEEPSEEK_OVERHEAD_SECONDS'],
+            prefill_tps=config['DEEPSEEK_PREFILL_TPS'],
+            decode_tps=config['DEEPSEEK_DECODE_TPS'],
+            input_cost=config['DEEPSEEK_INPUT_COST'],
+            output_cost=config['DEEPSEEK_OUTPUT_COST']
+        )
+    }
+    return CostModelPolicy(profiles, max_cost=config['ROUTING_MAX_COST'], output_ratio=config['ROUTING_OUTPUT_RATIO'])
+
+
+def log_decision(decision):
+    """Una línea JSON por petición en el logger 'routing' para ajustar la política offline"""
+    routing_decisions.inc(backend=decision.backend, reason=decision.reason)
+    routing_logger.info(json.dumps(decision.as_dict(), ensure_ascii=False))
@@ -0,0 +1,291 @@
+# Semantic Cache - Respuestas de preguntas parecidas (embeddings + búsqueda por similitud coseno)
+import asyncio
+import hashlib
+import logging
+import math
+import operator
+import threading
+import time
+from array import array
+from collections import OrderedDict, deque
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - numpy es opcional
+    numpy = None
+
+from api.services.cache import is_deterministic
+from api.services.metrics import semantic_cache_lookups, semantic_cache_seconds, semantic_cache_similarity
+from config.settings import load_config
+
+
+def _normalize(vector):
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return array('f', (value / norm for value in vector))
+
+
+def _fits(response, max_tokens):
+    """La respuesta guardada cabe en el max_tokens de la nueva petición (sin usage no se puede saber)"""
+    if max_tokens is None:
+        return True
+    try:
+        return int(response['usage']['completion_tokens']) <= int(max_tokens)
+    except (KeyError, TypeError, ValueError):
+        return False
+
+
+def _percentile(ordered, percentile):
+    if not ordered:
+        return None
+    rank = -(-percentile * len(ordered) // 100)
+    return round(ordered[max(0, min(len(ordered), int(rank)) - 1)], 4)
+
+
+class Probe:
+    """Resultado de lookup(): la respuesta si hubo acierto y lo necesario para store()"""
+
+    def __init__(self, scope, vector, response=None, similarity=None):
+        self.scope = scope
+        self.vector = vector
+        self.response = response
+        self.similarity = similarity
+
+
+class _Entry:
+    __slots__ = ('scope', 'vector', 'response', 'expires_at')
+
+    def __init__(self, scope, vector, response, expires_at):
+        self.scope = scope
+        self.vector = vector
+        self.response = response
+        self.expires_at = expires_at
+
+
+class SemanticCache:
+    """Índice vectorial en proceso de prompts ya respondidos
+
+    Solo entran conversaciones de una pregunta (system opcional + un mensaje de
+    usuario) y con temperature 0: con turnos previos la misma frase puede pedir
+    otra respuesta, y una petición con muestreo no espera una respuesta fija. Un
+    acierto solo se sirve si su completion_tokens cabe en el max_tokens. El
+    ámbito es modelo + system prompt; dentro de él se busca el vector más
+    parecido (coseno, vectores normalizados) y por encima de `threshold` se
+    devuelve su respuesta. Con numpy la búsqueda es un producto matriz-vector
+    sobre los vectores del ámbito (matriz contigua que se rehace tras cada
+    cambio); sin numpy, un recorrido en Python acotado por `max_scope_entries`.
+    Expulsión LRU con `max_entries` en total y `max_scope_entries` por ámbito, y TTL.
+    """
+
+    def __init__(self, threshold=0.92, max_entries=1000, ttl=3600, window=500, max_scope_entries=256):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_scope_entries = max_scope_entries
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._scopes = {}
+        self._matrices = {}
+        self._next_id = 0
+        self._similarities = deque(maxlen=window)
+        self._latencies = deque(maxlen=window)
+        self._counters = {"lookups": 0, "hits": 0, "misses": 0, "errors": 0, "stores": 0, "skipped": 0, "evictions": 0,
+                          "over_limit": 0}
+
+    @staticmethod
+    def prompt(model, messages, temperature=0):
+        """(ámbito, texto a embeber) o None si la petición no es cacheable"""
+        if not isinstance(messages, list) or not is_deterministic(temperature):
+            return None
+        system = [m.get('content') or '' for m in messages if isinstance(m, dict) and m.get('role') == 'system']
+        turns = [m for m in messages if isinstance(m, dict) and m.get('role') != 'system']
+        if len(turns) != 1 or turns[0].get('role') != 'user' or not isinstance(turns[0].get('content'), str):
+            return None
+        text = turns[0]['content'].strip()
+        if not text:
+            return None
+        scope = hashlib.sha256('\x00'.join([model or ''] + system).encode('utf-8')).hexdigest()
+        return scope, text
+
+    def probe(self, model, messages, embed, temperature=0, max_tokens=None):
+        """Embebe la pregunta con embed(texto) y busca; None si no aplica o el embedding falla"""
+        prompt = self.prompt(model, messages, temperature)
+        if prompt is None:
+            return None
+        started = time.monotonic()
+        try:
+            vector = embed(prompt[1])
+        except Exception as e:
+            self.error(e)
+            return None
+        return self.lookup(prompt[0], vector, started, max_tokens)
+
+    async def probe_async(self, model, messages, embed, temperature=0, max_tokens=None):
+        """Equivalente asyncio de probe(); embed es una corrutina"""
+        prompt = self.prompt(model, messages, temperature)
+        if prompt is None:
+            return None
+        started = time.monotonic()
+        try:
+            vector = await embed(prompt[1])
+        except Exception as e:
+            self.error(e)
+            return None
+        # La búsqueda es CPU: en un hilo del executor para no parar el event loop
+        return await asyncio.get_running_loop().run_in_executor(None, self.lookup, prompt[0], vector, started,
+                                                                  max_tokens)
+
+    def lookup(self, scope, vector, started, max_tokens=None):
+        """Busca el prompt más parecido del ámbito; `started` mide también el embedding"""
+        vector = _normalize(vector)
+        now = time.time()
+        with self._lock:
+            for entry_id in list(self._scopes.get(scope, ())):
+                if self._entries[entry_id].expires_at <= now:
+                    self._evict(entry_id)
+            candidates = self._candidates(scope, len(vector))
+
+        # La búsqueda se hace sin el lock
+        best, similarity = None, None
+        if numpy is not None and candidates is not None:
+            ids, matrix = candidates
+            scores = matrix @ numpy.frombuffer(vector, dtype=numpy.float32)
+            index = int(scores.argmax())
+            best, similarity = ids[index], float(scores[index])
+        elif candidates is not None:
+            for entry_id, candidate in candidates:
+                score = sum(map(operator.mul, candidate, vector))
+                if similarity is None or score > similarity:
+                    best, similarity = entry_id, score
+
+        with self._lock:
+            response = None
+            if best is not None and similarity >= self.threshold and best in self._entries:
+                if not _fits(self._entries[best].response, max_tokens):
+                    # Respuesta más larga de lo que permite esta petición
+                    self._counters["over_limit"] += 1
+                    best = None
+            if best is not None and similarity >= self.threshold:
+                self._entries.move_to_end(best)
+                ids = self._scopes[scope]
+                ids.remove(best)
+                ids.append(best)
+                response = self._entries[best].response
+            hit = response is not None
+            self._counters["lookups"] += 1
+            self._counters["hits" if hit else "misses"] += 1
+            if similarity is not None:
+                self._similarities.append(similarity)
+            elapsed = time.monotonic() - started
+            self._latencies.append(elapsed)
+        semantic_cache_lookups.inc(result='hit' if hit else 'miss')
+        semantic_cache_seconds.observe(elapsed)
+        if similarity is not None:
+            semantic_cache_similarity.observe(similarity)
+        return Probe(scope, vector, response, similarity)
+
+    def _candidates(self, scope, dimensions):
+        """Vectores del ámbito con la dimensión de la consulta (con el lock tomado)
+
+        Con numpy: (ids, matriz n×d float32), cacheada hasta el siguiente cambio
+        del ámbito. Sin numpy: [(id, vector)]. None si no hay ninguno.
+        """
+        if numpy is not None:
+            cached = self._matrices.get(scope)
+            if cached is not None and cached[0] == dimensions:
+                return cached[1], cached[2]
+        ids = [entry_id for entry_id in self._scopes.get(scope, ())
+               if len(self._entries[entry_id].vector) == dimensions]
+        if not ids:
+            return None
+        if numpy is None:
+            return [(entry_id, self._entries[entry_id].vector) for entry_id in ids]
+        rows = b''.join(self._entries[entry_id].vector.tobytes() for entry_id in ids)
+        matrix = numpy.frombuffer(rows, dtype=numpy.float32).reshape(len(ids), dimensions)
+        self._matrices[scope] = (dimensions, ids, matrix)
+        return ids, matrix
+
+    def error(self, e):
+        """El embedding falló: la petición sigue sin caché"""
+        logging.warning(f"Caché semántica sin embedding: {e}")
+        with self._lock:
+            self._counters["errors"] += 1
+        semantic_cache_lookups.inc(result='error')
+
+    @staticmethod
+    def is_complete(response):
+        """Todas las opciones terminaron en 'stop' (una cortada por max_tokens no vale para otra petición)"""
+        choices = response.get('choices') if isinstance(response, dict) else None
+        return bool(choices) and all(choice.get('finish_reason') == 'stop' for choice in choices)
+
+    def store(self, probe, response):
+        """Guarda la respuesta para el prompt de `probe`; las incompletas no entran"""
+        if not self.is_complete(response):
+            with self._lock:
+                self._counters["skipped"] += 1
+            return
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = _Entry(probe.scope, probe.vector, response, time.time() + self.ttl)
+            ids = self._scopes.setdefault(probe.scope, [])
+            ids.append(entry_id)
+            self._matrices.pop(probe.scope, None)
+            self._counters["stores"] += 1
+            # El ámbito se mantiene pequeño (la búsqueda recorre el ámbito entero)
+            while len(ids) > self.max_scope_entries:
+                self._evict(ids[0])
+                self._counters["evictions"] += 1
+            while len(self._entries) > self.max_entries:
+                self._evict(next(iter(self._entries)))
+                self._counters["evictions"] += 1
+
+    def _evict(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        ids = self._scopes[entry.scope]
+        ids.remove(entry_id)
+        self._matrices.pop(entry.scope, None)
+        if not ids:
+            del self._scopes[entry.scope]
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            entries = len(self._entries)
+            scopes = len(self._scopes)
+            similarities = sorted(self._similarities)
+            latencies = sorted(self._latencies)
+        answered = counters["hits"] + counters["misses"]
+        return {
+            **counters,
+            "hit_rate": round(counters["hits"] / answered, 4) if answered else 0.0,
+            "entries": entries,
+            "scopes": scopes,
+            "max_entries": self.max_entries,
+            "max_scope_entries": self.max_scope_entries,
+            "vectorized": numpy is not None,
+            "threshold": self.threshold,
+            "similarity": {f"p{p}": _percentile(similarities, p) for p in (10, 50, 90, 99)},
+            "lookup_seconds": {f"p{p}": _percentile(latencies, p) for p in (50, 95, 99)}
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_semantic_cache():
+    """SemanticCache compartida por proceso; None si SEMANTIC_CACHE_ENABLED=false"""
+    global _cache
+    config = load_config()
+    if not config['SEMANTIC_CACHE_ENABLED']:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = SemanticCache(
+                threshold=config['SEMANTIC_CACHE_THRESHOLD'],
+                max_entries=config['SEMANTIC_CACHE_MAX_ENTRIES'],
+                max_scope_entries=config['SEMANTIC_CACHE_MAX_SCOPE_ENTRIES'],
+                ttl=config['SEMANTIC_CACHE_TTL']
+            )
+    return _cache
@@ -0,0 +1,179 @@
+# Streaming helpers - Eventos SSE compatibles con OpenAI
+import asyncio
+import threading
+import time
+import uuid
+
+from api.services.codec import dumps, loads
+
+
+def sse(data):
+    """Serializa un evento SSE 'data: ...' (bytes, listos para el socket)"""
+    return b"data: " + dumps(data) + b"\n\n"
+
+
+SSE_DONE = b"data: [DONE]\n\n"
+
+
+class OllamaChunkConverter:
+    """Convierte líneas NDJSON de Ollama /api/chat en chat.completion.chunk"""
+
+    def __init__(self, model):
+        self.model = model
+        self.id = f"chatcmpl-{uuid.uuid4().hex}"
+        self.created = int(time.time())
+        self.done = False
+        self.final = None
+
+    def chunk(self, delta, finish_reason=None):
+        return sse({
+            "id": self.id,
+            "object": "chat.completion.chunk",
+            "created": self.created,
+            "model": self.model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        })
+
+    def start(self):
+        return self.chunk({"role": "assistant", "content": ""})
+
+    def usage(self):
+        """Chunk final con el uso (formato stream_options.include_usage de OpenAI)"""
+        prompt_tokens = self.final.get('prompt_eval_count', 0)
+        completion_tokens = self.final.get('eval_count', 0)
+        return sse({
+            "id": self.id,
+            "object": "chat.completion.chunk",
+            "created": self.created,
+            "model": self.model,
+            "choices": [],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        })
+
+    def convert(self, line):
+        """Devuelve los eventos SSE correspondientes a una línea de Ollama"""
+        if not line:
+            return []
+        data = loads(line)
+        if data.get('error'):
+            self.done = True
+            return [sse({"error": {"message": data['error'], "type": "upstream_error"}})]
+        events = []
+        content = data.get('message', {}).get('content', '')
+        if content:
+            events.append(self.chunk({"content": content}))
+        if data.get('done'):
+            self.done = True
+            # La última línea trae los contadores y tiempos de la generación
+            self.final = data
+            finish_reason = 'length' if data.get('done_reason') == 'length' else 'stop'
+            events.append(self.chunk({}, finish_reason))
+        return events
+
+
+def completion_from_chunks(events):
+    """Reconstruye una chat.completion a partir de los eventos SSE de un stream"""
+    completion = None
+    content = []
+    finish_reason = None
+    usage = None
+    for event in events:
+        if isinstance(event, str):
+            event = event.encode('utf-8')
+        payload = event.strip()[len(b'data:'):].strip() if event.startswith(b'data:') else b''
+        if not payload or payload == b'[DONE]':
+            continue
+        chunk = loads(payload)
+        if chunk.get('error'):
+            raise Exception(chunk['error'].get('message', 'upstream error'))
+        if completion is None:
+            completion = {"id": chunk.get('id'), "created": chunk.get('created'), "model": chunk.get('model')}
+        usage = chunk.get('usage') or usage
+        for choice in chunk.get('choices') or []:
+            content.append(choice.get('delta', {}).get('content') or '')
+            finish_reason = choice.get('finish_reason') or finish_reason
+    completion = completion or {}
+    return {
+        "id": completion.get('id') or f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": completion.get('created') or int(time.time()),
+        "model": completion.get('model'),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": ''.join(content)},
+            "finish_reason": finish_reason or 'stop'
+        }],
+        "usage": usage or {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    }
+
+
+class TrackedStream:
+    """Iterador que avisa una sola vez cuando el stream termina
+
+    on_close(ok) recibe False si el upstream falló a mitad del stream y None si
+    el gateway lo cancela (cancel). También se llama si el cliente abandona o si
+    el iterador se descarta sin consumirse.
+    """
+
+    def __init__(self, iterable, on_close):
+        self._iterator = iter(iterable)
+        self._on_close = on_close
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            self._finish(True)
+            raise
+        except Exception:
+            self._finish(False)
+            raise
+
+    def _finish(self, ok):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._on_close(ok)
+
+    def close(self):
+        try:
+            close = getattr(self._iterator, 'close', None)
+            if close:
+                close()
+        finally:
+            self._finish(True)
+
+    def cancel(self):
+        """Cierra el upstream sin contarlo como éxito ni como fallo"""
+        self._finish(None)
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+
+async def track_async_stream(stream, on_close):
+    """Equivalente asíncrono de TrackedStream"""
+    ok = True
+    try:
+        async for event in stream:
+            yield event
+    except asyncio.CancelledError:
+        ok = None
+        raise
+    except Exception:
+        ok = False
+        raise
+    finally:
+        await stream.aclose()
+        on_close(ok)
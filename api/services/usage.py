@@ -0,0 +1,172 @@
+# Usage - Tokens reales por key, backend y modelo en series por minuto/hora/día (SQLite WAL)
+import atexit
+import contextvars
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from api.services.journal import current_trace
+from api.services.key_store import get_key_store
+from config.settings import load_config
+
+# Key de la petición en curso; la fija la autenticación y la leen los routers
+current_api_key = contextvars.ContextVar('current_api_key', default='')
+
+RESOLUTIONS = (('minute', 60), ('hour', 3600), ('day', 86400))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    resolution TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    api_key TEXT NOT NULL,
+    backend TEXT NOT NULL,
+    model TEXT NOT NULL,
+    requests INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (resolution, bucket, api_key, backend, model)
+) WITHOUT ROWID;
+"""
+
+UPSERT = """
+INSERT INTO usage (resolution, bucket, api_key, backend, model, requests, prompt_tokens, completion_tokens)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (resolution, bucket, api_key, backend, model) DO UPDATE SET
+    requests = requests + excluded.requests,
+    prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+    completion_tokens = completion_tokens + excluded.completion_tokens
+"""
+
+
+class UsageStore:
+    """Series agregadas en SQLite
+
+    Cada volcado suma sus contadores a las tres resoluciones con un UPSERT, así
+    que consultar 30 días lee 30 filas por key/modelo en lugar de cada petición.
+    WAL permite que varios workers escriban mientras APIManager lee. Las filas
+    por minuto y por hora se podan tras su retención; las diarias se conservan.
+    """
+
+    def __init__(self, path, retention=None):
+        self.path = path
+        self.retention = retention or {"minute": 2 * 86400, "hour": 90 * 86400}
+        self._initialized = False
+
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5)
+        if not self._initialized:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+            self._initialized = True
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def add(self, counters, now=None):
+        """counters: {(minuto, key, backend, modelo): [peticiones, prompt, completion]}"""
+        now = now or time.time()
+        rows = []
+        for (minute, api_key, backend, model), (requests, prompt, completion) in counters.items():
+            for resolution, seconds in RESOLUTIONS:
+                rows.append((resolution, minute // seconds * seconds, api_key, backend, model, requests, prompt, completion))
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(UPSERT, rows)
+                for resolution, seconds in self.retention.items():
+                    conn.execute("DELETE FROM usage WHERE resolution = ? AND bucket < ?", (resolution, int(now - seconds)))
+        finally:
+            conn.close()
+
+    def query(self, since, resolution='day', api_key=None):
+        """Filas con bucket >= since (epoch) agrupadas por intervalo, key, backend y modelo"""
+        sql = ("SELECT bucket, api_key, backend, model, requests, prompt_tokens, completion_tokens "
+               "FROM usage WHERE resolution = ? AND bucket >= ?")
+        params = [resolution, int(since)]
+        if api_key is not None:
+            sql += " AND api_key = ?"
+            params.append(api_key)
+        conn = self._connect()
+        try:
+            rows = conn.execute(sql + " ORDER BY bucket", params).fetchall()
+        finally:
+            conn.close()
+        columns = ("bucket", "api_key", "backend", "model", "requests", "prompt_tokens", "completion_tokens")
+        return [dict(zip(columns, row)) for row in rows]
+
+
+class UsageRecorder:
+    """Acumula el uso en memoria y lo vuelca a UsageStore en lotes"""
+
+    def __init__(self, store, flush_interval=10):
+        self.store = store
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._pid = None
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._pending = {}
+        threading.Thread(target=self._run, name="usage-flush", daemon=True).start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def record(self, backend, model, prompt_tokens, completion_tokens, api_key=None):
+        """Una generación upstream; sin api_key se atribuye a la key de la petición en curso"""
+        if api_key is None:
+            api_key = current_api_key.get()
+        prompt_tokens = int(prompt_tokens or 0)
+        completion_tokens = int(completion_tokens or 0)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.generation(backend, model, prompt_tokens, completion_tokens)
+        self._start()
+        minute = int(time.time()) // 60 * 60
+        with self._lock:
+            counters = self._pending.setdefault((minute, api_key, backend, model or ''), [0, 0, 0])
+            counters[0] += 1
+            counters[1] += prompt_tokens
+            counters[2] += completion_tokens
+        if api_key and (prompt_tokens or completion_tokens):
+            # Total acumulado por key en api_keys.json (APIManager list_keys)
+            get_key_store().record_usage(api_key, tokens=prompt_tokens + completion_tokens)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            self.store.add(pending)
+        except Exception as e:
+            logging.error(f"Error guardando uso: {e}")
+            # Devolver los contadores para el siguiente intento
+            with self._lock:
+                for bucket_key, values in pending.items():
+                    current = self._pending.setdefault(bucket_key, [0, 0, 0])
+                    for i, value in enumerate(values):
+                        current[i] += value
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_usage_recorder():
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None:
+            config = load_config()
+            _recorder = UsageRecorder(UsageStore(config['USAGE_DB']), flush_interval=config['USAGE_FLUSH_INTERVAL'])
+    return _recorder
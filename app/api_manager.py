@@ -6,20 +6,27 @@ Este script recibe comandos y los ejecuta en el sistema
 
 import os
 import json
+import fcntl
+import sqlite3
 import subprocess
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 # Configuración
 API_GATEWAY_URL = "http://localhost:8080"
-API_KEY_FILE = "/root/ai-gateway/api_keys.json"
+API_KEY_FILE = os.getenv('API_KEYS_FILE', "/root/ai-gateway/api_keys.json")
+USAGE_DB = os.getenv('USAGE_DB', "/root/ai-gateway/usage.db")
+# Clases de la cola de admisión del gateway (api/services/admission.py)
+PRIORITIES = ("interactive", "batch")
 
 class APIManager:
     """Gestor de APIs para ejecutar comandos remotos"""
     
     def __init__(self):
         self.keys_file = API_KEY_FILE
-        self.stats_file = "/root/ai-gateway/stats.json"
+        self.usage_db = USAGE_DB
         self.load_keys()
     
     def load_keys(self):
@@ -31,18 +38,33 @@ class APIManager:
             self.keys = {}
     
     def save_keys(self):
-        """Guardar keys"""
-        with open(self.keys_file, 'w') as f:
-            json.dump(self.keys, f, indent=2)
+        """Guardar keys (con lock y escritura atómica; el gateway vuelca los contadores)"""
+        with open(f"{self.keys_file}.lock", 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.exists(self.keys_file):
+                with open(self.keys_file, 'r') as f:
+                    on_disk = json.load(f)
+            else:
+                on_disk = {}
+            # Conservar los contadores que los workers hayan volcado desde load_keys()
+            for key, data in self.keys.items():
+                if key in on_disk:
+                    data["requests"] = on_disk[key].get("requests", 0)
+                    data["tokens"] = on_disk[key].get("tokens", 0)
+            tmp_file = f"{self.keys_file}.tmp"
+            with open(tmp_file, 'w') as f:
+                json.dump(self.keys, f, indent=2)
+            os.replace(tmp_file, self.keys_file)
     
-    def create_key(self, name, description="", rate_limit=100):
-        """Crear nueva API key"""
+    def create_key(self, name, description="", rate_limit=100, priority="interactive"):
+        """Crear nueva API key (priority: interactive o batch en la cola de Ollama)"""
         import secrets
         key = f"sk-bak-{secrets.token_hex(16)}"
         self.keys[key] = {
             "name": name,
             "description": description,
             "rate_limit": rate_limit,
+            "priority": priority,
             "active": True,
             "created_at": datetime.now().isoformat(),
             "requests": 0,
@@ -53,7 +75,8 @@ class APIManager:
             "status": "ok",
             "key": key,
             "name": name,
-            "rate_limit": rate_limit
+            "rate_limit": rate_limit,
+            "priority": priority
         }
     
     def list_keys(self):
@@ -64,6 +87,7 @@ class APIManager:
                 "key": key[:20] + "...",
                 "name": data["name"],
                 "active": data["active"],
+                "priority": data.get("priority", "interactive"),
                 "requests": data["requests"],
                 "created": data["created_at"]
             })
@@ -78,53 +102,96 @@ class APIManager:
                 return {"status": "ok", "key": k[:20] + "..."}
         return {"status": "error", "message": "Key no encontrada"}
     
+    def set_priority(self, key_prefix, priority):
+        """Cambiar la clase de una key (por prefijo): interactive o batch"""
+        if priority not in PRIORITIES:
+            return {"status": "error", "message": f"Prioridad no válida (usar {' o '.join(PRIORITIES)})"}
+        for k in self.keys:
+            if k.startswith(key_prefix):
+                self.keys[k]["priority"] = priority
+                self.save_keys()
+                return {"status": "ok", "key": k[:20] + "...", "priority": priority}
+        return {"status": "error", "message": "Key no encontrada"}
+    
+    def _usage_rows(self, days):
+        """Filas diarias de usage.db (el gateway las agrega por minuto/hora/día)"""
+        if not os.path.exists(self.usage_db):
+            return []
+        since = (int(time.time()) // 86400 - (days - 1)) * 86400
+        conn = sqlite3.connect(self.usage_db, timeout=5)
+        try:
+            return conn.execute(
+                "SELECT bucket, api_key, backend, model, SUM(requests), SUM(prompt_tokens), SUM(completion_tokens) "
+                "FROM usage WHERE resolution = 'day' AND bucket >= ? "
+                "GROUP BY bucket, api_key, backend, model ORDER BY bucket",
+                (since,)
+            ).fetchall()
+        finally:
+            conn.close()
+    
     def get_stats(self, days=1):
-        """Obtener estadísticas"""
-        if os.path.exists(self.stats_file):
-            with open(self.stats_file, 'r') as f:
-                stats = json.load(f)
-        else:
-            stats = {"total_requests": 0, "daily": {}}
-        
-        # Calcular totales
-        total = stats.get("total_requests", 0)
+        """Obtener estadísticas de los últimos `days` días (tokens reales por key, backend y modelo)"""
+        days = max(1, int(days))
+        totals = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        daily, by_key, by_model = {}, {}, {}
+        for bucket, key, backend, model, requests_count, prompt, completion in self._usage_rows(days):
+            day = datetime.utcfromtimestamp(bucket).strftime('%Y-%m-%d')
+            name = self.keys.get(key, {}).get("name", key[:12] + "..." if key else "anonymous")
+            for group, label in ((daily, day), (by_key, name), (by_model, f"{backend}/{model}")):
+                entry = group.setdefault(label, {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0})
+                entry["requests"] += requests_count
+                entry["prompt_tokens"] += prompt
+                entry["completion_tokens"] += completion
+            totals["requests"] += requests_count
+            totals["prompt_tokens"] += prompt
+            totals["completion_tokens"] += completion
         
         # Contar keys activas
         active_keys = sum(1 for k, v in self.keys.items() if v.get("active", False))
         
         return {
             "status": "ok",
-            "total_requests": total,
+            "days": days,
+            "total_requests": totals["requests"],
+            "prompt_tokens": totals["prompt_tokens"],
+            "completion_tokens": totals["completion_tokens"],
+            "total_tokens": totals["prompt_tokens"] + totals["completion_tokens"],
+            "daily": daily,
+            "by_key": by_key,
+            "by_model": by_model,
             "active_keys": active_keys,
             "total_keys": len(self.keys)
         }
     
     def health_check(self):
-        """Verificar salud del sistema"""
-        checks = {}
+        """Verificar salud del sistema (las tres comprobaciones a la vez: como mucho 5 s en total)"""
+        urls = {
+            "api_gateway": f"{API_GATEWAY_URL}/health",
+            "ollama": f"{API_GATEWAY_URL}/v1/models",
+            "nginx": "http://localhost/health"
+        }
         
-        # Check API Gateway
-        try:
-            r = requests.get(f"{API_GATEWAY_URL}/health", timeout=5)
-            checks["api_gateway"] = "OK" if r.status_code == 200 else "ERROR"
-        except:
-            checks["api_gateway"] = "DOWN"
+        def check(url):
+            try:
+                r = requests.get(url, timeout=5)
+                return ("OK" if r.status_code == 200 else "ERROR"), r
+            except requests.RequestException:
+                return "DOWN", None
         
-        # Check Ollama
-        try:
-            r = requests.get(f"{API_GATEWAY_URL}/v1/models", timeout=5)
-            checks["ollama"] = "OK" if r.status_code == 200 else "ERROR"
-        except:
-            checks["ollama"] = "DOWN"
+        with ThreadPoolExecutor(max_workers=len(urls)) as pool:
+            results = dict(zip(urls, pool.map(check, urls.values())))
         
-        # Check Nginx
-        try:
-            r = requests.get(f"http://localhost/health", timeout=5)
-            checks["nginx"] = "OK" if r.status_code == 200 else "ERROR"
-        except:
-            checks["nginx"] = "DOWN"
+        checks = {name: result for name, (result, _) in results.items()}
+        result = {"status": "ok", "checks": checks}
         
-        return {"status": "ok", "checks": checks}
+        # El gateway ya sondea Ollama y DeepSeek en segundo plano: su último resultado, sin esperar
+        gateway = results["api_gateway"][1]
+        if gateway is not None:
+            try:
+                result["dependencies"] = gateway.json().get("checks")
+            except ValueError:
+                pass
+        return result
     
     def execute(self, command):
         """Ejecutar comando"""
@@ -132,19 +199,30 @@ class APIManager:
         
         if "crea" in cmd and "key" in cmd:
             # Extraer nombre
-            parts = cmd.replace("crea", "").replace("key", "").replace("api", "").strip()
+            # "crea una API key batch para X": sus peticiones ceden el turno a las interactivas
+            priority = "batch" if "batch" in cmd.split() else "interactive"
+            parts = cmd.replace("crea", "").replace("key", "").replace("api", "").replace("batch", "").strip()
             name = parts if parts else "API Key"
-            return self.create_key(name)
+            return self.create_key(name, priority=priority)
         
         elif "lista" in cmd or "lista" in cmd:
             return self.list_keys()
         
         elif "estadísticas" in cmd or "stats" in cmd:
-            return self.get_stats()
+            # "dame las estadísticas de 7 días"
+            numbers = [int(word) for word in cmd.split() if word.isdigit()]
+            return self.get_stats(days=numbers[0] if numbers else 1)
         
         elif "salud" in cmd or "health" in cmd:
             return self.health_check()
         
+        elif "prioridad" in cmd or "priority" in cmd:
+            # "prioridad sk-bak-1234 batch"
+            parts = cmd.split()
+            if len(parts) < 3:
+                return {"status": "error", "message": "Uso: prioridad [key] interactive|batch"}
+            return self.set_priority(parts[-2], parts[-1])
+        
         elif "desactiva" in cmd or "bloquea" in cmd:
             # Extraer prefijo de key
             parts = cmd.split()
@@ -155,10 +233,11 @@ class APIManager:
             return {
                 "status": "ok",
                 "commands": [
-                    "crea una API key para [nombre]",
+                    "crea una API key [batch] para [nombre]",
                     "lista las API keys",
-                    "dame las estadísticas",
+                    "dame las estadísticas [de N días]",
                     "dame la salud del sistema",
+                    "prioridad [key] interactive|batch",
                     "desactiva [key]",
                     "ayuda"
                 ]
@@ -169,10 +248,11 @@ class APIManager:
                 "status": "error",
                 "message": "Comando no reconocido",
                 "available_commands": [
-                    "crea una API key para [nombre]",
+                    "crea una API key [batch] para [nombre]",
                     "lista las API keys",
-                    "dame las estadísticas",
+                    "dame las estadísticas [de N días]",
                     "dame la salud del sistema",
+                    "prioridad [key] interactive|batch",
                     "desactiva [key]",
                     "ayuda"
                 ]
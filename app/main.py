@@ -4,15 +4,30 @@ Unified AI API Gateway - bak.tecnotactil.com
 Compatible con OpenAI API - Ollama local + DeepSeek fallback
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response
 from flask_cors import CORS
-import requests
 import os
-import json
 import logging
+import time
+from functools import partial
 from datetime import datetime
+from api.services.model_registry import get_model_registry
+from api.services.http_client import get_upstream_client, upstream_stats
+from api.services.key_store import get_key_store
+from api.middleware.rate_limit import get_rate_limiter, rate_limit_headers
+from api.services.metrics import registry as metrics_registry, CONTENT_TYPE, UpstreamCall, observe_generation, observe_http
+from api.services.usage import get_usage_recorder
+from api.services.admission import get_admission_queue, priority_for
+from api.services.context_window import get_context_window
+from api.services.cancellation import RequestAborted, get_request_deadlines
+from api.services.journal import get_request_journal
+from api.services.backend_health import BackendUnavailable
+from api.services.health_prober import health_response, is_deep, start_health_prober
+from api.services.codec import JSON_HEADERS, FastJSONProvider, RawCompletion, dumps, loads
+from config.settings import load_config
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 CORS(app)
 
 # Configuración
@@ -20,55 +35,78 @@ OLLAMA_URL = os.getenv('OLLAMA_URL', 'http://localhost:11434')
 DEEPSEEK_URL = os.getenv('DEEPSEEK_URL', 'https://api.deepseek.com/chat/completions')
 DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY', '')
 ADMIN_API_KEY = os.getenv('ADMIN_API_KEY', '')
-KEYS_FILE = "/root/ai-gateway/api_keys.json"
 
 # Logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+key_store = get_key_store()
+usage_recorder = get_usage_recorder()
+admission = get_admission_queue()
+context_window = get_context_window()
+deadlines = get_request_deadlines()
+journal = get_request_journal()
+DEFAULT_PRIORITY = load_config()['ADMISSION_DEFAULT_PRIORITY']
+start_health_prober()
+
 def verify_api_key():
-    """Verificar API key en headers"""
+    """Verificar API key en headers; devuelve la key válida o None"""
     auth = request.headers.get('Authorization', '')
     if auth.startswith('Bearer '):
         key = auth[7:]
         
         # Admin key siempre funciona
-        if key == ADMIN_API_KEY:
-            return True
+        if ADMIN_API_KEY and key == ADMIN_API_KEY:
+            return key
         
-        # Verificar en archivo de keys (búsqueda por prefijo)
-        if os.path.exists(KEYS_FILE):
-            try:
-                with open(KEYS_FILE, 'r') as f:
-                    keys = json.load(f)
-                
-                # Buscar key que comience con el prefijo enviado
-                for full_key, data in keys.items():
-                    if full_key.startswith(key) and data.get('active', False):
-                        # Incrementar contador de requests
-                        keys[full_key]['requests'] = keys[full_key].get('requests', 0) + 1
-                        with open(KEYS_FILE, 'w') as f:
-                            json.dump(keys, f, indent=2)
-                        return True
-            except Exception as e:
-                logger.error(f"Error verificando key: {e}")
-    return False
+        # Búsqueda exacta en el índice en memoria; el contador se persiste en lotes
+        if key_store.get(key):
+            key_store.record_usage(key, requests=1)
+            return key
+    return None
+
+@app.before_request
+def start_timer():
+    g.started = time.monotonic()
+    if journal:
+        g.trace = journal.begin(request.method, request.path, request.get_data)
+
+@app.after_request
+def add_rate_limit_headers(response):
+    if 'rate_limit' in g:
+        response.headers.extend(rate_limit_headers(g.rate_limit))
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    observe_http(request.method, route, response.status_code, time.monotonic() - g.get('started', time.monotonic()))
+    if g.get('trace'):
+        finish = partial(journal.finish, g.trace, response.status_code, g.get('api_key', ''),
+                         cache=response.headers.get('X-Cache'))
+        # Un stream se registra al terminar de enviarse
+        if response.is_streamed:
+            response.call_on_close(finish)
+        else:
+            finish()
+    return response
 
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({
-        "status": "healthy",
+    body, status = health_response({
         "service": "Unified AI API Gateway",
         "domain": "bak.tecnotactil.com"
-    })
+    }, is_deep(request.args.get('deep')))
+    return jsonify(body), status
+
+@app.route('/health/upstreams', methods=['GET'])
+def health_upstreams():
+    return jsonify({"upstreams": upstream_stats()})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # Con gunicorn -w 4 hay que definir METRICS_DIR para sumar los cuatro workers
+    return Response(metrics_registry.render(), content_type=CONTENT_TYPE)
 
 @app.route('/v1/models', methods=['GET'])
 def list_models():
-    try:
-        ollama_resp = requests.get(f'{OLLAMA_URL}/api/tags', timeout=5)
-        local_models = ollama_resp.json().get('models', [])
-    except:
-        local_models = []
+    local_models = get_model_registry().models()
     
     models = []
     for m in local_models:
@@ -89,14 +127,22 @@ def list_models():
 
 @app.route('/v1/chat/completions', methods=['POST'])
 def chat_completions():
-    if not verify_api_key():
+    api_key = verify_api_key()
+    if not api_key:
         return jsonify({"error": "Invalid API key"}), 401
+    g.api_key = api_key
+    
+    g.rate_limit = get_rate_limiter().check(api_key)
+    if not g.rate_limit.allowed:
+        return jsonify({"error": "Rate limit exceeded"}), 429
     
     data = request.json
     model = data.get('model', 'qwen2.5:7b')
     messages = data.get('messages', [])
     temperature = data.get('temperature', 0.7)
     max_tokens = data.get('max_tokens', 2000)
+    # Plazo según max_tokens (este modo no vigila la desconexión del cliente)
+    scope = deadlines.begin(max_tokens)
     
     logger.info(f"Request: model={model}, messages={len(messages)}")
     
@@ -110,8 +156,13 @@ def chat_completions():
         try:
             ollama_messages = []
             system_prompt = None
+            options = {"temperature": temperature, "num_predict": max_tokens}
+            # Historial ajustado al contexto del modelo (sin resúmenes en este modo)
+            compaction = context_window.compact('qwen2.5:7b', messages, max_tokens) if context_window else None
+            if compaction:
+                options["num_ctx"] = compaction.num_ctx
             
-            for msg in messages:
+            for msg in (compaction.messages if compaction else messages):
                 if msg.get('role') == 'system':
                     system_prompt = msg.get('content', '')
                 else:
@@ -126,22 +177,39 @@ def chat_completions():
             ollama_payload = {
                 "model": "qwen2.5:7b",
                 "messages": ollama_messages,
-                "options": {
-                    "temperature": temperature,
-                    "num_predict": max_tokens
-                },
+                "options": options,
                 "stream": False
             }
             
-            ollama_resp = requests.post(
-                f'{OLLAMA_URL}/api/chat',
-                json=ollama_payload,
-                timeout=120
-            )
+            # Turno en la cola de admisión: si el plazo vence se pasa a DeepSeek
+            slot = admission.acquire(priority_for(key_store.get(api_key), DEFAULT_PRIORITY)) if admission else None
+            call = UpstreamCall('ollama', ollama_payload['model'])
+            try:
+                ollama_resp = get_upstream_client('ollama').post(
+                    f'{OLLAMA_URL}/api/chat',
+                    data=dumps(ollama_payload),
+                    headers=JSON_HEADERS,
+                    timeout=scope.timeout(get_upstream_client('ollama').read_timeout)
+                )
+            except Exception:
+                call.finish('error')
+                raise
+            finally:
+                if slot is not None:
+                    admission.release(slot)
+            call.finish(ollama_resp.status_code)
             
             if ollama_resp.status_code == 200:
-                result = ollama_resp.json()
+                result = loads(ollama_resp.content)
+                observe_generation(
+                    'ollama', ollama_payload['model'], result.get('prompt_eval_count', 0),
+                    result.get('eval_count', 0), result.get('eval_duration', 0) / 1e9
+                )
                 content = result.get('message', {}).get('content', '')
+                # Tokens reales de Ollama (también suma el total por key en api_keys.json)
+                prompt_tokens = result.get('prompt_eval_count', 0)
+                completion_tokens = result.get('eval_count', 0)
+                usage_recorder.record('ollama', ollama_payload['model'], prompt_tokens, completion_tokens, api_key=api_key)
                 
                 return jsonify({
                     "id": f"chatcmpl-local-{datetime.now().timestamp()}",
@@ -154,17 +222,23 @@ def chat_completions():
                             "role": "assistant",
                             "content": content
                         },
-                        "finish_reason": "stop"
+                        "finish_reason": 'length' if result.get('done_reason') == 'length' else 'stop'
                     }],
                     "usage": {
-                        "prompt_tokens": 0,
-                        "completion_tokens": len(content.split()),
-                        "total_tokens": len(content.split())
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens
                     }
                 })
             
+        except BackendUnavailable as e:
+            # Cola llena: descartar ahora en vez de cargar DeepSeek con todo el exceso
+            return jsonify({"error": "Service unavailable", "message": str(e)}), 503, {'Retry-After': str(e.retry_after)}
         except Exception as e:
             logger.error(f"Ollama error: {e}")
+            if scope.expired():
+                # Sin plazo para reintentar con DeepSeek
+                return jsonify({"error": "Request aborted", "message": str(scope.deadline_error())}), 504
             use_local = False
     
     # Fallback a DeepSeek
@@ -181,15 +255,39 @@ def chat_completions():
             "Content-Type": "application/json"
         }
         
-        ds_resp = requests.post(DEEPSEEK_URL, json=deepseek_payload, headers=headers, timeout=120)
+        call = UpstreamCall('deepseek', deepseek_payload['model'])
+        try:
+            ds_resp = get_upstream_client('deepseek').post(
+                DEEPSEEK_URL, data=dumps(deepseek_payload), headers=headers,
+                timeout=scope.timeout(get_upstream_client('deepseek').read_timeout)
+            )
+        except Exception:
+            call.finish('error')
+            raise
+        call.finish(ds_resp.status_code)
         
         if ds_resp.status_code == 200:
-            return ds_resp.json()
+            # Ya es compatible con OpenAI: se devuelve con los bytes recibidos
+            result = RawCompletion(ds_resp.content)
+            usage = result.get('usage') or {}
+            observe_generation(
+                'deepseek', deepseek_payload['model'], usage.get('prompt_tokens', 0),
+                usage.get('completion_tokens', 0), time.monotonic() - call.started
+            )
+            usage_recorder.record(
+                'deepseek', deepseek_payload['model'], usage.get('prompt_tokens', 0),
+                usage.get('completion_tokens', 0), api_key=api_key
+            )
+            return result
         else:
             return jsonify({"error": f"DeepSeek error: {ds_resp.status_code}"}), 500
             
+    except RequestAborted as e:
+        return jsonify({"error": "Request aborted", "message": str(e)}), e.status
     except Exception as e:
         logger.error(f"DeepSeek error: {e}")
+        if scope.expired():
+            return jsonify({"error": "Request aborted", "message": str(scope.deadline_error())}), 504
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+"""
+Unified AI API Gateway - Modo asíncrono (ASGI)
+Mismos endpoints que run.py servidos con asyncio: uvicorn asgi:app
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse as StarletteJSONResponse, Response, StreamingResponse
+from starlette.middleware import Middleware
+from starlette.routing import Route
+
+from api.middleware.auth import is_valid_api_key
+from api.middleware.rate_limit import get_rate_limiter, rate_limit_headers
+from api.routes.models import build_model_list
+from api.services.async_router import AsyncAIRouter
+from api.services.admission import current_priority
+from api.services.cancellation import RequestAborted, get_request_deadlines
+from api.services.journal import get_request_journal
+from api.services.health_prober import health_response, is_deep, start_health_prober
+from api.services.usage import current_api_key
+from api.services.cache import CompletionCache, get_completion_cache, is_cache_bypassed, is_deterministic
+from api.services.coalescing import AsyncSingleFlight
+from api.services.batch import (
+    AsyncBatchExecutor, backend_limits, batch_response, first_error, max_item_tokens, merge_choices, parse_batch,
+    parse_choices, replicate_choices
+)
+from api.services.backend_health import BackendUnavailable, backend_health_stats
+from api.services.codec import dumps, loads
+from api.services.embeddings import embedding_response, parse_embedding_request
+from api.services.semantic_cache import get_semantic_cache
+from api.services.http_client import close_async_upstream_clients, upstream_stats
+from api.services.metrics import CONTENT_TYPE, observe_http, registry as metrics_registry
+from config.settings import load_config
+
+config = load_config()
+router = AsyncAIRouter()
+completion_cache = get_completion_cache()
+single_flight = AsyncSingleFlight() if config['COALESCE_ENABLED'] else None
+semantic_cache = get_semantic_cache()
+semantic_model = config['SEMANTIC_CACHE_MODEL'] or None
+batch_executor = AsyncBatchExecutor(router, backend_limits(config))
+max_batch_items = config['BATCH_MAX_ITEMS']
+max_embedding_inputs = config['EMBEDDING_MAX_INPUTS']
+journal = get_request_journal()
+deadlines = get_request_deadlines()
+
+
+class JSONResponse(StarletteJSONResponse):
+    """JSONResponse con el codec del gateway (orjson; RawCompletion sale con sus bytes upstream)"""
+
+    def render(self, content):
+        return dumps(content)
+
+
+async def read_json(request):
+    """Cuerpo JSON de la petición, parseado una sola vez (rate limit y handler)"""
+    if not hasattr(request.state, 'json'):
+        request.state.json = loads(await request.body())
+    return request.state.json
+
+
+def get_api_key(request):
+    auth_header = request.headers.get('Authorization', '')
+    if auth_header.startswith('Bearer '):
+        return auth_header[7:]
+    return request.query_params.get('api_key', '')
+
+
+async def _request_cost(request):
+    """Cada elemento de un lote o cada choice (n) cuenta como una petición"""
+    try:
+        data = await read_json(request)
+    except ValueError:
+        return 1
+    if not isinstance(data, dict):
+        return 1
+    if isinstance(data.get('requests'), list):
+        return min(max(1, len(data['requests'])), max_batch_items)
+    n = data.get('n', 1)
+    return min(n, max_batch_items) if isinstance(n, int) and n > 1 else 1
+
+
+async def _authorized(request, handler):
+    api_key = get_api_key(request)
+    if not is_valid_api_key(api_key):
+        return JSONResponse({"error": "Invalid or missing API key"}, status_code=401)
+    limit = get_rate_limiter().check(api_key, await _request_cost(request))
+    if not limit.allowed:
+        return JSONResponse({"error": "Rate limit exceeded"}, status_code=429, headers=rate_limit_headers(limit))
+
+    response = await handler(request)
+    response.headers.update(rate_limit_headers(limit))
+    return response
+
+
+async def create_completion(request):
+    """POST /v1/chat/completions (ver api/routes/chat.py)"""
+    return await _authorized(request, _create_completion)
+
+
+async def create_batch(request):
+    """POST /v1/chat/batch (ver api/routes/chat.py)"""
+    return await _authorized(request, _create_batch)
+
+
+async def create_embeddings(request):
+    """POST /v1/embeddings (ver api/routes/embeddings.py)"""
+    return await _authorized(request, _create_embeddings)
+
+
+def _disconnect_source(request):
+    """receive de la petición para vigilar la desconexión (None si CANCEL_ON_DISCONNECT=false)"""
+    return request.receive if deadlines.cancel_on_disconnect else None
+
+
+async def _create_completion(request):
+    try:
+        try:
+            data = await read_json(request)
+        except ValueError:
+            data = None
+
+        if not data:
+            return JSONResponse({"error": "No input data provided"}, status_code=400)
+
+        if 'messages' not in data:
+            return JSONResponse({"error": "Missing 'messages' parameter"}, status_code=400)
+
+        if 'model' not in data:
+            return JSONResponse({"error": "Missing 'model' parameter"}, status_code=400)
+
+        try:
+            n = parse_choices(data, max_batch_items)
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+
+        model = data.get('model')
+        messages = data.get('messages')
+        temperature = data.get('temperature', 0.7)
+        max_tokens = data.get('max_tokens', 2000)
+        stream = data.get('stream', False)
+        # Cancelar la tarea corta la petición httpx: Ollama deja de generar
+        scope = deadlines.begin(max_tokens)
+        receive = _disconnect_source(request)
+
+        if n > 1 and not is_deterministic(temperature):
+            outcomes = await scope.run(batch_executor.run(
+                [{"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}] * n
+            ), receive)
+            error = first_error(outcomes)
+            if error is not None:
+                raise error
+            return JSONResponse(merge_choices(outcomes))
+
+        request_key = CompletionCache.make_key(model, messages, temperature, max_tokens) if is_deterministic(temperature) else None
+        use_cache = completion_cache is not None and completion_cache.is_cacheable(temperature, stream)
+        bypass = is_cache_bypassed(request.headers)
+        if use_cache and not bypass:
+            cached = completion_cache.get(request_key)
+            if cached is not None:
+                if n > 1:
+                    cached = replicate_choices(cached, n)
+                return JSONResponse(cached, headers={'X-Cache': 'HIT'})
+
+        probe = None
+        if semantic_cache is not None and not stream and not bypass:
+            probe = await semantic_cache.probe_async(model, messages, lambda text: router.embed_text(text, semantic_model),
+                                                     temperature, max_tokens)
+            if probe is not None and probe.response is not None:
+                cached = replicate_choices(probe.response, n) if n > 1 else probe.response
+                return JSONResponse(cached, headers={'X-Cache': 'SEMANTIC', 'X-Cache-Similarity': f"{probe.similarity:.4f}"})
+
+        async def route():
+            return await router.route_request(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=stream,
+                session=request.headers.get('X-Session-Id')
+            )
+
+        if single_flight and request_key:
+            # La llamada compartida sigue aunque se vaya el cliente que la abrió
+            run = single_flight.do_stream if stream else single_flight.do
+            response, leader = await scope.run(run(f"{'stream' if stream else 'json'}:{request_key}", route))
+        else:
+            response, leader = await scope.run(route(), receive), True
+        headers = {} if leader else {'X-Coalesced': 'true'}
+
+        if stream:
+            return StreamingResponse(
+                scope.guard_async(response, receive),
+                media_type='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', **headers}
+            )
+
+        if use_cache:
+            if leader:
+                completion_cache.set(request_key, response)
+            headers['X-Cache'] = 'BYPASS' if bypass else 'MISS'
+        if probe is not None and leader:
+            semantic_cache.store(probe, response)
+
+        if n > 1:
+            response = replicate_choices(response, n)
+        return JSONResponse(response, headers=headers)
+
+    except BackendUnavailable as e:
+        return JSONResponse({"error": "Service unavailable", "message": str(e)},
+                            status_code=503, headers={'Retry-After': str(e.retry_after)})
+
+    except RequestAborted as e:
+        return JSONResponse({"error": "Request aborted", "message": str(e)}, status_code=e.status)
+
+    except Exception as e:
+        logging.error(f"Error en completions: {e}")
+        return JSONResponse({
+            "error": "Internal server error",
+            "message": str(e)
+        }, status_code=500)
+
+
+async def _create_batch(request):
+    try:
+        data = await read_json(request)
+    except ValueError:
+        data = None
+    try:
+        requests = parse_batch(data, max_batch_items)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    outcomes = [None] * len(requests)
+    pending = []
+    for index, item in enumerate(requests):
+        if completion_cache is not None and completion_cache.is_cacheable(item['temperature']):
+            item_key = CompletionCache.make_key(item['model'], item['messages'], item['temperature'], item['max_tokens'])
+            outcomes[index] = completion_cache.get(item_key)
+        if outcomes[index] is None:
+            pending.append(index)
+
+    # Los lotes nunca adelantan en la cola de Ollama a las peticiones interactivas
+    current_priority.set('batch')
+    scope = deadlines.begin(max_item_tokens(requests))
+    try:
+        completed = await scope.run(batch_executor.run([requests[i] for i in pending]), _disconnect_source(request))
+    except RequestAborted as e:
+        return JSONResponse({"error": "Request aborted", "message": str(e)}, status_code=e.status)
+    for index, outcome in zip(pending, completed):
+        outcomes[index] = outcome
+        item = requests[index]
+        if completion_cache is not None and completion_cache.is_cacheable(item['temperature']) and isinstance(outcome, dict):
+            completion_cache.set(
+                CompletionCache.make_key(item['model'], item['messages'], item['temperature'], item['max_tokens']),
+                outcome
+            )
+
+    return JSONResponse(batch_response(outcomes))
+
+
+async def _create_embeddings(request):
+    try:
+        data = await read_json(request)
+    except ValueError:
+        data = None
+    try:
+        params = parse_embedding_request(data, max_embedding_inputs)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    model = router.resolve_embedding_model(params['model'])
+    if model is None:
+        return JSONResponse({"error": f"Model '{params['model']}' not found"}, status_code=404)
+
+    try:
+        vectors, tokens = await router.embed(model, params['input'], params['dimensions'])
+        return JSONResponse(embedding_response(model, vectors, tokens, params['encoding_format']))
+
+    except BackendUnavailable as e:
+        return JSONResponse({"error": "Service unavailable", "message": str(e)},
+                            status_code=503, headers={'Retry-After': str(e.retry_after)})
+
+    except Exception as e:
+        logging.error(f"Error en embeddings: {e}")
+        return JSONResponse({
+            "error": "Internal server error",
+            "message": str(e)
+        }, status_code=500)
+
+
+async def list_models(request):
+    return JSONResponse(build_model_list())
+
+
+async def health_check(request):
+    base = {"service": "Unified AI API Gateway", "version": "1.0.0"}
+    if is_deep(request.query_params.get('deep')):
+        # Una ronda profunda espera a las sondas (bloqueantes): fuera del event loop
+        body, status = await run_in_threadpool(health_response, base, True)
+    else:
+        body, status = health_response(base)
+    return JSONResponse(body, status_code=status)
+
+
+async def upstream_pools(request):
+    return JSONResponse({"upstreams": upstream_stats()})
+
+
+async def backends(request):
+    return JSONResponse({"backends": backend_health_stats()})
+
+
+async def coalescing_stats(request):
+    return JSONResponse({"coalescing": single_flight.stats() if single_flight else None})
+
+
+async def ollama_nodes(request):
+    return JSONResponse({"ollama": router.pool.stats()})
+
+
+async def hedging_stats(request):
+    return JSONResponse({"hedging": router.hedging.stats() if router.hedging else None})
+
+
+async def admission_stats(request):
+    return JSONResponse({"admission": router.admission.stats() if router.admission else None})
+
+
+async def semantic_cache_stats(request):
+    return JSONResponse({"semantic_cache": semantic_cache.stats() if semantic_cache else None})
+
+
+async def context_stats(request):
+    return JSONResponse({"context": router.context.stats() if router.context else None})
+
+
+async def residency_stats(request):
+    return JSONResponse({"residency": router.residency.stats() if router.residency else None})
+
+
+async def deadline_stats(request):
+    return JSONResponse({"deadlines": deadlines.stats()})
+
+
+async def journal_stats(request):
+    return JSONResponse({"journal": journal.stats() if journal else None})
+
+
+async def embedding_stats(request):
+    return JSONResponse({"embeddings": router.embeddings.stats()})
+
+
+async def batch_stats(request):
+    return JSONResponse({"batch": batch_executor.stats()})
+
+
+async def metrics(request):
+    return Response(metrics_registry.render(), headers={'Content-Type': CONTENT_TYPE})
+
+
+async def cache_stats(request):
+    return JSONResponse({"cache": completion_cache.stats() if completion_cache else None})
+
+
+class MetricsMiddleware:
+    """Cuenta peticiones y tiempo hasta las cabeceras por ruta (ASGI puro, no bufferiza streams)"""
+
+    def __init__(self, app, paths):
+        self.app = app
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        started = time.monotonic()
+        route = scope['path'] if scope['path'] in self.paths else 'unmatched'
+
+        async def send_with_metrics(message):
+            if message['type'] == 'http.response.start':
+                observe_http(scope['method'], route, message['status'], time.monotonic() - started)
+            await send(message)
+
+        await self.app(scope, receive, send_with_metrics)
+
+
+class JournalMiddleware:
+    """Registra cada petición /v1/ en el journal al enviar el último byte (streams incluidos)"""
+
+    def __init__(self, app, journal):
+        self.app = app
+        self.journal = journal
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self.journal.journaled(scope['path']):
+            return await self.app(scope, receive, send)
+        trace = self.journal.begin(scope['method'], scope['path'])
+        body = []
+        response = {"status": 500, "cache": None}
+
+        async def receive_with_body():
+            message = await receive()
+            if message['type'] == 'http.request':
+                body.append(message.get('body', b''))
+            return message
+
+        def finish():
+            trace.body = b''.join(body)
+            self.journal.finish(trace, response["status"], current_api_key.get(), current_priority.get(),
+                                response["cache"])
+
+        async def send_with_journal(message):
+            if message['type'] == 'http.response.start':
+                response["status"] = message['status']
+                for name, value in message.get('headers', ()):
+                    if name.lower() == b'x-cache':
+                        response["cache"] = value.decode('latin-1')
+            await send(message)
+            if message['type'] == 'http.response.body' and not message.get('more_body', False):
+                finish()
+
+        try:
+            await self.app(scope, receive_with_body, send_with_journal)
+        finally:
+            # Cliente desconectado o excepción: se registra lo que haya
+            finish()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Primer inventario de Ollama fuera del event loop para no bloquearlo
+    registry = router.models
+    registry.start()
+    await asyncio.get_running_loop().run_in_executor(None, registry.wait_ready)
+    start_health_prober()
+    yield
+    await close_async_upstream_clients()
+
+
+routes = [
+    Route('/health', health_check, methods=['GET']),
+    Route('/health/upstreams', upstream_pools, methods=['GET']),
+    Route('/health/cache', cache_stats, methods=['GET']),
+    Route('/health/backends', backends, methods=['GET']),
+    Route('/health/coalescing', coalescing_stats, methods=['GET']),
+    Route('/health/batch', batch_stats, methods=['GET']),
+    Route('/health/ollama', ollama_nodes, methods=['GET']),
+    Route('/health/hedging', hedging_stats, methods=['GET']),
+    Route('/health/admission', admission_stats, methods=['GET']),
+    Route('/health/embeddings', embedding_stats, methods=['GET']),
+    Route('/health/semantic-cache', semantic_cache_stats, methods=['GET']),
+    Route('/health/context', context_stats, methods=['GET']),
+    Route('/health/residency', residency_stats, methods=['GET']),
+    Route('/health/journal', journal_stats, methods=['GET']),
+    Route('/health/deadlines', deadline_stats, methods=['GET']),
+    Route('/metrics', metrics, methods=['GET']),
+    Route('/v1/models', list_models, methods=['GET']),
+    Route('/v1/chat/completions', create_completion, methods=['POST']),
+    Route('/v1/chat/batch', create_batch, methods=['POST']),
+    Route('/v1/embeddings', create_embeddings, methods=['POST']),
+]
+
+middleware = [Middleware(MetricsMiddleware, paths=[route.path for route in routes])]
+if journal:
+    middleware.append(Middleware(JournalMiddleware, journal=journal))
+
+app = Starlette(routes=routes, middleware=middleware, lifespan=lifespan)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    host = config.get('HOST', '0.0.0.0')
+    port = config.get('PORT', 8080)
+
+    print(f"🚀 Unified AI API Gateway (asyncio) iniciado en http://{host}:{port}")
+    uvicorn.run(app, host=host, port=port, log_level=config.get('LOG_LEVEL', 'INFO').lower())
@@ -0,0 +1 @@
+# Benchmarks - Servidores stub de Ollama/DeepSeek y generador de carga para el gateway
@@ -0,0 +1,288 @@
+# Benchmark CLI - python -m bench run|replay|compare
+import argparse
+import json
+import sys
+from datetime import datetime, timezone
+
+from bench.harness import (
+    BENCH_API_KEY, TARGETS, Gateway, ProcessSampler, build_payload, git_revision, resource_usage,
+    run_load, summarize
+)
+from bench.replay import load_trace, replay as replay_trace
+from bench.stubs import StubProfile, start_deepseek_stub, start_ollama_stub
+
+# Métricas que comparan dos ejecuciones: (ruta en el JSON, True si más alto es mejor)
+COMPARED = (
+    (("results", "throughput_rps"), True),
+    (("results", "latency", "p50"), False),
+    (("results", "latency", "p95"), False),
+    (("results", "latency", "p99"), False),
+    (("results", "ttft", "p50"), False),
+    (("results", "ttft", "p95"), False),
+    (("results", "error_rate"), False),
+    (("gateway", "cpu_ms_per_request"), False),
+    (("gateway", "rss_peak_mb"), False),
+)
+
+
+def _env_pairs(values):
+    env = {}
+    for item in values or []:
+        if '=' not in item:
+            raise SystemExit(f"--env expects KEY=VALUE, got '{item}'")
+        key, value = item.split('=', 1)
+        env[key] = value
+    return env
+
+
+def _profile(args, prefix, models):
+    return StubProfile(
+        latency=getattr(args, f'{prefix}_latency'),
+        tokens=args.tokens,
+        token_rate=getattr(args, f'{prefix}_token_rate'),
+        error_rate=getattr(args, f'{prefix}_error_rate'),
+        models=models
+    )
+
+
+def run(args):
+    ollama_models = ('qwen2.5:7b',) if 'deepseek' in args.model else (args.model,)
+    ollama_profile = _profile(args, 'ollama', ollama_models)
+    deepseek_profile = _profile(args, 'deepseek', ('deepseek-chat',))
+    ollama = start_ollama_stub(ollama_profile)
+    deepseek = start_deepseek_stub(deepseek_profile)
+    gateway = None
+    try:
+        url, pid = args.url, args.pid
+        if not url:
+            gateway = Gateway(args.target, ollama.url, f"{deepseek.url}/chat/completions",
+                              workers=args.workers, env=_env_pairs(args.env)).start()
+            url, pid = gateway.url, gateway.process.pid
+        endpoint = f"{url.rstrip('/')}/v1/chat/completions"
+
+        def payload():
+            return build_payload(args.model, args.stream, args.tokens, unique=not args.repeat)
+
+        if args.warmup:
+            run_load(endpoint, payload, min(args.concurrency, args.warmup), total=args.warmup, api_key=args.api_key)
+
+        sampler = ProcessSampler(pid) if pid else None
+        if sampler:
+            sampler.start()
+            before = sampler.sample()
+        results, elapsed = run_load(endpoint, payload, args.concurrency, total=args.requests,
+                                    duration=args.duration, api_key=args.api_key, timeout=args.timeout)
+        if sampler:
+            after = sampler.sample()
+            sampler.stop()
+
+        # Referencia para el overhead: el backend que sirve el modelo pedido
+        backend = deepseek_profile if 'deepseek' in args.model else ollama_profile
+        report = {
+            "version": 1,
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            "revision": git_revision(),
+            "target": args.target if gateway else url,
+            "settings": {
+                "concurrency": args.concurrency,
+                "requests": args.requests,
+                "duration": args.duration,
+                "warmup": args.warmup,
+                "stream": args.stream,
+                "model": args.model,
+                "unique_prompts": not args.repeat,
+                "workers": args.workers,
+                "env": _env_pairs(args.env)
+            },
+            "stubs": {"ollama": ollama_profile.as_dict(), "deepseek": deepseek_profile.as_dict()},
+            "results": summarize(results, elapsed, backend.expected_seconds()),
+            "gateway": resource_usage(sampler, before, after, elapsed, len(results)) if sampler else None,
+            "upstream": {"ollama": ollama.stats(), "deepseek": deepseek.stats()}
+        }
+    finally:
+        if gateway:
+            gateway.stop()
+        ollama.stop()
+        deepseek.stop()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(_brief(report), file=sys.stderr)
+    else:
+        print(output)
+    return 0
+
+
+def replay(args):
+    """Reproduce un journal del gateway; sin --url contra los stubs con los modelos de la traza"""
+    entries = load_trace(args.trace, args.limit)
+    if not entries:
+        raise SystemExit("No requests found in the trace")
+    models = {entry.get('model') for entry in entries if entry.get('model')}
+    local_models = sorted({model for model in models if 'deepseek' not in model} | {'qwen2.5:7b', 'nomic-embed-text'})
+    ollama = deepseek = gateway = None
+    try:
+        url, pid = args.url, args.pid
+        if not url:
+            ollama = start_ollama_stub(StubProfile(models=local_models))
+            deepseek = start_deepseek_stub()
+            gateway = Gateway(args.target, ollama.url, f"{deepseek.url}/chat/completions",
+                              workers=args.workers, env=_env_pairs(args.env)).start()
+            url, pid = gateway.url, gateway.process.pid
+
+        sampler = ProcessSampler(pid) if pid else None
+        if sampler:
+            sampler.start()
+            before = sampler.sample()
+        results, elapsed, lag = replay_trace(url, entries, speed=args.speed, api_key=args.api_key,
+                                             batch_api_key=args.batch_api_key, timeout=args.timeout,
+                                             max_in_flight=args.max_in_flight)
+        if sampler:
+            after = sampler.sample()
+            sampler.stop()
+
+        report = {
+            "version": 1,
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            "revision": git_revision(),
+            "target": args.target if gateway else url,
+            "settings": {
+                "trace": args.trace,
+                "requests": len(entries),
+                "trace_seconds": round(entries[-1]['ts'] - entries[0]['ts'], 3),
+                "speed": args.speed,
+                "workers": args.workers,
+                "env": _env_pairs(args.env)
+            },
+            "results": summarize(results, elapsed),
+            "replay": {"max_lag_seconds": round(lag, 6)},
+            "gateway": resource_usage(sampler, before, after, elapsed, len(results)) if sampler else None,
+            "upstream": {"ollama": ollama.stats(), "deepseek": deepseek.stats()} if ollama else None
+        }
+    finally:
+        if gateway:
+            gateway.stop()
+        for stub in (ollama, deepseek):
+            if stub:
+                stub.stop()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(_brief(report), file=sys.stderr)
+    else:
+        print(output)
+    return 0
+
+
+def _brief(report):
+    results, gateway = report["results"], report["gateway"] or {}
+    latency = results["latency"] or {}
+    return (f"{results['succeeded']}/{results['requests']} ok, {results['throughput_rps']} req/s, "
+            f"p50 {latency.get('p50')}s p95 {latency.get('p95')}s p99 {latency.get('p99')}s, "
+            f"cpu {gateway.get('cpu_ms_per_request')} ms/req, rss {gateway.get('rss_peak_mb')} MB")
+
+
+def _lookup(report, path):
+    value = report
+    for part in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def compare(args):
+    """Tabla de diferencias; código 1 si alguna métrica empeora más que --threshold %"""
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    rows, regressions = [], []
+    for path, higher_is_better in COMPARED:
+        name = '.'.join(path[1:])
+        old, new = _lookup(baseline, path), _lookup(candidate, path)
+        change = None
+        if isinstance(old, (int, float)) and isinstance(new, (int, float)) and old:
+            change = 100 * (new - old) / old
+            worse = -change if higher_is_better else change
+            if args.threshold is not None and worse > args.threshold:
+                regressions.append(name)
+        rows.append({"metric": name, "baseline": old, "candidate": new,
+                     "change_percent": round(change, 2) if change is not None else None})
+
+    if args.json:
+        print(json.dumps({"metrics": rows, "regressions": regressions}, indent=2))
+    else:
+        print(f"{'metric':<22}{'baseline':>14}{'candidate':>14}{'change':>10}")
+        for row in rows:
+            change = f"{row['change_percent']:+.1f}%" if row['change_percent'] is not None else '-'
+            print(f"{row['metric']:<22}{str(row['baseline']):>14}{str(row['candidate']):>14}{change:>10}")
+        if regressions:
+            print(f"\nRegressions over {args.threshold}%: {', '.join(regressions)}")
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench', description='Gateway load tests against stub backends')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='Start stubs and the gateway, apply load and report JSON')
+    run_parser.add_argument('--target', choices=sorted(TARGETS), default='run', help='Gateway entry point')
+    run_parser.add_argument('--workers', type=int, default=1, help='Workers for asgi/gunicorn targets')
+    run_parser.add_argument('--url', help='Benchmark an already running gateway instead of starting one')
+    run_parser.add_argument('--pid', type=int, help='Gateway pid to sample CPU/memory when using --url')
+    run_parser.add_argument('--api-key', default=BENCH_API_KEY)
+    run_parser.add_argument('--env', action='append', metavar='KEY=VALUE', help='Extra gateway setting')
+    run_parser.add_argument('-c', '--concurrency', type=int, default=8)
+    run_parser.add_argument('-n', '--requests', type=int, help='Total requests (default 200 without --duration)')
+    run_parser.add_argument('-d', '--duration', type=float, help='Stop after this many seconds')
+    run_parser.add_argument('--warmup', type=int, default=10, help='Requests sent before measuring')
+    run_parser.add_argument('--stream', action='store_true')
+    run_parser.add_argument('--model', default='qwen2.5:7b')
+    run_parser.add_argument('--repeat', action='store_true', help='Send identical deterministic prompts (cache/coalescing)')
+    run_parser.add_argument('--tokens', type=int, default=32, help='Completion tokens per response')
+    run_parser.add_argument('--timeout', type=float, default=120)
+    for backend, latency, rate in (('ollama', 0.05, 200.0), ('deepseek', 0.2, 100.0)):
+        run_parser.add_argument(f'--{backend}-latency', type=float, default=latency, help='Seconds to first token')
+        run_parser.add_argument(f'--{backend}-token-rate', type=float, default=rate, help='Tokens per second')
+        run_parser.add_argument(f'--{backend}-error-rate', type=float, default=0.0, help='Fraction of 500 responses')
+    run_parser.add_argument('-o', '--output', help='Write the JSON report here instead of stdout')
+
+    replay_parser = commands.add_parser('replay', help='Re-issue a request journal at its original (or scaled) timing')
+    replay_parser.add_argument('trace', nargs='+', help='Journal files or directories (JOURNAL_DIR)')
+    replay_parser.add_argument('--target', choices=sorted(TARGETS), default='run', help='Gateway entry point')
+    replay_parser.add_argument('--workers', type=int, default=1, help='Workers for asgi/gunicorn targets')
+    replay_parser.add_argument('--url', help='Replay against an already running gateway instead of the stubs')
+    replay_parser.add_argument('--pid', type=int, help='Gateway pid to sample CPU/memory when using --url')
+    replay_parser.add_argument('--api-key', default=BENCH_API_KEY)
+    replay_parser.add_argument('--batch-api-key', help='Key for requests recorded with batch priority')
+    replay_parser.add_argument('--env', action='append', metavar='KEY=VALUE', help='Extra gateway setting')
+    replay_parser.add_argument('--speed', type=float, default=1.0, help='Time scale: 2 = twice as fast, 0 = no waits')
+    replay_parser.add_argument('--limit', type=int, help='Only the first N requests of the trace')
+    replay_parser.add_argument('--max-in-flight', type=int, default=256, help='Concurrent requests the replayer can hold')
+    replay_parser.add_argument('--timeout', type=float, default=120)
+    replay_parser.add_argument('-o', '--output', help='Write the JSON report here instead of stdout')
+
+    compare_parser = commands.add_parser('compare', help='Compare two JSON reports')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--threshold', type=float, help='Fail if a metric gets worse by more than this %%')
+    compare_parser.add_argument('--json', action='store_true')
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        if args.requests is None and args.duration is None:
+            args.requests = 200
+        return run(args)
+    if args.command == 'replay':
+        return replay(args)
+    return compare(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
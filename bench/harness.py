@@ -0,0 +1,323 @@
+# Harness - Arranca el gateway contra los stubs, genera carga y mide latencia, TTFT y recursos
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_API_KEY = 'bench-key'
+
+# Cómo se lanza cada variante del gateway; {port} y {workers} se sustituyen
+TARGETS = {
+    'run': [sys.executable, 'run.py'],
+    'main': [sys.executable, '-m', 'app.main'],
+    'asgi': [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', '{port}',
+             '--workers', '{workers}', '--log-level', 'warning'],
+    'gunicorn': ['gunicorn', '-w', '{workers}', '-k', 'gevent', '-b', '127.0.0.1:{port}', 'app.main:app'],
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentiles(values, points=(50, 95, 99)):
+    """Resumen por rango más cercano; None si no hay muestras"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    summary = {f"p{p}": ordered[max(0, -(-p * len(ordered) // 100) - 1)] for p in points}
+    summary["mean"] = sum(ordered) / len(ordered)
+    summary["min"] = ordered[0]
+    summary["max"] = ordered[-1]
+    return {name: round(value, 6) for name, value in summary.items()}
+
+
+class ProcessSampler:
+    """CPU y memoria de un proceso y sus hijos (workers) leyendo /proc"""
+
+    def __init__(self, pid, interval=0.2):
+        self.pid = pid
+        self.interval = interval
+        self.clock_ticks = os.sysconf('SC_CLK_TCK')
+        self.page_size = os.sysconf('SC_PAGE_SIZE')
+        self.rss_peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _tree(self):
+        children = {}
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+            except OSError:
+                continue
+            children.setdefault(int(fields[1]), []).append(int(entry))
+        pids, pending = [], [self.pid]
+        while pending:
+            pid = pending.pop()
+            pids.append(pid)
+            pending.extend(children.get(pid, []))
+        return pids
+
+    def sample(self):
+        """(segundos de CPU, RSS en bytes) sumados sobre el árbol de procesos"""
+        cpu, rss = 0.0, 0
+        for pid in self._tree():
+            try:
+                with open(f'/proc/{pid}/stat') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+                with open(f'/proc/{pid}/statm') as f:
+                    resident = int(f.read().split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            # utime y stime (campos 14 y 15 de stat)
+            cpu += (int(fields[11]) + int(fields[12])) / self.clock_ticks
+            rss += resident * self.page_size
+        return cpu, rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.rss_peak = max(self.rss_peak, self.sample()[1])
+
+    def start(self):
+        self.rss_peak = self.sample()[1]
+        self._thread = threading.Thread(target=self._run, name="bench-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+
+class Gateway:
+    """Proceso del gateway configurado para hablar solo con los stubs"""
+
+    def __init__(self, target, ollama_url, deepseek_url, workers=1, env=None, log_path=None):
+        if target not in TARGETS:
+            raise ValueError(f"Unknown target '{target}' (expected one of {', '.join(TARGETS)})")
+        self.target = target
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.workers = workers
+        self._tmpdir = tempfile.mkdtemp(prefix='bench-gateway-')
+        self.log_path = log_path or os.path.join(self._tmpdir, 'gateway.log')
+        self.env = {
+            **os.environ,
+            'HOST': '127.0.0.1',
+            'PORT': str(self.port),
+            'OLLAMA_URL': ollama_url,
+            'OLLAMA_NODES': '',
+            'OLLAMA_NODES_FILE': '',
+            'DEEPSEEK_URL': deepseek_url,
+            'DEEPSEEK_API_KEY': 'bench',
+            'API_KEYS': BENCH_API_KEY,
+            'ADMIN_API_KEY': BENCH_API_KEY,
+            'API_KEYS_FILE': os.path.join(self._tmpdir, 'api_keys.json'),
+            'USAGE_DB': os.path.join(self._tmpdir, 'usage.db'),
+            'METRICS_DIR': os.path.join(self._tmpdir, 'metrics') if workers > 1 else '',
+            'RATE_LIMIT_REQUESTS': str(10 ** 9),
+            'RATE_LIMIT_REDIS_URL': '',
+            'CACHE_REDIS_URL': '',
+            'LOG_LEVEL': 'WARNING',
+            'DEBUG': 'False',
+            'PYTHONUNBUFFERED': '1',
+            **(env or {})
+        }
+        self.process = None
+        self._log = None
+
+    def command(self):
+        return [part.format(port=self.port, workers=self.workers) for part in TARGETS[self.target]]
+
+    def start(self, timeout=30):
+        command = self.command()
+        if shutil.which(command[0]) is None and not os.path.exists(command[0]):
+            raise RuntimeError(f"'{command[0]}' is not installed")
+        self._log = open(self.log_path, 'wb')
+        self.process = subprocess.Popen(command, cwd=ROOT, env=self.env, stdout=self._log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Gateway exited with code {self.process.returncode}:\n{self.log_tail()}")
+            try:
+                if requests.get(f"{self.url}/health", timeout=1).status_code == 200:
+                    return self
+            except requests.RequestException:
+                pass
+            time.sleep(0.1)
+        self.stop()
+        raise RuntimeError(f"Gateway did not become healthy in {timeout}s:\n{self.log_tail()}")
+
+    def log_tail(self, lines=20):
+        try:
+            with open(self.log_path, 'rb') as f:
+                return b''.join(f.readlines()[-lines:]).decode('utf-8', 'replace')
+        except OSError:
+            return ''
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self._log:
+            self._log.close()
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+
+class LoadResult:
+    def __init__(self, status, latency, ttft=None, error=None):
+        self.status = status
+        self.latency = latency
+        self.ttft = ttft
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.status == 200 and self.error is None
+
+
+def build_payload(model, stream, max_tokens, unique=True):
+    # Prompt distinto por petición para no medir la caché ni la coalescencia
+    content = f"benchmark request {uuid.uuid4().hex}" if unique else "benchmark request"
+    return {
+        "model": model,
+        "messages": [{"role": "user", "content": content}],
+        "stream": stream,
+        "max_tokens": max_tokens,
+        "temperature": 0.7 if unique else 0
+    }
+
+
+def send(session, url, payload, api_key=BENCH_API_KEY, timeout=120):
+    """Una petición; en streaming el TTFT es la llegada del primer evento con datos"""
+    headers = {"Authorization": f"Bearer {api_key}"}
+    started = time.perf_counter()
+    try:
+        response = session.post(url, json=payload, headers=headers, stream=payload.get("stream", False), timeout=timeout)
+        with response:
+            if not payload.get("stream"):
+                response.content
+                return LoadResult(response.status_code, time.perf_counter() - started)
+            ttft = None
+            done = False
+            for line in response.iter_lines():
+                if not line.startswith(b'data:'):
+                    continue
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+                if line[5:].strip() == b'[DONE]':
+                    done = True
+            error = None if done or response.status_code != 200 else "stream ended without [DONE]"
+            return LoadResult(response.status_code, time.perf_counter() - started, ttft, error)
+    except requests.RequestException as e:
+        return LoadResult(None, time.perf_counter() - started, error=type(e).__name__)
+
+
+def run_load(url, payload_factory, concurrency, total=None, duration=None, api_key=BENCH_API_KEY, timeout=120):
+    """Lanza peticiones con `concurrency` clientes hasta `total` o `duration` segundos
+
+    Devuelve (resultados, segundos de reloj). Cada cliente reutiliza su sesión
+    HTTP, como haría un SDK de OpenAI.
+    """
+    if total is None and duration is None:
+        raise ValueError("total or duration is required")
+    lock = threading.Lock()
+    results = []
+    issued = [0]
+    deadline = time.perf_counter() + duration if duration else None
+
+    def next_slot():
+        with lock:
+            if total is not None and issued[0] >= total:
+                return False
+            if deadline is not None and time.perf_counter() >= deadline:
+                return False
+            issued[0] += 1
+            return True
+
+    def client():
+        with requests.Session() as session:
+            while next_slot():
+                result = send(session, url, payload_factory(), api_key=api_key, timeout=timeout)
+                with lock:
+                    results.append(result)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, name=f"bench-client-{i}", daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def summarize(results, elapsed, expected_upstream=None):
+    """Métricas agregadas de una ejecución (segundos)"""
+    ok = [r for r in results if r.ok]
+    statuses = {}
+    for r in results:
+        if r.status is None:
+            key = r.error
+        elif r.status == 200 and r.error:
+            key = 'stream_error'
+        else:
+            key = str(r.status)
+        statuses[key] = statuses.get(key, 0) + 1
+    latency = percentiles([r.latency for r in ok])
+    summary = {
+        "requests": len(results),
+        "succeeded": len(ok),
+        "failed": len(results) - len(ok),
+        "error_rate": round((len(results) - len(ok)) / len(results), 6) if results else 0,
+        "status_codes": statuses,
+        "duration_seconds": round(elapsed, 6),
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed > 0 else 0,
+        "latency": latency,
+        "ttft": percentiles([r.ttft for r in ok if r.ttft is not None])
+    }
+    if expected_upstream is not None and latency:
+        # Lo que añade el gateway sobre una llamada directa al backend emulado
+        summary["upstream_expected_seconds"] = round(expected_upstream, 6)
+        summary["overhead_p50_seconds"] = round(latency["p50"] - expected_upstream, 6)
+    return summary
+
+
+def resource_usage(sampler, before, after, elapsed, requests_count):
+    cpu = after[0] - before[0]
+    return {
+        "rss_idle_mb": round(before[1] / 2 ** 20, 2),
+        "rss_end_mb": round(after[1] / 2 ** 20, 2),
+        "rss_peak_mb": round(max(sampler.rss_peak, after[1]) / 2 ** 20, 2),
+        "cpu_seconds": round(cpu, 3),
+        "cpu_percent": round(100 * cpu / elapsed, 1) if elapsed > 0 else 0,
+        "cpu_ms_per_request": round(1000 * cpu / requests_count, 3) if requests_count else None
+    }
+
+
+def git_revision():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                  text=True, timeout=5).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                               capture_output=True, text=True, timeout=5).stdout.strip()
+        return f"{revision}-dirty" if revision and dirty else revision or None
+    except (OSError, subprocess.SubprocessError):
+        return None
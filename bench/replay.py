@@ -0,0 +1,106 @@
+# Replay - Reproduce un journal de peticiones contra el gateway con su ritmo original o escalado
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench.harness import BENCH_API_KEY, send
+
+
+def load_trace(paths, limit=None):
+    """Entradas POST de ficheros JSONL o directorios del journal, ordenadas por ts"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, 'requests-*.jsonl'))))
+        else:
+            files.append(path)
+    entries = []
+    for name in files:
+        with open(name) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Última línea a medias si el proceso murió escribiendo
+                    continue
+                if isinstance(entry, dict) and entry.get('method') == 'POST' and entry.get('path') and 'ts' in entry:
+                    entries.append(entry)
+    entries.sort(key=lambda entry: entry['ts'])
+    return entries[:limit] if limit else entries
+
+
+def _filler(tokens):
+    # Texto distinto en cada petición (sin caché ni coalescencia) de unos `tokens` tokens
+    return f"replay {uuid.uuid4().hex} " + ' '.join(['palabra'] * max(1, int(tokens)))
+
+
+def build_request(entry):
+    """(ruta, cuerpo): el cuerpo guardado o uno sintético del mismo tamaño que el original
+
+    Sin cuerpo se reparte prompt_tokens entre las generaciones y la respuesta se
+    limita a los completion_tokens observados (o al max_tokens pedido).
+    """
+    path = entry['path']
+    if entry.get('body') is not None:
+        return path, entry['body']
+    model = entry.get('model') or 'qwen2.5:7b'
+    generations = max(1, entry.get('generations') or 1)
+    prompt_tokens = (entry.get('prompt_tokens') or 16) // generations
+
+    if path.endswith('/embeddings'):
+        count = max(1, entry.get('inputs') or 1)
+        return path, {"model": model, "input": [_filler(prompt_tokens // count) for _ in range(count)]}
+
+    completion = (entry.get('completion_tokens') or 0) // generations
+    body = {"model": model, "max_tokens": completion or entry.get('max_tokens') or 256}
+    if entry.get('temperature') is not None:
+        body["temperature"] = entry['temperature']
+    if path.endswith('/batch'):
+        items = max(1, entry.get('items') or 1)
+        body["requests"] = [{"messages": [{"role": "user", "content": _filler(prompt_tokens)}]} for _ in range(items)]
+        return path, body
+    body["messages"] = [{"role": "user", "content": _filler(prompt_tokens)}]
+    body["stream"] = bool(entry.get('stream'))
+    if entry.get('n'):
+        body["n"] = entry['n']
+    return path, body
+
+
+def replay(base_url, entries, speed=1.0, api_key=BENCH_API_KEY, batch_api_key=None, timeout=120, max_in_flight=256):
+    """Lanza cada entrada en su instante original dividido por `speed` (0 = sin esperas)
+
+    Carga en bucle abierto: una petición lenta no retrasa las siguientes, como en
+    producción. Devuelve (resultados, segundos de reloj, mayor retraso del
+    planificador); un retraso alto significa que faltan hilos (max_in_flight).
+    """
+    local = threading.local()
+    lock = threading.Lock()
+    results = []
+
+    def fire(entry, due):
+        lag[0] = max(lag[0], time.perf_counter() - due)
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        path, body = build_request(entry)
+        key = batch_api_key if batch_api_key and entry.get('priority') == 'batch' else api_key
+        result = send(local.session, f"{base_url.rstrip('/')}{path}", body, api_key=key, timeout=timeout)
+        with lock:
+            results.append(result)
+
+    origin = entries[0]['ts'] if entries else 0
+    lag = [0.0]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='replay') as pool:
+        for entry in entries:
+            due = started + (entry['ts'] - origin) / speed if speed > 0 else time.perf_counter()
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(fire, entry, due)
+    return results, time.perf_counter() - started, lag[0]
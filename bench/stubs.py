@@ -0,0 +1,358 @@
+# Stubs - Servidores falsos de Ollama y DeepSeek con latencia, velocidad y errores configurables
+import json
+import math
+import random
+import select
+import socket
+import zlib
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubProfile:
+    """Comportamiento del backend emulado
+
+    latency: segundos hasta el primer token (cola + prefill)
+    tokens: tokens generados por respuesta (se recorta a max_tokens/num_predict)
+    token_rate: tokens por segundo en la fase de generación (0 = instantáneo)
+    error_rate: fracción de peticiones que responden 500
+    context_length: contexto máximo que informa /api/show
+    loaded: modelos en memoria al arrancar (None = todos); el resto se carga al usarlo
+    load_latency: segundos que cuesta cargar un modelo que no está en memoria
+    """
+
+    def __init__(self, latency=0.05, tokens=32, token_rate=200.0, error_rate=0.0, models=('qwen2.5:7b',),
+                 context_length=32768, loaded=None, load_latency=0.0):
+        self.latency = latency
+        self.tokens = tokens
+        self.token_rate = token_rate
+        self.error_rate = error_rate
+        self.models = list(models)
+        self.context_length = context_length
+        self.loaded = list(models if loaded is None else loaded)
+        self.load_latency = load_latency
+
+    def completion_tokens(self, limit=None):
+        if limit:
+            return max(1, min(self.tokens, int(limit)))
+        return self.tokens
+
+    def expected_seconds(self):
+        """Duración de una respuesta completa sin pasar por el gateway"""
+        decode = self.tokens / self.token_rate if self.token_rate > 0 else 0
+        return self.latency + decode
+
+    def as_dict(self):
+        return {
+            "latency": self.latency,
+            "tokens": self.tokens,
+            "token_rate": self.token_rate,
+            "error_rate": self.error_rate,
+            "models": self.models,
+            "context_length": self.context_length,
+            "loaded": self.loaded,
+            "load_latency": self.load_latency
+        }
+
+
+def _prompt_tokens(messages):
+    # Aproximación suficiente para el stub: una palabra, un token
+    return sum(len(str(m.get('content', '')).split()) for m in messages or [])
+
+
+def stub_embedding(text, dimensions=64):
+    """Vector determinista por bolsa de palabras: textos con palabras en común se parecen"""
+    vector = [0.0] * dimensions
+    for word in text.lower().split():
+        vector[zlib.crc32(word.encode('utf-8')) % dimensions] += 1.0
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'bench-stub'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def profile(self):
+        return self.server.profile
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        try:
+            return json.loads(body or b'{}')
+        except ValueError:
+            return {}
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _token_delay(self):
+        if self.profile.token_rate > 0:
+            time.sleep(1 / self.profile.token_rate)
+
+    def _client_gone(self):
+        # Como Ollama: la generación se interrumpe si el cliente cierra la conexión
+        try:
+            readable, _, _ = select.select([self.connection], [], [], 0)
+            return bool(readable) and self.connection.recv(1, socket.MSG_PEEK) == b''
+        except OSError:
+            return True
+
+    def _generate(self, count, emit=None):
+        """Genera `count` tokens al ritmo del perfil; False si el cliente se fue a mitad"""
+        for _ in range(count):
+            self._token_delay()
+            if self._client_gone():
+                self.server.count('aborted')
+                return False
+            self.server.count('tokens')
+            if emit:
+                try:
+                    emit()
+                except (BrokenPipeError, ConnectionResetError):
+                    self.server.count('aborted')
+                    return False
+        return True
+
+    def _begin_generation(self):
+        """Cuenta la petición, aplica la latencia y decide si se inyecta un error"""
+        self.server.count('requests')
+        time.sleep(self.profile.latency)
+        if random.random() < self.profile.error_rate:
+            self.server.count('errors')
+            self._send_json(500, {"error": "injected failure"})
+            return False
+        return True
+
+    def do_GET(self):
+        self.server.count('gets')
+        if self.path == '/stats':
+            self._send_json(200, self.server.stats())
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        self._send_json(404, {"error": "not found"})
+
+
+class OllamaHandler(_StubHandler):
+    """/api/version, /api/tags, /api/ps, /api/show, /api/generate (solo carga), /api/chat (NDJSON en streaming) y /api/embed"""
+
+    def do_GET(self):
+        if self.path in ('/api/tags', '/api/ps'):
+            self.server.count('gets')
+            names = self.profile.models if self.path == '/api/tags' else self.server.loaded_models()
+            self._send_json(200, {"models": [{"name": name, "model": name} for name in names]})
+        elif self.path == '/api/version':
+            self.server.count('gets')
+            self._send_json(200, {"version": "stub"})
+        else:
+            super().do_GET()
+
+    def _load(self, model):
+        """Carga el modelo si no está en memoria (load_latency)"""
+        if self.server.load(model) and self.profile.load_latency > 0:
+            time.sleep(self.profile.load_latency)
+
+    def do_POST(self):
+        if self.path == '/api/embed':
+            return self._embed()
+        if self.path == '/api/show':
+            self._read_json()
+            return self._send_json(200, {"model_info": {"stub.context_length": self.profile.context_length}})
+        if self.path == '/api/generate':
+            data = self._read_json()
+            self._load(data.get('model', ''))
+            return self._send_json(200, {"model": data.get('model', ''), "response": "", "done": True, "done_reason": "load"})
+        if self.path != '/api/chat':
+            return super().do_POST()
+        data = self._read_json()
+        if not self._begin_generation():
+            return
+        model = data.get('model', '')
+        self._load(model)
+        prompt_tokens = _prompt_tokens(data.get('messages'))
+        count = self.profile.completion_tokens((data.get('options') or {}).get('num_predict'))
+        started = time.monotonic()
+
+        if not data.get('stream', True):
+            if self._generate(count):
+                self._send_json(200, self._final(model, prompt_tokens, count, started, content=' '.join(['tok'] * count)))
+            return
+
+        self._start_chunked('application/x-ndjson')
+        chunk = json.dumps({"model": model, "message": {"role": "assistant", "content": "tok "}, "done": False}).encode()
+        if not self._generate(count, lambda: self._write_chunk(chunk + b"\n")):
+            return
+        self._write_chunk(json.dumps(self._final(model, prompt_tokens, count, started)).encode() + b"\n")
+        self._end_chunked()
+
+    def _embed(self):
+        """Un lote de textos por llamada; la latencia se paga una vez por lote"""
+        data = self._read_json()
+        inputs = data.get('input', [])
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        self.server.count('embed_inputs', len(inputs))
+        if not self._begin_generation():
+            return
+        self._load(data.get('model', ''))
+        dimensions = data.get('dimensions') or 64
+        self._send_json(200, {
+            "model": data.get('model', ''),
+            "embeddings": [stub_embedding(text, dimensions) for text in inputs],
+            "prompt_eval_count": sum(len(text.split()) for text in inputs)
+        })
+
+    def _final(self, model, prompt_tokens, count, started, content=''):
+        return {
+            "model": model,
+            "message": {"role": "assistant", "content": content},
+            "done": True,
+            "done_reason": "length" if count < self.profile.tokens else "stop",
+            "prompt_eval_count": prompt_tokens,
+            "eval_count": count,
+            "eval_duration": int((time.monotonic() - started) * 1e9)
+        }
+
+
+class DeepSeekHandler(_StubHandler):
+    """API de chat compatible con OpenAI (SSE en streaming) en cualquier ruta POST y GET /models"""
+
+    def do_GET(self):
+        if self.path.endswith('/models'):
+            self.server.count('gets')
+            self._send_json(200, {"object": "list", "data": [{"id": "deepseek-chat", "object": "model"}]})
+        else:
+            super().do_GET()
+
+    def do_POST(self):
+        data = self._read_json()
+        if not self._begin_generation():
+            return
+        model = data.get('model', 'deepseek-chat')
+        prompt_tokens = _prompt_tokens(data.get('messages'))
+        count = self.profile.completion_tokens(data.get('max_tokens'))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": count, "total_tokens": prompt_tokens + count}
+        finish_reason = "length" if count < self.profile.tokens else "stop"
+
+        if not data.get('stream'):
+            if not self._generate(count):
+                return
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": ' '.join(['tok'] * count)},
+                    "finish_reason": finish_reason
+                }],
+                "usage": usage
+            })
+            return
+
+        def event(choices, **extra):
+            payload = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                       "model": model, "choices": choices, **extra}
+            return f"data: {json.dumps(payload)}\n\n".encode()
+
+        self._start_chunked('text/event-stream')
+        token = event([{"index": 0, "delta": {"content": "tok "}, "finish_reason": None}])
+        if not self._generate(count, lambda: self._write_chunk(token)):
+            return
+        self._write_chunk(event([{"index": 0, "delta": {}, "finish_reason": finish_reason}]))
+        if (data.get('stream_options') or {}).get('include_usage'):
+            self._write_chunk(event([], usage=usage))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._end_chunked()
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, handler, profile, host='127.0.0.1', port=0):
+        super().__init__((host, port), handler)
+        self.profile = profile
+        self._lock = threading.Lock()
+        self._counters = {"requests": 0, "errors": 0, "gets": 0}
+        self._loaded = set(getattr(profile, 'loaded', ()) or ())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def handle_error(self, request, client_address):
+        # El pool del gateway cierra conexiones keep-alive ociosas: no es un fallo del stub
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def load(self, model):
+        """Marca el modelo como cargado; True si no lo estaba (cuenta una carga)"""
+        with self._lock:
+            if model in self._loaded:
+                return False
+            self._loaded.add(model)
+            self._counters["loads"] = self._counters.get("loads", 0) + 1
+            return True
+
+    def loaded_models(self):
+        with self._lock:
+            return sorted(self._loaded)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="bench-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def start_ollama_stub(profile=None, port=0):
+    return StubServer(OllamaHandler, profile or StubProfile(), port=port).start()
+
+
+def start_deepseek_stub(profile=None, port=0):
+    return StubServer(DeepSeekHandler, profile or StubProfile(models=('deepseek-chat',)), port=port).start()
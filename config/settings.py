@@ -4,15 +4,120 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+def _parse_mapping(value):
+    """Convierte 'a=b,c=d' en {'a': 'b', 'c': 'd'}"""
+    mapping = {}
+    for item in value.split(','):
+        if '=' in item:
+            key, target = item.split('=', 1)
+            mapping[key.strip()] = target.strip()
+    return mapping
+
 def load_config():
     return {
         'HOST': os.getenv('HOST', '0.0.0.0'),
         'PORT': int(os.getenv('PORT', 8080)),
         'DEBUG': os.getenv('DEBUG', 'False').lower() == 'true',
         'OLLAMA_URL': os.getenv('OLLAMA_URL', 'http://localhost:11434'),
+        'OLLAMA_NODES': os.getenv('OLLAMA_NODES', ''),
+        'OLLAMA_NODES_FILE': os.getenv('OLLAMA_NODES_FILE', ''),
+        'OLLAMA_AFFINITY': os.getenv('OLLAMA_AFFINITY', 'True').lower() == 'true',
+        'OLLAMA_AFFINITY_TTL': float(os.getenv('OLLAMA_AFFINITY_TTL', 600)),
+        'OLLAMA_AFFINITY_SLACK': int(os.getenv('OLLAMA_AFFINITY_SLACK', 2)),
+        'OLLAMA_MODELS_TTL': int(os.getenv('OLLAMA_MODELS_TTL', 30)),
+        'OLLAMA_RESIDENCY': os.getenv('OLLAMA_RESIDENCY', 'True').lower() == 'true',
+        'OLLAMA_PRELOAD_MODELS': os.getenv('OLLAMA_PRELOAD_MODELS', ''),
+        'OLLAMA_KEEP_ALIVE': _parse_mapping(os.getenv('OLLAMA_KEEP_ALIVE', '')),
+        'OLLAMA_KEEP_ALIVE_DEFAULT': os.getenv('OLLAMA_KEEP_ALIVE_DEFAULT', ''),
+        'MODEL_EQUIVALENTS': _parse_mapping(os.getenv('MODEL_EQUIVALENTS', '')),
+        'OLLAMA_COLD_POLICY': os.getenv('OLLAMA_COLD_POLICY', 'load'),
+        'OLLAMA_COLD_PENALTY': int(os.getenv('OLLAMA_COLD_PENALTY', 2)),
+        'OLLAMA_PS_INTERVAL': float(os.getenv('OLLAMA_PS_INTERVAL', 5)),
+        'OLLAMA_WARM_INTERVAL': float(os.getenv('OLLAMA_WARM_INTERVAL', 60)),
+        'MODEL_ALIASES': _parse_mapping(os.getenv('MODEL_ALIASES', '')),
         'DEEPSEEK_URL': os.getenv('DEEPSEEK_URL', 'https://api.deepseek.com/chat/completions'),
         'DEEPSEEK_API_KEY': os.getenv('DEEPSEEK_API_KEY', ''),
+        'OLLAMA_POOL_SIZE': int(os.getenv('OLLAMA_POOL_SIZE', 16)),
+        'DEEPSEEK_POOL_SIZE': int(os.getenv('DEEPSEEK_POOL_SIZE', 32)),
+        'UPSTREAM_CONNECT_TIMEOUT': float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', 5)),
+        'UPSTREAM_READ_TIMEOUT': float(os.getenv('UPSTREAM_READ_TIMEOUT', 120)),
+        'REQUEST_DEADLINE_BASE': float(os.getenv('REQUEST_DEADLINE_BASE', 30)),
+        'REQUEST_DEADLINE_TOKENS_PER_SECOND': float(os.getenv('REQUEST_DEADLINE_TOKENS_PER_SECOND', 5)),
+        'REQUEST_DEADLINE_MAX': float(os.getenv('REQUEST_DEADLINE_MAX', 600)),
+        'CANCEL_ON_DISCONNECT': os.getenv('CANCEL_ON_DISCONNECT', 'True').lower() == 'true',
+        'DISCONNECT_CHECK_INTERVAL': float(os.getenv('DISCONNECT_CHECK_INTERVAL', 0.25)),
+        'CACHE_ENABLED': os.getenv('CACHE_ENABLED', 'True').lower() == 'true',
+        'CACHE_MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 1000)),
+        'CACHE_TTL': int(os.getenv('CACHE_TTL', 3600)),
+        'CACHE_REDIS_URL': os.getenv('CACHE_REDIS_URL', ''),
+        'API_KEYS_FILE': os.getenv('API_KEYS_FILE', '/root/ai-gateway/api_keys.json'),
+        'KEYS_FLUSH_INTERVAL': float(os.getenv('KEYS_FLUSH_INTERVAL', 5)),
+        'USAGE_DB': os.getenv('USAGE_DB', '/root/ai-gateway/usage.db'),
+        'USAGE_FLUSH_INTERVAL': float(os.getenv('USAGE_FLUSH_INTERVAL', 10)),
+        'ROUTING_POLICY': os.getenv('ROUTING_POLICY', 'cost'),
+        'ROUTING_COMPLEXITY_THRESHOLD': int(os.getenv('ROUTING_COMPLEXITY_THRESHOLD', 500)),
+        'ROUTING_MAX_COST': float(os.getenv('ROUTING_MAX_COST', 0.002)),
+        'ROUTING_OUTPUT_RATIO': float(os.getenv('ROUTING_OUTPUT_RATIO', 0.25)),
+        'OLLAMA_OVERHEAD_SECONDS': float(os.getenv('OLLAMA_OVERHEAD_SECONDS', 0.2)),
+        'OLLAMA_PREFILL_TPS': float(os.getenv('OLLAMA_PREFILL_TPS', 800)),
+        'OLLAMA_DECODE_TPS': float(os.getenv('OLLAMA_DECODE_TPS', 40)),
+        'DEEPSEEK_OVERHEAD_SECONDS': float(os.getenv('DEEPSEEK_OVERHEAD_SECONDS', 1.0)),
+        'DEEPSEEK_PREFILL_TPS': float(os.getenv('DEEPSEEK_PREFILL_TPS', 2000)),
+        'DEEPSEEK_DECODE_TPS': float(os.getenv('DEEPSEEK_DECODE_TPS', 30)),
+        'DEEPSEEK_INPUT_COST': float(os.getenv('DEEPSEEK_INPUT_COST', 0.27)),
+        'DEEPSEEK_OUTPUT_COST': float(os.getenv('DEEPSEEK_OUTPUT_COST', 1.10)),
+        'OLLAMA_CONCURRENCY': int(os.getenv('OLLAMA_CONCURRENCY', 4)),
+        'DEEPSEEK_CONCURRENCY': int(os.getenv('DEEPSEEK_CONCURRENCY', 64)),
+        'ADMISSION_ENABLED': os.getenv('ADMISSION_ENABLED', 'True').lower() == 'true',
+        'ADMISSION_CONCURRENCY': int(os.getenv('ADMISSION_CONCURRENCY', 0)),
+        'ADMISSION_QUEUE_SIZE': int(os.getenv('ADMISSION_QUEUE_SIZE', 32)),
+        'ADMISSION_TIMEOUT_INTERACTIVE': float(os.getenv('ADMISSION_TIMEOUT_INTERACTIVE', 5)),
+        'ADMISSION_TIMEOUT_BATCH': float(os.getenv('ADMISSION_TIMEOUT_BATCH', 60)),
+        'ADMISSION_DEFAULT_PRIORITY': os.getenv('ADMISSION_DEFAULT_PRIORITY', 'interactive'),
+        'CIRCUIT_ERROR_THRESHOLD': float(os.getenv('CIRCUIT_ERROR_THRESHOLD', 0.5)),
+        'CIRCUIT_MIN_SAMPLES': int(os.getenv('CIRCUIT_MIN_SAMPLES', 5)),
+        'CIRCUIT_CONSECUTIVE_FAILURES': int(os.getenv('CIRCUIT_CONSECUTIVE_FAILURES', 3)),
+        'CIRCUIT_OPEN_SECONDS': float(os.getenv('CIRCUIT_OPEN_SECONDS', 30)),
+        'HEALTH_PROBE_ENABLED': os.getenv('HEALTH_PROBE_ENABLED', 'True').lower() == 'true',
+        'HEALTH_PROBE_INTERVAL': float(os.getenv('HEALTH_PROBE_INTERVAL', 10)),
+        'HEALTH_PROBE_TIMEOUT': float(os.getenv('HEALTH_PROBE_TIMEOUT', 2)),
+        'HEALTH_PROBE_URLS': os.getenv('HEALTH_PROBE_URLS', ''),
+        'COALESCE_ENABLED': os.getenv('COALESCE_ENABLED', 'True').lower() == 'true',
+        'HEDGE_ENABLED': os.getenv('HEDGE_ENABLED', 'False').lower() == 'true',
+        'HEDGE_DELAY': float(os.getenv('HEDGE_DELAY', 2.0)),
+        'HEDGE_PERCENTILE': float(os.getenv('HEDGE_PERCENTILE', 0)),
+        'HEDGE_MIN_SAMPLES': int(os.getenv('HEDGE_MIN_SAMPLES', 20)),
+        'BATCH_MAX_ITEMS': int(os.getenv('BATCH_MAX_ITEMS', 100)),
+        'EMBEDDING_MODEL': os.getenv('EMBEDDING_MODEL', 'nomic-embed-text'),
+        'EMBEDDING_BATCH_SIZE': int(os.getenv('EMBEDDING_BATCH_SIZE', 32)),
+        'EMBEDDING_BATCH_WAIT_MS': float(os.getenv('EMBEDDING_BATCH_WAIT_MS', 5)),
+        'EMBEDDING_MAX_INPUTS': int(os.getenv('EMBEDDING_MAX_INPUTS', 256)),
+        'SEMANTIC_CACHE_ENABLED': os.getenv('SEMANTIC_CACHE_ENABLED', 'False').lower() == 'true',
+        'SEMANTIC_CACHE_MODEL': os.getenv('SEMANTIC_CACHE_MODEL', ''),
+        'SEMANTIC_CACHE_THRESHOLD': float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.92)),
+        'SEMANTIC_CACHE_MAX_ENTRIES': int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', 1000)),
+        'SEMANTIC_CACHE_MAX_SCOPE_ENTRIES': int(os.getenv('SEMANTIC_CACHE_MAX_SCOPE_ENTRIES', 256)),
+        'SEMANTIC_CACHE_TTL': int(os.getenv('SEMANTIC_CACHE_TTL', 3600)),
+        'CONTEXT_COMPACTION': os.getenv('CONTEXT_COMPACTION', 'True').lower() == 'true',
+        'MODEL_CONTEXT_SIZES': _parse_mapping(os.getenv('MODEL_CONTEXT_SIZES', '')),
+        'CONTEXT_DEFAULT_TOKENS': int(os.getenv('CONTEXT_DEFAULT_TOKENS', 4096)),
+        'CONTEXT_MAX_TOKENS': int(os.getenv('CONTEXT_MAX_TOKENS', 8192)),
+        'CONTEXT_MIN_TOKENS': int(os.getenv('CONTEXT_MIN_TOKENS', 2048)),
+        'CONTEXT_STICKY_SECONDS': float(os.getenv('CONTEXT_STICKY_SECONDS', 300)),
+        'CONTEXT_SUMMARY_ENABLED': os.getenv('CONTEXT_SUMMARY_ENABLED', 'False').lower() == 'true',
+        'CONTEXT_SUMMARY_MODEL': os.getenv('CONTEXT_SUMMARY_MODEL', ''),
+        'CONTEXT_SUMMARY_TOKENS': int(os.getenv('CONTEXT_SUMMARY_TOKENS', 256)),
         'RATE_LIMIT_REQUESTS': int(os.getenv('RATE_LIMIT_REQUESTS', 100)),
         'RATE_LIMIT_WINDOW': int(os.getenv('RATE_LIMIT_WINDOW', 60)),
+        'RATE_LIMIT_REDIS_URL': os.getenv('RATE_LIMIT_REDIS_URL', ''),
+        'JOURNAL_ENABLED': os.getenv('JOURNAL_ENABLED', 'False').lower() == 'true',
+        'JOURNAL_DIR': os.getenv('JOURNAL_DIR', '/root/ai-gateway/journal'),
+        'JOURNAL_INCLUDE_BODIES': os.getenv('JOURNAL_INCLUDE_BODIES', 'False').lower() == 'true',
+        'JOURNAL_MAX_MB': float(os.getenv('JOURNAL_MAX_MB', 64)),
+        'JOURNAL_MAX_FILES': int(os.getenv('JOURNAL_MAX_FILES', 20)),
+        'JOURNAL_FLUSH_INTERVAL': float(os.getenv('JOURNAL_FLUSH_INTERVAL', 1)),
+        'JOURNAL_QUEUE_SIZE': int(os.getenv('JOURNAL_QUEUE_SIZE', 10000)),
+        'METRICS_DIR': os.getenv('METRICS_DIR', ''),
+        'METRICS_FLUSH_INTERVAL': float(os.getenv('METRICS_FLUSH_INTERVAL', 5)),
         'LOG_LEVEL': os.getenv('LOG_LEVEL', 'INFO'),
     }
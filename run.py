@@ -4,23 +4,61 @@ Unified AI API Gateway
 Compatible con OpenAI API - Puede usar modelos locales o remotos
 """
 
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, g
 from flask_cors import CORS
+import time
+from functools import partial
 from api.routes.chat import chat_bp
+from api.routes.embeddings import embeddings_bp
 from api.routes.models import models_bp
 from api.routes.health import health_bp
+from api.routes.metrics import metrics_bp
+from api.services.metrics import observe_http
+from api.services.journal import get_request_journal
+from api.services.usage import current_api_key
+from api.services.admission import current_priority
+from api.services.codec import FastJSONProvider
+from api.services.health_prober import start_health_prober
 from config.settings import load_config
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 CORS(app)
 
 # Cargar configuración
 config = load_config()
+journal = get_request_journal()
 
 # Registrar blueprints
 app.register_blueprint(health_bp, url_prefix='/health')
 app.register_blueprint(models_bp, url_prefix='/v1')
 app.register_blueprint(chat_bp, url_prefix='/v1/chat')
+app.register_blueprint(embeddings_bp, url_prefix='/v1')
+app.register_blueprint(metrics_bp, url_prefix='/metrics')
+
+# Sondas de dependencias en segundo plano (/health sirve su último resultado)
+start_health_prober()
+
+@app.before_request
+def start_timer():
+    g.started = time.monotonic()
+    if journal:
+        g.trace = journal.begin(request.method, request.path, request.get_data)
+
+@app.after_request
+def record_request(response):
+    # Ruta de Flask (no la URL) para no disparar la cardinalidad; en streams mide hasta las cabeceras
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    observe_http(request.method, route, response.status_code, time.monotonic() - g.get('started', time.monotonic()))
+    if g.get('trace'):
+        finish = partial(journal.finish, g.trace, response.status_code, current_api_key.get(),
+                         current_priority.get(), response.headers.get('X-Cache'))
+        # Un stream se registra al terminar de enviarse (tokens y latencia completos)
+        if response.is_streamed:
+            response.call_on_close(finish)
+        else:
+            finish()
+    return response
 
 @app.errorhandler(404)
 def not_found(e):
@@ -0,0 +1,7 @@
+# Los tests no escriben en las rutas de producción (/root/ai-gateway)
+import os
+import tempfile
+
+os.environ.setdefault('USAGE_DB', os.path.join(tempfile.mkdtemp(prefix='uaa-tests-'), 'usage.db'))
+# Sin sondas en segundo plano: abrirían los circuitos de los backends que no existen aquí
+os.environ.setdefault('HEALTH_PROBE_ENABLED', 'false')
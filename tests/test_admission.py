@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Tests for the Ollama admission queue
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from api.services.admission import AdmissionQueue, AdmissionTimeout, priority_for
+from api.services.backend_health import BackendUnavailable
+
+
+def make_queue(concurrency=1, max_queue=8, interactive=1.0, batch=1.0):
+    return AdmissionQueue(concurrency, max_queue, {'interactive': interactive, 'batch': batch})
+
+
+def queued(queue, count):
+    deadline = time.monotonic() + 1
+    while sum(queue.stats()["queued"].values()) < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_concurrency_cap():
+    queue = make_queue(concurrency=2)
+    slots = [queue.acquire('interactive'), queue.acquire('interactive')]
+    assert queue.stats()["active"] == 2
+
+    admitted = threading.Event()
+    thread = threading.Thread(target=lambda: (queue.acquire('interactive'), admitted.set()))
+    thread.start()
+    queued(queue, 1)
+    assert not admitted.is_set()
+
+    queue.release(slots[0])
+    assert admitted.wait(1)
+    thread.join()
+    assert queue.stats()["active"] == 2
+
+
+def test_interactive_served_before_batch():
+    queue = make_queue()
+    slot = queue.acquire('interactive')
+    order = []
+
+    def worker(priority):
+        queue.acquire(priority)
+        order.append(priority)
+
+    batch = threading.Thread(target=worker, args=('batch',))
+    batch.start()
+    queued(queue, 1)
+    interactive = threading.Thread(target=worker, args=('interactive',))
+    interactive.start()
+    queued(queue, 2)
+
+    queue.release(slot)
+    interactive.join(1)
+    assert order == ['interactive']
+    queue.release(time.monotonic())
+    batch.join(1)
+    assert order == ['interactive', 'batch']
+
+
+def test_queue_wait_deadline_raises_timeout():
+    queue = make_queue(interactive=0.05)
+    queue.acquire('interactive')
+    with pytest.raises(AdmissionTimeout) as error:
+        queue.acquire('interactive')
+    assert error.value.priority == 'interactive'
+    stats = queue.stats()
+    assert stats["queued"] == {'interactive': 0, 'batch': 0}
+    assert stats["classes"]["interactive"]["timeouts"] == 1
+
+
+def test_full_queue_sheds_with_retry_after():
+    queue = make_queue(max_queue=1, interactive=0.3)
+    queue.acquire('interactive')
+    thread = threading.Thread(target=lambda: pytest.raises(AdmissionTimeout, queue.acquire, 'interactive'))
+    thread.start()
+    queued(queue, 1)
+    with pytest.raises(BackendUnavailable) as error:
+        queue.acquire('batch')
+    assert error.value.backend == 'ollama'
+    assert error.value.retry_after >= 1
+    assert queue.stats()["classes"]["batch"]["shed"] == 1
+    thread.join()
+
+
+def test_async_cancel_leaves_the_queue():
+    queue = make_queue()
+
+    async def main():
+        slot = await queue.acquire_async('interactive')
+        waiter = asyncio.ensure_future(queue.acquire_async('batch'))
+        await asyncio.sleep(0.01)
+        assert queue.stats()["queued"]["batch"] == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert queue.stats()["queued"]["batch"] == 0
+
+        follower = asyncio.ensure_future(queue.acquire_async('interactive'))
+        await asyncio.sleep(0.01)
+        queue.release(slot)
+        queue.release(await asyncio.wait_for(follower, 1))
+
+    asyncio.run(main())
+    assert queue.stats()["active"] == 0
+
+
+def test_priority_for_key_data():
+    assert priority_for({"priority": "batch"}) == 'batch'
+    assert priority_for({"priority": "urgent"}) == 'interactive'
+    assert priority_for(None, 'batch') == 'batch'
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Tests for the asyncio gateway (asgi.py + AsyncAIRouter) against the benchmark stubs
+"""
+
+import importlib
+import json
+import sys
+
+import pytest
+from starlette.testclient import TestClient
+
+from api.middleware import rate_limit
+from api.services import backend_health, http_client, key_store, model_registry, ollama_pool, residency
+from bench.stubs import StubProfile, start_deepseek_stub, start_ollama_stub
+
+API_KEY = 'asgi-key'
+LIMITED_KEY = 'asgi-limited-key'
+RATE_LIMIT = 20
+HEADERS = {"Authorization": f"Bearer {API_KEY}"}
+
+
+@pytest.fixture(scope="module")
+def gateway(tmp_path_factory):
+    ollama = start_ollama_stub(StubProfile(latency=0.01, tokens=8, token_rate=0,
+                                           models=('qwen2.5:7b', 'nomic-embed-text')))
+    deepseek = start_deepseek_stub(StubProfile(latency=0.01, tokens=8, token_rate=0, models=('deepseek-chat',)))
+    patch = pytest.MonkeyPatch()
+    env = {
+        'OLLAMA_URL': ollama.url,
+        'OLLAMA_NODES': '',
+        'OLLAMA_NODES_FILE': '',
+        'DEEPSEEK_URL': f"{deepseek.url}/chat/completions",
+        'DEEPSEEK_API_KEY': 'stub',
+        'API_KEYS': f"{API_KEY},{LIMITED_KEY}",
+        'API_KEYS_FILE': str(tmp_path_factory.mktemp('asgi') / 'api_keys.json'),
+        'RATE_LIMIT_REQUESTS': str(RATE_LIMIT),
+        'RATE_LIMIT_REDIS_URL': '',
+        'CACHE_ENABLED': 'false',
+        'CACHE_REDIS_URL': '',
+        'COALESCE_ENABLED': 'false',
+        'ROUTING_POLICY': 'local',
+    }
+    for name, value in env.items():
+        patch.setenv(name, value)
+    # asgi.py arma sus servicios al importarse: nada heredado de otros módulos de tests
+    for module, name in ((model_registry, '_registry'), (ollama_pool, '_pool'), (residency, '_residency'),
+                         (key_store, '_store'), (rate_limit, '_limiter')):
+        patch.setattr(module, name, None)
+    patch.setattr(backend_health, '_backends', {})
+    patch.setattr(http_client, '_clients', {})
+    patch.setattr(http_client, '_async_clients', {})
+    sys.modules.pop('asgi', None)
+    asgi = importlib.import_module('asgi')
+    try:
+        with TestClient(asgi.app) as client:
+            yield client, ollama, deepseek
+    finally:
+        sys.modules.pop('asgi', None)
+        patch.undo()
+        ollama.stop()
+        deepseek.stop()
+
+
+def chat(model, stream=False, max_tokens=4):
+    return {"model": model, "messages": [{"role": "user", "content": "hola"}], "max_tokens": max_tokens,
+            "temperature": 0.7, "stream": stream}
+
+
+def test_chat_completion_from_ollama(gateway):
+    client, ollama, _ = gateway
+    before = ollama.stats()["requests"]
+    response = client.post("/v1/chat/completions", headers=HEADERS, json=chat("qwen2.5:7b"))
+    assert response.status_code == 200
+    body = response.json()
+    assert body["object"] == "chat.completion"
+    assert body["usage"]["completion_tokens"] == 4
+    assert body["choices"][0]["finish_reason"] == "length"
+    assert ollama.stats()["requests"] == before + 1
+    assert response.headers["X-RateLimit-Limit"] == str(RATE_LIMIT)
+
+
+def test_chat_completion_stream(gateway):
+    client, _, _ = gateway
+    with client.stream("POST", "/v1/chat/completions", headers=HEADERS, json=chat("qwen2.5:7b", True, 8)) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = [line[6:] for line in response.iter_lines() if line.startswith("data: ")]
+    assert events[-1] == "[DONE]"
+    chunks = [json.loads(event) for event in events[:-1]]
+    content = "".join(c["choices"][0]["delta"].get("content", "") for c in chunks if c["choices"])
+    assert content.count("tok") == 8
+
+
+def test_deepseek_relay(gateway):
+    client, _, deepseek = gateway
+    before = deepseek.stats()["requests"]
+    response = client.post("/v1/chat/completions", headers=HEADERS, json=chat("deepseek-chat"))
+    assert response.status_code == 200
+    body = response.json()
+    assert body["id"].startswith("chatcmpl-") and body["usage"]["completion_tokens"] == 4
+
+    with client.stream("POST", "/v1/chat/completions", headers=HEADERS, json=chat("deepseek-chat", True)) as response:
+        events = [line for line in response.iter_lines() if line.startswith("data: ")]
+    assert events[-1] == "data: [DONE]"
+    assert deepseek.stats()["requests"] == before + 2
+
+
+def test_invalid_json_is_rejected(gateway):
+    client, _, _ = gateway
+    response = client.post("/v1/chat/completions", headers={**HEADERS, "Content-Type": "application/json"},
+                           content=b'{"model": ')
+    assert response.status_code == 400
+    assert response.json()["error"] == "No input data provided"
+
+    response = client.post("/v1/chat/completions", headers=HEADERS, json={"model": "qwen2.5:7b"})
+    assert response.status_code == 400
+
+
+def test_embeddings(gateway):
+    client, _, _ = gateway
+    response = client.post("/v1/embeddings", headers=HEADERS,
+                           json={"model": "text-embedding-3-small", "input": ["hola mundo", "adiós"]})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["model"] == "nomic-embed-text"
+    assert [item["index"] for item in body["data"]] == [0, 1]
+    assert body["usage"]["prompt_tokens"] == 3
+
+    response = client.post("/v1/embeddings", headers=HEADERS, json={"model": "nomic-embed-text"})
+    assert response.status_code == 400
+
+
+def test_missing_or_unknown_key_is_rejected(gateway):
+    client, ollama, _ = gateway
+    before = ollama.stats()["requests"]
+    assert client.post("/v1/chat/completions", json=chat("qwen2.5:7b")).status_code == 401
+    response = client.post("/v1/chat/completions", headers={"Authorization": "Bearer nope"}, json=chat("qwen2.5:7b"))
+    assert response.status_code == 401
+    assert client.post("/v1/embeddings", json={"input": "hola"}).status_code == 401
+    assert ollama.stats()["requests"] == before
+
+
+def test_rate_limit_rejects_over_the_limit(gateway):
+    client, _, _ = gateway
+    headers = {"Authorization": f"Bearer {LIMITED_KEY}", "Content-Type": "application/json"}
+    statuses = [client.post("/v1/chat/completions", headers=headers, content=b'{}').status_code
+                for _ in range(RATE_LIMIT)]
+    assert statuses == [400] * RATE_LIMIT
+
+    response = client.post("/v1/chat/completions", headers=headers, content=b'{}')
+    assert response.status_code == 429
+    assert response.headers["X-RateLimit-Remaining"] == "0"
+    assert int(response.headers["Retry-After"]) >= 1
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Tests for BackendHealth (circuit breaker)
+"""
+
+from api.services import backend_health
+from api.services.backend_health import BackendHealth, BackendNodes, CLOSED, OPEN, HALF_OPEN
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def fail(health, times=1):
+    for _ in range(times):
+        health.end(health.begin(), ok=False)
+
+
+def test_opens_after_consecutive_failures_and_recovers(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(backend_health.time, 'monotonic', clock)
+    health = BackendHealth('ollama', consecutive_failures=3, open_seconds=30)
+
+    fail(health, 2)
+    assert health.state == CLOSED and health.allow_request()
+    fail(health)
+    assert health.state == OPEN and not health.allow_request()
+    assert health.retry_after() == 31
+
+    clock.now += 30
+    assert health.allow_request() and health.state == HALF_OPEN
+    probe = health.begin()
+    # Solo una petición de prueba a la vez
+    assert not health.allow_request()
+    clock.now += 2
+    health.end(probe, ok=True)
+    assert health.state == CLOSED and health.latency == 2
+
+
+def test_failed_probe_reopens(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(backend_health.time, 'monotonic', clock)
+    health = BackendHealth('ollama', consecutive_failures=1, open_seconds=10)
+
+    fail(health)
+    clock.now += 10
+    assert health.allow_request()
+    fail(health)
+    assert health.state == OPEN and health.trips == 2
+
+
+def test_queue_delay_grows_with_in_flight():
+    health = BackendHealth('ollama', concurrency=2)
+    health.end(health.begin(), ok=True)
+    health.latency = 10.0
+    tokens = [health.begin() for _ in range(4)]
+    assert health.queue_delay() == 15.0
+    for token in tokens:
+        health.end(token, ok=True)
+    assert health.queue_delay() == 0.0
+
+
+def test_active_probes_open_and_recover_circuit(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(backend_health.time, 'monotonic', clock)
+    health = BackendHealth('deepseek', open_seconds=30)
+
+    health.probe(False)
+    assert health.state == OPEN and health.samples == 0
+    # Mientras las sondas fallen el circuito no se reintenta
+    clock.now += 20
+    health.probe(False)
+    clock.now += 20
+    assert not health.allow_request()
+    health.probe(True)
+    assert health.state == HALF_OPEN and health.allow_request()
+
+    # Un circuito abierto por peticiones reales espera su open_seconds aunque la sonda conteste
+    fail(health, 3)
+    health.probe(True)
+    assert health.state == OPEN
+
+
+def test_failing_node_opens_only_its_own_circuit(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(backend_health.time, 'monotonic', clock)
+    ollama = BackendNodes('ollama', concurrency=2, consecutive_failures=3, open_seconds=30)
+    healthy, failing = ollama.node("http://a"), ollama.node("http://b")
+    assert ollama.node("http://a") is healthy
+
+    # 5xx repetidos de un nodo: se abre su circuito, el backend sigue disponible
+    fail(failing, 3)
+    healthy.end(healthy.begin(), ok=True)
+    assert failing.state == OPEN and healthy.state == CLOSED
+    assert ollama.state == CLOSED and ollama.allow_request()
+
+    fail(healthy, 3)
+    assert ollama.state == OPEN and not ollama.allow_request()
+    assert ollama.retry_after() == 31
+    snapshot = ollama.snapshot()
+    assert snapshot["state"] == OPEN and snapshot["trips"] == 2 and set(snapshot["nodes"]) == {"http://a", "http://b"}
+
+    clock.now += 31
+    assert ollama.state == HALF_OPEN and ollama.allow_request()
+
+
+def test_nodes_queue_delay_uses_backend_concurrency(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(backend_health.time, 'monotonic', clock)
+    ollama = BackendNodes('ollama', concurrency=2)
+    assert ollama.queue_delay() == 0.0 and ollama.allow_request()
+    for url in ("http://a", "http://b"):
+        node = ollama.node(url)
+        token = node.begin()
+        clock.now += 1
+        node.end(token, ok=True)
+        node.begin()
+    # Dos en curso (uno por nodo) con concurrencia 2 y latencia 1 s
+    assert ollama.queue_delay() == 0.5
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Tests for the per-backend batch executor
+"""
+
+import threading
+import time
+
+import pytest
+
+from api.services.backend_health import BackendUnavailable
+from api.services.batch import BatchExecutor, merge_choices, parse_batch, parse_choices, replicate_choices
+from api.services.routing_policy import RoutingDecision
+
+
+class FakeRouter:
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.running = {"ollama": 0, "deepseek": 0}
+        self.peak = {"ollama": 0, "deepseek": 0}
+
+    def choose_backend(self, model, messages, max_tokens):
+        if model == "down":
+            raise BackendUnavailable("deepseek", 7)
+        backend = "deepseek" if "deepseek" in model else "ollama"
+        return RoutingDecision(backend, "test"), model
+
+    def dispatch(self, decision, local_model, model, messages, temperature, max_tokens, stream):
+        with self.lock:
+            self.running[decision.backend] += 1
+            self.peak[decision.backend] = max(self.peak[decision.backend], self.running[decision.backend])
+        time.sleep(self.delay)
+        with self.lock:
+            self.running[decision.backend] -= 1
+        if messages[0]["content"] == "boom":
+            raise Exception("DeepSeek API error: 500")
+        return {
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": messages[0]["content"]}}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 2, "total_tokens": 3}
+        }
+
+
+def item(model, content):
+    return {"model": model, "messages": [{"role": "user", "content": content}], "temperature": 0.7, "max_tokens": 10}
+
+
+def test_results_keep_order_and_report_failures_per_item():
+    executor = BatchExecutor(FakeRouter(), {"ollama": 2, "deepseek": 2})
+    outcomes = executor.run([item("qwen", "a"), item("deepseek-chat", "boom"), item("down", "c"), item("qwen", "d")])
+
+    assert outcomes[0]["choices"][0]["message"]["content"] == "a"
+    assert str(outcomes[1]) == "DeepSeek API error: 500"
+    assert isinstance(outcomes[2], BackendUnavailable)
+    assert outcomes[3]["choices"][0]["message"]["content"] == "d"
+    assert executor.stats()["deepseek"]["failed"] == 1
+
+
+def test_concurrency_is_bounded_per_backend():
+    router = FakeRouter()
+    executor = BatchExecutor(router, {"ollama": 2, "deepseek": 4})
+    executor.run([item("qwen", str(i)) for i in range(8)] + [item("deepseek-chat", str(i)) for i in range(8)])
+
+    assert router.peak == {"ollama": 2, "deepseek": 4}
+
+
+def test_parse_batch_applies_top_level_defaults():
+    requests = parse_batch({"model": "qwen", "temperature": 0, "requests": [{"messages": []}, {"messages": [], "model": "x"}]}, 10)
+    assert [r["model"] for r in requests] == ["qwen", "x"]
+    assert requests[0]["temperature"] == 0
+    with pytest.raises(ValueError):
+        parse_batch({"model": "qwen", "requests": [{"messages": []}] * 3}, 2)
+
+
+def test_choices_are_merged_and_replicated():
+    with pytest.raises(ValueError):
+        parse_choices({"n": 2, "stream": True}, 10)
+    response = FakeRouter(delay=0).dispatch(RoutingDecision("ollama", "t"), "q", "q", [{"content": "x"}], 0, 1, False)
+
+    merged = merge_choices([response, response, response])
+    assert [c["index"] for c in merged["choices"]] == [0, 1, 2]
+    assert merged["usage"]["total_tokens"] == 9
+    assert [c["index"] for c in replicate_choices(response, 2)["choices"]] == [0, 1]
+    assert len(response["choices"]) == 1
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Tests for CompletionCache
+"""
+
+from api.services.cache import CompletionCache
+
+
+MESSAGES = [{"role": "user", "content": "Clasifica: hola"}]
+
+
+def test_key_is_canonical():
+    a = CompletionCache.make_key("qwen2.5:7b", MESSAGES, 0, 100)
+    b = CompletionCache.make_key("qwen2.5:7b", [{"content": "Clasifica: hola", "role": "user"}], 0.0, 100)
+    assert a == b
+    assert a != CompletionCache.make_key("qwen2.5:7b", MESSAGES, 0, 200)
+
+
+def test_only_deterministic_requests_are_cacheable():
+    assert CompletionCache.is_cacheable(0)
+    assert not CompletionCache.is_cacheable(0.7)
+    assert not CompletionCache.is_cacheable(0, stream=True)
+    assert not CompletionCache.is_cacheable(None)
+
+
+def test_lru_eviction_and_ttl(monkeypatch):
+    cache = CompletionCache(max_entries=2, ttl=10)
+    cache.set("a", {"n": 1})
+    cache.set("b", {"n": 2})
+    assert cache.get("a") == {"n": 1}
+    cache.set("c", {"n": 3})
+
+    assert cache.get("b") is None
+    assert cache.get("a") == {"n": 1}
+
+    now = __import__('time').time()
+    monkeypatch.setattr('api.services.cache.time.time', lambda: now + 11)
+    assert cache.get("c") is None
+
+    stats = cache.stats()
+    assert stats["hits"] == 2 and stats["misses"] == 2 and stats["evictions"] == 1
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Tests for per-request deadlines and upstream cancellation on client disconnect
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from api.services.cancellation import (
+    DeadlineExceeded, RequestCancelled, RequestDeadlines, current_scope
+)
+from api.services.codec import dumps
+from api.services.router import AIRouter
+
+
+@pytest.fixture(autouse=True)
+def reset_scope():
+    # begin() fija el ámbito en el contexto del hilo de los tests: que no llegue a otros módulos
+    token = current_scope.set(None)
+    yield
+    current_scope.reset(token)
+
+
+class FakeStream:
+    def __init__(self, events):
+        self.events = events
+        self.cancelled = False
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def close(self):
+        self.closed = True
+
+
+class FakeResponse:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def iter_lines(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+def test_budget_grows_with_max_tokens_and_is_capped():
+    deadlines = RequestDeadlines(base=10, tokens_per_second=5, maximum=60)
+    assert deadlines.budget(None) == 10
+    assert deadlines.budget(100) == 30
+    assert deadlines.budget(10000) == 60
+    assert RequestDeadlines(base=0).budget(100) is None
+
+    scope = deadlines.begin(100)
+    assert current_scope.get() is scope
+    assert 29 < scope.remaining() <= 30
+    assert scope.timeout(5) == 5
+
+
+def test_guard_cancels_upstream_when_client_leaves():
+    gone = []
+    deadlines = RequestDeadlines(base=30)
+    scope = deadlines.begin(10, probe=lambda: bool(gone))
+    scope.interval = 0
+    stream = FakeStream([b'a', b'b', b'c'])
+
+    received = []
+    for event in scope.guard(stream):
+        received.append(event)
+        gone.append(True)
+    assert received == [b'a']
+    assert stream.cancelled and stream.closed
+    assert deadlines.stats()["disconnect"] == 1
+
+    # Sin CANCEL_ON_DISCONNECT no se vigila el socket
+    assert RequestDeadlines(cancel_on_disconnect=False).begin(10, probe=lambda: True).probe is None
+
+
+def test_guard_ends_stream_with_timeout_event():
+    deadlines = RequestDeadlines(base=30)
+    scope = deadlines.begin(10)
+    scope.deadline = time.monotonic() - 1
+    stream = FakeStream([b'a', b'b'])
+
+    [event] = list(scope.guard(stream))
+    assert b'"type":"timeout"' in event.replace(b' ', b'')
+    assert stream.cancelled
+    assert deadlines.stats()["deadline"] == 1
+    with pytest.raises(DeadlineExceeded):
+        scope.timeout(5)
+
+
+def test_collect_from_ollama_builds_response_and_stops_on_disconnect():
+    lines = [dumps({"message": {"content": "ho"}, "done": False}),
+             dumps({"message": {"content": "la"}, "done": False}),
+             dumps({"message": {"content": ""}, "done": True, "eval_count": 2})]
+    deadlines = RequestDeadlines(base=30)
+    response = FakeResponse(lines)
+    result = AIRouter._collect_from_ollama(response, deadlines.begin(10, probe=lambda: False))
+    assert result["message"]["content"] == "hola" and result["eval_count"] == 2
+    assert response.closed
+
+    scope = deadlines.begin(10, probe=lambda: True)
+    scope.interval = 0
+    response = FakeResponse(lines)
+    with pytest.raises(RequestCancelled):
+        AIRouter._collect_from_ollama(response, scope)
+    assert response.closed
+    assert deadlines.stats()["disconnect"] == 1
+
+
+def test_run_cancels_work_on_deadline_and_disconnect():
+    deadlines = RequestDeadlines(base=0.05, tokens_per_second=0)
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def scenario():
+        assert await deadlines.begin(None).run(asyncio.sleep(0, result='ok')) == 'ok'
+        with pytest.raises(DeadlineExceeded):
+            await deadlines.begin(None).run(slow())
+        with pytest.raises(RequestCancelled):
+            await RequestDeadlines(base=30).begin(None).run(slow(), receive)
+
+    asyncio.run(scenario())
+    assert cancelled == [True, True]
+
+
+def test_shared_scope_keeps_deadline_without_probe():
+    scope = RequestDeadlines(base=30).begin(10, probe=lambda: True)
+    shared = scope.shared()
+    assert shared.deadline == scope.deadline and shared.probe is None
+    assert shared.abort_reason() is None
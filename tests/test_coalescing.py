@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Tests for SingleFlight request coalescing
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from api.services.coalescing import AsyncSingleFlight, SingleFlight
+
+
+def test_identical_calls_share_one_execution():
+    single_flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def work():
+        calls.append(1)
+        release.wait()
+        return {"choices": [{"message": {"content": "ok"}}]}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(single_flight.do("k", work))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert sorted(leader for _, leader in results) == [False, False, False, False, True]
+    assert all(r == {"choices": [{"message": {"content": "ok"}}]} for r, _ in results)
+    assert single_flight.stats() == {"leaders": 1, "followers": 4, "in_flight": 0}
+
+
+def test_stream_is_fanned_out_to_late_subscribers():
+    single_flight = SingleFlight()
+    gate = threading.Event()
+
+    def upstream():
+        yield "data: 1\n\n"
+        gate.wait()
+        yield "data: 2\n\n"
+
+    leader_stream, leader = single_flight.do_stream("k", upstream)
+    follower_stream, follower_leader = single_flight.do_stream("k", lambda: iter(()))
+    gate.set()
+
+    assert leader and not follower_leader
+    assert list(leader_stream) == ["data: 1\n\n", "data: 2\n\n"]
+    assert list(follower_stream) == ["data: 1\n\n", "data: 2\n\n"]
+
+
+def test_errors_propagate_to_followers():
+    single_flight = SingleFlight()
+    started = threading.Event()
+
+    def failing():
+        started.set()
+        time.sleep(0.1)
+        raise RuntimeError("upstream down")
+
+    errors = []
+
+    def follower():
+        started.wait()
+        try:
+            single_flight.do("k", failing)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    t = threading.Thread(target=follower)
+    t.start()
+    try:
+        single_flight.do("k", failing)
+    except RuntimeError:
+        pass
+    t.join()
+    assert errors == ["upstream down"]
+
+
+def test_cancelled_leader_hands_the_call_to_a_follower():
+    single_flight = AsyncSingleFlight()
+    calls = []
+
+    async def work(delay):
+        calls.append(delay)
+        await asyncio.sleep(delay)
+        return {"choices": [{"message": {"content": "ok"}}]}
+
+    async def events():
+        yield b"data: ok\n\n"
+
+    async def stream(delay):
+        calls.append(delay)
+        await asyncio.sleep(delay)
+        return events()
+
+    async def scenario(do, fn):
+        # El plazo del líder vence mientras el seguidor espera: el seguidor repite la llamada
+        leader = asyncio.ensure_future(asyncio.wait_for(do("k", lambda: fn(10)), 0.05))
+        await asyncio.sleep(0.01)
+        follower = asyncio.ensure_future(do("k", lambda: fn(0.01)))
+        with pytest.raises(asyncio.TimeoutError):
+            await leader
+        return await follower
+
+    result, leader = asyncio.run(scenario(single_flight.do, work))
+    assert leader and result["choices"][0]["message"]["content"] == "ok"
+
+    async def streamed():
+        subscription, leader = await scenario(single_flight.do_stream, stream)
+        return [event async for event in subscription], leader
+
+    assert asyncio.run(streamed()) == ([b"data: ok\n\n"], True)
+    assert calls == [10, 0.01, 10, 0.01]
+    assert single_flight.stats() == {"leaders": 4, "followers": 0, "in_flight": 0}
+
+
+def test_follower_cancelled_on_its_own_stays_cancelled():
+    single_flight = AsyncSingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.05)
+        return {"ok": True}
+
+    async def scenario():
+        leader = asyncio.ensure_future(single_flight.do("k", work))
+        await asyncio.sleep(0.01)
+        follower = asyncio.ensure_future(single_flight.do("k", work))
+        await asyncio.sleep(0.01)
+        follower.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await follower
+        return await leader
+
+    assert asyncio.run(scenario()) == ({"ok": True}, True)
+    assert single_flight.stats()["followers"] == 1
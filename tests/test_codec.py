@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Tests for the JSON codec and upstream passthrough
+"""
+
+import copy
+
+from flask import Flask, jsonify
+
+from api.services.batch import replicate_choices
+from api.services.codec import FastJSONProvider, RawCompletion, dumps, loads
+from api.services.streaming import SSE_DONE, completion_from_chunks, sse
+
+UPSTREAM = (b'{"id":"c1","object":"chat.completion","model":"deepseek-chat",'
+            b'"choices":[{"index":0,"message":{"role":"assistant","content":"Ol\xc3\xa1"},"finish_reason":"stop"}],'
+            b'"usage":{"prompt_tokens":3,"completion_tokens":1,"total_tokens":4}}')
+
+
+def test_raw_completion_reads_as_dict_and_keeps_bytes():
+    completion = RawCompletion(UPSTREAM)
+    assert completion["usage"]["total_tokens"] == 4
+    assert dumps(completion) is UPSTREAM
+
+
+def test_derived_responses_are_serialized_again():
+    replicated = replicate_choices(RawCompletion(UPSTREAM), 2)
+    assert [c["index"] for c in loads(dumps(replicated))["choices"]] == [0, 1]
+    assert type(copy.deepcopy(RawCompletion(UPSTREAM))) is dict
+
+
+def test_flask_provider_relays_upstream_bytes():
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+    with app.app_context():
+        assert jsonify(RawCompletion(UPSTREAM)).get_data() == UPSTREAM
+        assert loads(jsonify({"content": "ñ"}).get_data()) == {"content": "ñ"}
+
+
+def test_sse_events_are_bytes():
+    events = [sse({"id": "c1", "model": "m", "choices": [{"index": 0, "delta": {"content": "Hola"}}]}), SSE_DONE]
+    assert all(isinstance(event, bytes) for event in events)
+    assert completion_from_chunks(events)["choices"][0]["message"]["content"] == "Hola"
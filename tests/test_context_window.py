@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Tests for context-window compaction of Ollama chat histories
+"""
+
+import threading
+
+from api.services.context_window import SUMMARY_HEADER, ContextWindow, ConversationSummaries
+
+
+def conversation(turns, words=200):
+    messages = [{"role": "system", "content": "Eres un asistente."}]
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"pregunta {i} " + "palabra " * words})
+        messages.append({"role": "assistant", "content": f"respuesta {i} " + "palabra " * words})
+    messages.append({"role": "user", "content": "última pregunta"})
+    return messages
+
+
+def test_short_conversation_is_untouched():
+    window = ContextWindow(default_context=4096, max_context=8192, min_context=2048)
+    messages = conversation(1, words=10)
+    result = window.compact('qwen2.5:7b', messages, 256)
+    assert result.messages is messages
+    assert result.dropped == 0
+    assert result.num_ctx == 2048
+
+
+def test_keeps_system_and_recent_turns_within_budget():
+    window = ContextWindow(default_context=4096, max_context=8192, min_context=1024)
+    messages = conversation(40)
+    result = window.compact('qwen2.5:7b', messages, 1000)
+
+    assert result.dropped > 0
+    assert result.messages[0] == messages[0]
+    assert result.messages[1]['role'] == 'user'
+    assert result.messages[-1] == messages[-1]
+    assert result.messages[1:] == messages[-(len(result.messages) - 1):]
+    assert result.prompt_tokens + 1000 <= 4096
+    assert result.num_ctx == 4096
+
+
+def test_model_context_sizes_and_max_context_cap():
+    window = ContextWindow(default_context=4096, max_context=16384, sizes={'small:1b': '2048'})
+    assert window.limit('small:1b', context_length=32768) == 2048
+    assert window.limit('qwen2.5:7b', context_length=32768) == 16384
+    assert window.limit('qwen2.5:7b') == 4096
+
+
+def test_num_ctx_does_not_shrink_while_in_use():
+    window = ContextWindow(max_context=8192, min_context=2048, sticky=300)
+    assert window.num_ctx('m', 5000, 8192) == 8192
+    assert window.num_ctx('m', 100, 8192) == 8192
+    window.sticky = 0
+    assert window.num_ctx('m', 100, 8192) == 2048
+
+
+def test_cached_summary_replaces_dropped_turns():
+    done = threading.Event()
+    calls = []
+
+    def summarize(model, previous, messages):
+        calls.append((previous, len(messages)))
+        done.set()
+        return "El usuario pregunta cosas."
+
+    summaries = ConversationSummaries(summarize)
+    window = ContextWindow(default_context=4096, max_context=8192, min_context=1024, summaries=summaries)
+    messages = conversation(40)
+
+    first = window.compact('qwen2.5:7b', messages, 1000)
+    assert first.summarized == 0
+    assert done.wait(2)
+    summaries._executor.shutdown(wait=True)
+
+    second = window.compact('qwen2.5:7b', messages, 1000)
+    assert second.summarized == first.dropped
+    assert second.messages[0]['content'].startswith("Eres un asistente.")
+    assert f"{SUMMARY_HEADER}\nEl usuario pregunta cosas." in second.messages[0]['content']
+    assert second.messages[1:] == first.messages[1:]
+    assert calls == [(None, first.dropped)]
+
+
+def test_summary_of_a_prefix_serves_a_longer_conversation():
+    summaries = ConversationSummaries(lambda model, previous, messages: "")
+    messages = conversation(5)[1:]
+    digests = summaries.digests('m', messages)
+    summaries.store(digests[3], "resumen")
+
+    longer = summaries.digests('m', messages + [{"role": "assistant", "content": "más"}])
+    assert longer[:len(digests)] == digests
+    assert summaries.lookup(longer) == (4, "resumen")
+    assert summaries.lookup(summaries.digests('otro', messages)) == (0, None)
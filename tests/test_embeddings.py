@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Tests for /v1/embeddings parsing and cross-request micro-batching
+"""
+
+import asyncio
+import base64
+import struct
+import threading
+import time
+
+import pytest
+
+from api.services.embeddings import (
+    AsyncEmbeddingBatcher, EmbeddingBatcher, embedding_response, parse_embedding_request
+)
+
+
+class FakeOllama:
+    """embed(model, inputs, dimensions) que registra cada lote"""
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, model, inputs, dimensions=None):
+        self.batches.append(list(inputs))
+        return [[float(len(text))] for text in inputs], sum(len(text) for text in inputs)
+
+
+def run_concurrently(batcher, payloads):
+    results = [None] * len(payloads)
+    barrier = threading.Barrier(len(payloads))
+
+    def worker(index, inputs):
+        barrier.wait()
+        results[index] = batcher.embed_many("nomic-embed-text", inputs)
+
+    threads = [threading.Thread(target=worker, args=(i, p)) for i, p in enumerate(payloads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(2)
+    return results
+
+
+def test_concurrent_requests_share_one_upstream_call():
+    ollama = FakeOllama()
+    batcher = EmbeddingBatcher(ollama, max_batch=32, max_wait=0.2)
+    payloads = [["a"], ["bb", "ccc"], ["dddd"]]
+    results = run_concurrently(batcher, payloads)
+
+    assert len(ollama.batches) == 1
+    for inputs, (vectors, tokens) in zip(payloads, results):
+        assert vectors == [[float(len(text))] for text in inputs]
+        assert tokens == sum(len(text) for text in inputs)
+    stats = batcher.stats()
+    assert stats["batches"] == 1 and stats["requests"] == 3 and stats["inputs"] == 4
+
+
+def test_full_batch_is_sent_without_waiting():
+    ollama = FakeOllama()
+    batcher = EmbeddingBatcher(ollama, max_batch=3, max_wait=5)
+    started = time.monotonic()
+    results = run_concurrently(batcher, [["a"], ["b", "c"]])
+    assert time.monotonic() - started < 1
+    assert all(result is not None for result in results)
+    assert [sorted(batch) for batch in ollama.batches] == [["a", "b", "c"]]
+
+
+def test_upstream_error_reaches_every_caller():
+    def failing(model, inputs, dimensions=None):
+        raise ConnectionError("ollama down")
+
+    batcher = EmbeddingBatcher(failing, max_batch=8, max_wait=0.001)
+    with pytest.raises(ConnectionError):
+        batcher.embed_many("nomic-embed-text", ["a"])
+    assert batcher.stats()["errors"] == 1
+
+
+def test_async_batcher_merges_requests():
+    calls = []
+
+    async def embed(model, inputs, dimensions=None):
+        calls.append(list(inputs))
+        return [[1.0, 0.0] for _ in inputs], len(inputs)
+
+    async def main():
+        batcher = AsyncEmbeddingBatcher(embed, max_batch=16, max_wait=0.05)
+        return await asyncio.gather(*(batcher.embed_many("m", [f"t{i}"]) for i in range(5)))
+
+    results = asyncio.run(main())
+    assert calls == [["t0", "t1", "t2", "t3", "t4"]]
+    assert all(vectors == [[1.0, 0.0]] for vectors, _ in results)
+
+
+def test_parse_and_format():
+    params = parse_embedding_request({"model": "text-embedding-3-small", "input": "hola"}, 10)
+    assert params["input"] == ["hola"] and params["encoding_format"] == "float"
+    with pytest.raises(ValueError):
+        parse_embedding_request({"input": [[1, 2, 3]]}, 10)
+    with pytest.raises(ValueError):
+        parse_embedding_request({"input": ["a"] * 11}, 10)
+
+    response = embedding_response("nomic-embed-text", [[0.5, -1.0]], 3, "base64")
+    packed = base64.b64decode(response["data"][0]["embedding"])
+    assert struct.unpack("<2f", packed) == (0.5, -1.0)
+    assert response["usage"] == {"prompt_tokens": 3, "total_tokens": 3}
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Tests for the background dependency prober behind /health
+"""
+
+import time
+
+import requests
+
+from api.services import health_prober as prober_module
+from api.services.backend_health import BackendHealth, BackendNodes, CLOSED, HALF_OPEN, OPEN
+from api.services.health_prober import HealthProber, models_url, parse_probe_urls
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class FakeClient:
+    """Cada URL responde con un código, tarda unos segundos o falla la conexión"""
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.calls = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.calls.append((url, headers))
+        route = self.routes.get(url, 200)
+        if route == 'refused':
+            raise requests.ConnectionError("connection refused")
+        if isinstance(route, float):
+            time.sleep(route)
+            return FakeResponse(200)
+        return FakeResponse(route)
+
+
+class FakeRegistry:
+    def __init__(self, nodes):
+        self.nodes = {url: {"healthy": True} for url in nodes}
+        self.down = []
+        self.invalidated = 0
+
+    def urls(self):
+        return list(self.nodes)
+
+    def snapshot(self):
+        return {url: dict(node) for url, node in self.nodes.items()}
+
+    def mark_down(self, url):
+        self.down.append(url)
+        self.nodes[url]["healthy"] = False
+
+    def invalidate(self):
+        self.invalidated += 1
+
+
+def make_prober(monkeypatch, routes, nodes=("http://a", "http://b"), **kwargs):
+    client = FakeClient(routes)
+    backends = {'ollama': BackendNodes('ollama'), 'deepseek': BackendHealth('deepseek')}
+    monkeypatch.setattr(prober_module, 'get_upstream_client', lambda name: client)
+    monkeypatch.setattr(prober_module, 'get_backend_health', lambda name: backends[name])
+    registry = FakeRegistry(nodes)
+    prober = HealthProber(registry, deepseek_url='http://ds/v1/chat/completions', deepseek_key='k', **kwargs)
+    return prober, registry, backends, client
+
+
+def test_probes_run_concurrently_and_are_cached(monkeypatch):
+    prober, _, _, client = make_prober(monkeypatch, {
+        "http://a/api/version": 0.3, "http://b/api/version": 0.3, "http://ds/v1/models": 0.3
+    })
+    started = time.monotonic()
+    results = prober.probe_all()
+    assert time.monotonic() - started < 0.8
+    assert sorted(results) == ["deepseek", "ollama:http://a", "ollama:http://b"]
+    assert all(result["status"] == 'up' and result["latency"] >= 0.3 for result in results.values())
+    assert ("http://ds/v1/models", {"Authorization": "Bearer k"}) in client.calls
+
+    status = prober.status()
+    assert status["status"] == 'healthy' and status["rounds"] == 1
+    # Varias peticiones profundas seguidas comparten la misma ronda
+    prober.status(deep=True)
+    assert prober.status()["rounds"] == 1
+
+
+def test_slow_dependency_is_cut_at_the_timeout(monkeypatch):
+    prober, _, _, _ = make_prober(monkeypatch, {"http://b/api/version": 1.5}, timeout=0.1)
+    started = time.monotonic()
+    results = prober.probe_all()
+    assert time.monotonic() - started < 1.4
+    assert results["ollama:http://b"] == {**results["ollama:http://b"], "status": 'down', "error": 'timeout'}
+    assert results["ollama:http://a"]["status"] == 'up'
+    assert prober.status()["status"] == 'degraded'
+
+
+def test_failures_feed_the_router(monkeypatch):
+    routes = {"http://a/api/version": 'refused', "http://b/api/version": 503, "http://ds/v1/models": 401}
+    prober, registry, backends, _ = make_prober(monkeypatch, routes)
+    prober.probe_all()
+
+    # Ningún nodo Ollama contesta: fuera del reparto y circuito abierto sin esperar a una petición
+    assert registry.down == ["http://a", "http://b"]
+    assert backends['ollama'].state == OPEN and not backends['ollama'].allow_request()
+    # Un 401 de DeepSeek no es una caída
+    assert backends['deepseek'].state == CLOSED
+    assert prober.status()["status"] == 'degraded'
+
+    routes["http://a/api/version"] = 200
+    prober.probe_all()
+    assert registry.invalidated == 1
+    assert backends['ollama'].state == HALF_OPEN
+
+    routes["http://a/api/version"] = 'refused'
+    routes["http://ds/v1/models"] = 500
+    prober.probe_all()
+    assert prober.status()["status"] == 'unhealthy'
+
+
+def test_extra_urls_and_models_url():
+    assert parse_probe_urls("nginx=http://localhost/health, bad, redis = http://r:1 ") == {
+        "nginx": "http://localhost/health", "redis": "http://r:1"
+    }
+    assert models_url("https://api.deepseek.com/chat/completions") == "https://api.deepseek.com/models"
+    assert models_url("http://x/v1/") == "http://x/v1/models"
+
+
+def test_prober_starts_only_when_the_app_starts_it(monkeypatch):
+    started = []
+    monkeypatch.setenv('HEALTH_PROBE_ENABLED', 'true')
+    monkeypatch.setattr(prober_module, '_prober', None)
+    monkeypatch.setattr(prober_module.HealthProber, 'start', lambda self: started.append(self))
+
+    prober = prober_module.get_health_prober()
+    assert prober is not None and started == []
+    assert prober_module.start_health_prober() is prober
+    assert started == [prober]
+
+    monkeypatch.setenv('HEALTH_PROBE_ENABLED', 'false')
+    assert prober_module.start_health_prober() is None
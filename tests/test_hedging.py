@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Tests for hedged Ollama/DeepSeek requests
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from api.services.hedging import HedgeCancelled, HedgePolicy
+from api.services.streaming import completion_from_chunks, sse
+
+
+def slow_primary(first_token_after, cancelled):
+    def fn(leg):
+        time.sleep(first_token_after)
+        try:
+            leg.first_token()
+        except HedgeCancelled:
+            cancelled.set()
+            raise
+        return "ollama"
+    return fn
+
+
+def secondary(calls, delay=0.0):
+    def fn(leg):
+        calls.append(time.monotonic())
+        time.sleep(delay)
+        leg.first_token()
+        return "deepseek"
+    return fn
+
+
+def test_fast_first_token_does_not_hedge():
+    policy = HedgePolicy(delay=0.5)
+    calls = []
+    result = policy.run(slow_primary(0.01, threading.Event()), secondary(calls), lambda: True)
+    assert result == "ollama"
+    assert calls == []
+    assert policy.stats()["hedged"] == 0
+
+
+def test_slow_first_token_hedges_and_cancels_loser():
+    policy = HedgePolicy(delay=0.05)
+    calls, cancelled = [], threading.Event()
+    started = time.monotonic()
+    result = policy.run(slow_primary(0.3, cancelled), secondary(calls), lambda: True)
+    assert result == "deepseek"
+    assert time.monotonic() - started < 0.25
+    assert cancelled.wait(1)
+    stats = policy.stats()
+    assert stats["hedged"] == 1
+    assert stats["wins"] == {"ollama": 0, "deepseek": 1}
+    assert stats["hedge_rate"] == 1.0
+
+
+def test_no_hedge_while_deepseek_circuit_is_open():
+    policy = HedgePolicy(delay=0.01)
+    calls = []
+    result = policy.run(slow_primary(0.1, threading.Event()), secondary(calls), lambda: False)
+    assert result == "ollama"
+    assert calls == []
+
+
+def test_primary_error_falls_back_without_counting_a_hedge():
+    policy = HedgePolicy(delay=5)
+
+    def failing(leg):
+        raise ConnectionError("ollama down")
+
+    calls = []
+    assert policy.run(failing, secondary(calls), lambda: True) == "deepseek"
+    stats = policy.stats()
+    assert stats["fallbacks"] == 1
+    assert stats["hedged"] == 0
+
+
+def test_both_legs_failing_raises():
+    policy = HedgePolicy(delay=5)
+
+    def failing(leg):
+        raise ConnectionError("down")
+
+    with pytest.raises(ConnectionError):
+        policy.run(failing, failing, lambda: True)
+
+
+def test_learned_delay_uses_percentile_after_min_samples():
+    policy = HedgePolicy(delay=2.0, percentile=90, min_samples=10)
+    for i in range(9):
+        policy.observe(i / 10)
+    assert policy.delay() == 2.0
+    policy.observe(0.9)
+    assert policy.delay() == pytest.approx(0.8)
+
+
+def test_async_hedge_cancels_slow_primary():
+    policy = HedgePolicy(delay=0.05)
+    state = {}
+
+    async def primary(leg):
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+        leg.first_token()
+        return "ollama"
+
+    async def hedge(leg):
+        leg.first_token()
+        return "deepseek"
+
+    async def main():
+        result = await policy.run_async(primary, hedge, lambda: True)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(main()) == "deepseek"
+    assert state["cancelled"]
+
+
+def test_completion_from_chunks():
+    events = [
+        sse({"id": "c1", "created": 1, "model": "m", "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}}]}),
+        sse({"id": "c1", "created": 1, "model": "m", "choices": [{"index": 0, "delta": {"content": "Hola"}}]}),
+        sse({"id": "c1", "created": 1, "model": "m", "choices": [{"index": 0, "delta": {}, "finish_reason": "length"}]}),
+        sse({"id": "c1", "created": 1, "model": "m", "choices": [],
+             "usage": {"prompt_tokens": 3, "completion_tokens": 1, "total_tokens": 4}}),
+        "data: [DONE]\n\n"
+    ]
+    completion = completion_from_chunks(events)
+    assert completion["choices"][0]["message"]["content"] == "Hola"
+    assert completion["choices"][0]["finish_reason"] == "length"
+    assert completion["usage"]["total_tokens"] == 4
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Tests for the request journal and the replay helpers
+"""
+
+import glob
+import json
+import os
+
+from api.services.journal import RequestJournal, current_trace, key_id
+from api.services.usage import UsageRecorder, UsageStore
+from bench.replay import build_request, load_trace
+
+CHAT = b'{"model": "qwen2.5:7b", "messages": [{"role": "user", "content": "hola"}], "max_tokens": 64, "stream": true}'
+
+
+def make_journal(directory, **kwargs):
+    journal = RequestJournal(str(directory), **kwargs)
+    # Sin hilo escritor: los tests vacían la cola con flush()
+    journal._pid = os.getpid()
+    return journal
+
+
+def read_lines(directory):
+    lines = []
+    for path in sorted(glob.glob(os.path.join(directory, 'requests-*.jsonl'))):
+        with open(path) as f:
+            lines.extend(json.loads(line) for line in f)
+    return lines
+
+
+def test_entry_has_request_metadata_and_upstream_usage(tmp_path):
+    journal = make_journal(tmp_path)
+    trace = journal.begin('POST', '/v1/chat/completions', lambda: CHAT)
+    assert current_trace.get() is trace
+    trace.first_token()
+    trace.generation('ollama', 'qwen2.5:7b', 12, 30)
+    journal.finish(trace, 200, 'secret-key', 'interactive', 'MISS')
+    journal.finish(trace, 200, 'secret-key')
+    journal.flush()
+
+    [entry] = read_lines(str(tmp_path))
+    assert entry["key"] == key_id('secret-key') and 'secret-key' not in json.dumps(entry)
+    assert (entry["model"], entry["stream"], entry["max_tokens"], entry["messages"]) == ('qwen2.5:7b', True, 64, 1)
+    assert (entry["backend"], entry["prompt_tokens"], entry["completion_tokens"]) == ('ollama', 12, 30)
+    assert entry["ttft"] is not None and entry["cache"] == 'MISS'
+    assert "body" not in entry
+    assert journal.begin('GET', '/health', b'') is None
+
+
+def test_bodies_only_when_opted_in(tmp_path):
+    journal = make_journal(tmp_path, include_bodies=True)
+    journal.finish(journal.begin('POST', '/v1/chat/completions', CHAT), 200)
+    journal.flush()
+    [entry] = read_lines(str(tmp_path))
+    assert entry["body"]["messages"][0]["content"] == "hola"
+
+
+def test_usage_record_is_attributed_to_the_trace(tmp_path):
+    journal = make_journal(tmp_path)
+    trace = journal.begin('POST', '/v1/chat/completions', CHAT)
+    recorder = UsageRecorder(UsageStore(str(tmp_path / 'usage.db')), flush_interval=3600)
+    recorder.record('deepseek', 'deepseek-chat', 5, 7)
+    recorder.record('ollama', 'qwen2.5:7b', 5, 3)
+    assert (trace.generations, trace.backend, trace.completion_tokens) == (2, 'mixed', 10)
+
+
+def test_rotation_and_retention(tmp_path):
+    journal = make_journal(tmp_path, max_bytes=1, max_files=2)
+    for _ in range(4):
+        journal.finish(journal.begin('POST', '/v1/chat/completions', CHAT), 200)
+        journal.flush()
+    assert len(glob.glob(str(tmp_path / 'requests-*.jsonl'))) == 2
+    assert journal.stats()["rotations"] == 3
+    assert len(read_lines(str(tmp_path))) == 2
+
+
+def test_full_queue_drops_instead_of_blocking(tmp_path):
+    journal = make_journal(tmp_path, queue_size=1)
+    for _ in range(3):
+        journal.finish(journal.begin('POST', '/v1/chat/completions', CHAT), 200)
+    assert journal.stats()["dropped"] == 2
+    assert journal.stats()["queued"] == 1
+
+
+def test_replay_builds_synthetic_requests(tmp_path):
+    trace = tmp_path / 'requests-1.jsonl'
+    trace.write_text(
+        '{"ts": 2, "method": "POST", "path": "/v1/chat/completions", "model": "m", "stream": true,'
+        ' "generations": 2, "prompt_tokens": 40, "completion_tokens": 20, "n": 2}\n'
+        '{"ts": 1, "method": "POST", "path": "/v1/embeddings", "model": "e", "inputs": 2, "prompt_tokens": 8}\n'
+        '{"ts": 3, "method": "GET", "path": "/v1/models"}\n'
+        '{"ts": 4, "method": "POST", "pa'
+    )
+    entries = load_trace([str(tmp_path)])
+    assert [entry["ts"] for entry in entries] == [1, 2]
+
+    path, body = build_request(entries[0])
+    assert path == '/v1/embeddings' and len(body["input"]) == 2
+    path, body = build_request(entries[1])
+    assert (body["model"], body["stream"], body["n"], body["max_tokens"]) == ('m', True, 2, 10)
+    assert build_request({"path": "/v1/x", "body": {"a": 1}}) == ('/v1/x', {"a": 1})
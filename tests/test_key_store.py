@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Tests for KeyStore
+"""
+
+import json
+import os
+
+from api.services.key_store import KeyStore
+
+
+def write_keys(path, keys):
+    path.write_text(json.dumps(keys))
+    # Asegurar que el cambio se detecta aunque el mtime no avance
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1_000_000))
+
+
+def make_store(path):
+    store = KeyStore(str(path), reload_interval=0)
+    # Sin hilo de volcado en los tests
+    store._pid = os.getpid()
+    return store
+
+
+def test_exact_lookup_only(tmp_path):
+    path = tmp_path / "api_keys.json"
+    write_keys(path, {
+        "sk-bak-aaaa": {"name": "a", "active": True, "requests": 0, "tokens": 0},
+        "sk-bak-bbbb": {"name": "b", "active": False, "requests": 0, "tokens": 0},
+    })
+    store = make_store(path)
+
+    assert store.get("sk-bak-aaaa")["name"] == "a"
+    assert store.get("sk-bak-a") is None
+    assert store.get("sk-bak-bbbb") is None
+    assert store.get("") is None
+
+
+def test_usage_is_flushed_in_batches(tmp_path):
+    path = tmp_path / "api_keys.json"
+    write_keys(path, {"sk-bak-aaaa": {"name": "a", "active": True, "requests": 5, "tokens": 0}})
+    store = make_store(path)
+
+    for _ in range(3):
+        store.record_usage("sk-bak-aaaa", requests=1, tokens=10)
+    assert json.loads(path.read_text())["sk-bak-aaaa"]["requests"] == 5
+
+    store.flush()
+    saved = json.loads(path.read_text())["sk-bak-aaaa"]
+    assert saved["requests"] == 8 and saved["tokens"] == 30
+
+
+def test_reload_on_file_change(tmp_path):
+    path = tmp_path / "api_keys.json"
+    write_keys(path, {})
+    store = make_store(path)
+    assert store.get("sk-bak-new") is None
+
+    write_keys(path, {"sk-bak-new": {"name": "new", "active": True}})
+    assert store.get("sk-bak-new")["name"] == "new"
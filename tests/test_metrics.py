@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Tests for the Prometheus metrics registry
+"""
+
+import json
+
+from api.services.metrics import MetricsRegistry
+
+
+def test_render_histogram_is_cumulative():
+    registry = MetricsRegistry()
+    latency = registry.histogram('latency_seconds', 'Latency', ('backend',), buckets=(0.1, 1))
+    latency.observe(0.05, backend='ollama')
+    latency.observe(0.5, backend='ollama')
+    latency.observe(3, backend='ollama')
+
+    text = registry.render()
+    assert '# TYPE latency_seconds histogram' in text
+    assert 'latency_seconds_bucket{backend="ollama",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{backend="ollama",le="1"} 2' in text
+    assert 'latency_seconds_bucket{backend="ollama",le="+Inf"} 3' in text
+    assert 'latency_seconds_count{backend="ollama"} 3' in text
+
+
+def test_workers_are_summed_and_dead_gauges_dropped(tmp_path):
+    registry = MetricsRegistry(str(tmp_path), flush_interval=3600)
+    requests = registry.counter('requests_total', 'Requests', ('status',))
+    in_flight = registry.gauge('in_flight', 'In flight')
+    requests.inc(status='200')
+    in_flight.inc()
+
+    # Volcado de un worker que ya terminó (pid inexistente)
+    dead = {
+        "requests_total": {"type": "counter", "help": "Requests", "labelnames": ["status"], "values": [[["200"], 4]]},
+        "in_flight": {"type": "gauge", "help": "In flight", "labelnames": [], "values": [[[], 7]]}
+    }
+    (tmp_path / "metrics-999999999.json").write_text(json.dumps(dead))
+
+    text = registry.render()
+    assert 'requests_total{status="200"} 5' in text
+    assert 'in_flight 1' in text
+
+
+def test_label_values_are_escaped():
+    registry = MetricsRegistry()
+    registry.counter('c_total', 'C', ('model',)).inc(model='a"b')
+    assert 'c_total{model="a\\"b"} 1' in registry.render()
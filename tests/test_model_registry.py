@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Tests for ModelRegistry
+"""
+
+import os
+
+from api.services import model_registry
+from api.services.model_registry import ModelRegistry
+
+
+class FakeTagsResponse:
+    status_code = 200
+
+    def json(self):
+        return {"models": [{"name": "qwen2.5:7b"}, {"name": "llama3:latest"}]}
+
+
+class FakeClient:
+    def __init__(self, get):
+        self.get = get
+
+
+def use_client(monkeypatch, get):
+    monkeypatch.setattr(model_registry, 'get_upstream_client', lambda name: FakeClient(get))
+
+
+def test_resolve_exact_and_aliases(monkeypatch):
+    use_client(monkeypatch, lambda *a, **kw: FakeTagsResponse())
+    registry = ModelRegistry("http://ollama", aliases={"gpt-3.5-turbo": "qwen2.5:7b"})
+    assert registry.refresh()
+    # Sin hilo de refresco en los tests
+    registry._pid = os.getpid()
+    registry._ready.set()
+
+    assert registry.resolve("qwen2.5:7b") == "qwen2.5:7b"
+    assert registry.resolve("llama3") == "llama3:latest"
+    assert registry.resolve("gpt-3.5-turbo") == "qwen2.5:7b"
+    assert not registry.is_local("qwen2.5")
+    assert not registry.is_local("deepseek-chat")
+
+
+def test_failed_refresh_keeps_last_inventory(monkeypatch):
+    use_client(monkeypatch, lambda *a, **kw: FakeTagsResponse())
+    registry = ModelRegistry("http://ollama")
+    registry.refresh()
+
+    def down(*args, **kwargs):
+        raise ConnectionError("down")
+
+    use_client(monkeypatch, down)
+    assert not registry.refresh()
+    assert [m['name'] for m in registry._models] == ["qwen2.5:7b", "llama3:latest"]
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Tests for the multi-node Ollama pool
+"""
+
+from api.services import model_registry
+from api.services.backend_health import BackendNodes
+from api.services.model_registry import ModelRegistry
+from api.services.ollama_pool import OllamaPool, affinity_key
+
+
+class FakeRegistry:
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    def nodes_for(self, model):
+        return self.nodes
+
+    def snapshot(self):
+        return {url: {} for url, _ in self.nodes}
+
+
+def test_least_loaded_node_wins_and_loaded_model_breaks_ties():
+    pool = OllamaPool(FakeRegistry([("http://a", False), ("http://b", True)]), affinity=False)
+    assert pool.pick("qwen2.5:7b") == "http://b"
+
+    pool.begin("http://b")
+    assert pool.pick("qwen2.5:7b") == "http://a"
+    pool.end("http://b")
+    assert pool.stats()["nodes"] == {"http://a": {"in_flight": 0}, "http://b": {"in_flight": 0}}
+
+
+def test_cold_penalty_prefers_a_busier_loaded_node():
+    pool = OllamaPool(FakeRegistry([("http://a", False), ("http://b", True)]), affinity=False, cold_penalty=2)
+    pool.begin("http://b")
+    assert pool.pick("qwen2.5:7b") == "http://b"
+    pool.begin("http://b")
+    pool.begin("http://b")
+    assert pool.pick("qwen2.5:7b") == "http://a"
+
+
+def test_conversation_sticks_to_its_node_within_slack():
+    pool = OllamaPool(FakeRegistry([("http://a", True), ("http://b", True)]), affinity_slack=1)
+    conversation = [{"role": "system", "content": "s"}, {"role": "user", "content": "hola"}]
+    key = affinity_key(conversation)
+    assert key == affinity_key(conversation + [{"role": "assistant", "content": "x"}, {"role": "user", "content": "y"}])
+
+    first = pool.pick("qwen2.5:7b", key)
+    pool.begin(first)
+    assert pool.pick("qwen2.5:7b", key) == first
+
+    # Demasiado cargado: se rompe la afinidad
+    pool.begin(first)
+    assert pool.pick("qwen2.5:7b", key) != first
+
+
+def test_no_node_with_model_returns_none():
+    assert OllamaPool(FakeRegistry([])).pick("qwen2.5:7b") is None
+
+
+def test_nodes_with_open_circuit_are_skipped():
+    health = BackendNodes('ollama', consecutive_failures=1)
+    pool = OllamaPool(FakeRegistry([("http://a", True), ("http://b", False)]), affinity=False, health=health)
+    assert pool.pick("qwen2.5:7b") == "http://a"
+
+    failing = health.node("http://a")
+    failing.end(failing.begin(), ok=False)
+    assert pool.pick("qwen2.5:7b") == "http://b"
+    assert health.allow_request()
+
+    failing = health.node("http://b")
+    failing.end(failing.begin(), ok=False)
+    assert pool.pick("qwen2.5:7b") is None
+    assert not health.allow_request()
+    assert pool.stats()["circuit_skips"] == 3
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, models):
+        self.models = models
+
+    def json(self):
+        return {"models": self.models}
+
+
+class FakeClient:
+    def get(self, url, **kwargs):
+        if url.endswith('/api/ps'):
+            return FakeResponse([{"name": "qwen2.5:7b"}] if url.startswith("http://b") else [])
+        return FakeResponse([{"name": "qwen2.5:7b"}])
+
+
+def test_nodes_file_is_reloaded_without_restart(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_registry, 'get_upstream_client', lambda name: FakeClient())
+    nodes_file = tmp_path / "nodes.txt"
+    nodes_file.write_text("http://a:11434\n")
+    registry = ModelRegistry("http://default:11434", nodes_file=str(nodes_file), reload_interval=0)
+    registry.refresh()
+    assert registry.nodes_for("qwen2.5:7b") == [("http://a:11434", False)]
+
+    nodes_file.write_text("http://a:11434\n# segundo nodo\nhttp://b:11434/\n")
+    registry.refresh()
+    assert registry.nodes_for("qwen2.5:7b") == [("http://a:11434", False), ("http://b:11434", True)]
+
+    registry.mark_down("http://a:11434")
+    assert registry.nodes_for("qwen2.5:7b") == [("http://b:11434", True)]
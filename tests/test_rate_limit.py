@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Tests for the token bucket rate limiter
+"""
+
+from api.middleware import rate_limit
+from api.middleware.rate_limit import TokenBucketLimiter, rate_limit_headers
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_allows_limit_then_refills(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit.time, 'monotonic', clock)
+    limiter = TokenBucketLimiter()
+
+    results = [limiter.hit("k", 3, 60) for _ in range(4)]
+    assert [r.allowed for r in results] == [True, True, True, False]
+    assert results[2].remaining == 0
+    assert results[3].retry_after == 20
+
+    clock.now += 20
+    assert limiter.hit("k", 3, 60).allowed
+
+
+def test_idle_keys_are_evicted(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit.time, 'monotonic', clock)
+    limiter = TokenBucketLimiter()
+
+    limiter.hit("idle", 10, 60)
+    clock.now += 61
+    limiter.hit("active", 10, 60)
+    assert len(limiter) == 1
+
+
+def test_headers():
+    limiter = TokenBucketLimiter()
+    limiter.hit("k", 1, 60)
+    headers = rate_limit_headers(limiter.hit("k", 1, 60))
+    assert headers['X-RateLimit-Limit'] == "1"
+    assert headers['X-RateLimit-Remaining'] == "0"
+    assert int(headers['Retry-After']) > 0
+
+
+def test_batch_cost_consumes_several_tokens(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit.time, 'monotonic', clock)
+    limiter = TokenBucketLimiter()
+
+    assert limiter.hit("k", 10, 60, cost=8).remaining == 2
+    denied = limiter.hit("k", 10, 60, cost=4)
+    assert not denied.allowed
+    assert denied.retry_after == 12
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Tests for Ollama model residency: placement, keep_alive and warmups
+"""
+
+import os
+
+from api.services import model_registry, residency as residency_module
+from api.services.model_registry import ModelRegistry
+from api.services.residency import ModelResidency, parse_keep_alive
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = body or {}
+
+    def json(self):
+        return self.body
+
+
+class FakeOllama:
+    """/api/tags y /api/ps de un nodo; /api/generate registra las cargas"""
+
+    def __init__(self, installed, loaded):
+        self.installed = installed
+        self.loaded = set(loaded)
+        self.generated = []
+
+    def get(self, url, **kwargs):
+        names = self.installed if url.endswith('/api/tags') else sorted(self.loaded)
+        return FakeResponse(200, {"models": [{"name": name} for name in names]})
+
+    def post(self, url, data=None, **kwargs):
+        if url.endswith('/api/generate'):
+            self.generated.append(data)
+            return FakeResponse(200)
+        return FakeResponse(404)
+
+
+def make_registry(monkeypatch, ollama):
+    monkeypatch.setattr(model_registry, 'get_upstream_client', lambda name: ollama)
+    monkeypatch.setattr(residency_module, 'get_upstream_client', lambda name: ollama)
+    registry = ModelRegistry("http://ollama", aliases={"gpt-4": "qwen2.5:14b"})
+    assert registry.refresh()
+    # Sin hilo de refresco en los tests
+    registry._pid = os.getpid()
+    registry._ready.set()
+    return registry
+
+
+def test_cold_model_uses_loaded_equivalent(monkeypatch):
+    ollama = FakeOllama(["qwen2.5:7b", "qwen2.5:14b", "llama3:latest"], ["qwen2.5:7b"])
+    registry = make_registry(monkeypatch, ollama)
+    residency = ModelResidency(registry, equivalents={"gpt-4": ["llama3", "qwen2.5:7b"]})
+
+    assert residency.place("qwen2.5:7b") == ("qwen2.5:7b", "resident")
+    assert residency.place("qwen2.5:14b") == ("qwen2.5:7b", "equivalent")
+    assert residency.place("llama3:latest") == ("llama3:latest", "cold")
+
+    # /api/ps refleja que Ollama expulsó el modelo
+    ollama.loaded = {"qwen2.5:14b"}
+    registry.refresh_loaded()
+    assert residency.place("qwen2.5:7b") == ("qwen2.5:7b", "cold")
+    assert residency.place("qwen2.5:14b") == ("qwen2.5:14b", "resident")
+    stats = residency.stats()
+    assert (stats["resident"], stats["equivalent"], stats["cold"]) == (2, 1, 2)
+
+
+def test_unknown_residency_without_ps(monkeypatch):
+    ollama = FakeOllama(["qwen2.5:7b"], [])
+    ollama.get = lambda url, **kwargs: (
+        FakeResponse(200, {"models": [{"name": "qwen2.5:7b"}]}) if url.endswith('/api/tags') else FakeResponse(404)
+    )
+    registry = make_registry(monkeypatch, ollama)
+    assert ModelResidency(registry).place("qwen2.5:7b") == ("qwen2.5:7b", "unknown")
+
+
+def test_keep_alive_per_model_and_hot_default(monkeypatch):
+    registry = make_registry(monkeypatch, FakeOllama(["qwen2.5:7b", "qwen2.5:14b", "llama3:latest"], []))
+    residency = ModelResidency(registry, hot=["qwen2.5:7b"], keep_alive={"gpt-4": "30m"}, default_keep_alive='300')
+    assert residency.keep_alive_for("qwen2.5:7b") == -1
+    assert residency.keep_alive_for("qwen2.5:14b") == '30m'
+    assert residency.keep_alive_for("llama3:latest") == 300
+    assert ModelResidency(registry).keep_alive_for("llama3:latest") is None
+    assert parse_keep_alive('-1') == -1 and parse_keep_alive('') is None
+
+
+def test_hot_models_are_warmed_once_per_interval(monkeypatch):
+    ollama = FakeOllama(["qwen2.5:7b", "llama3:latest"], ["llama3:latest"])
+    registry = make_registry(monkeypatch, ollama)
+    residency = ModelResidency(registry, hot=["qwen2.5:7b", "llama3"], warm_interval=60)
+
+    warmed = []
+    residency.warm = lambda url, model: warmed.append((url, model))
+    assert residency.warm_missing() == [("http://ollama", "qwen2.5:7b")]
+    del residency.warm
+    assert residency.warm("http://ollama", "qwen2.5:7b")
+    assert b'"keep_alive":-1' in ollama.generated[-1]
+    assert registry.residency("qwen2.5:7b") is True
+
+    registry.refresh_loaded()
+    assert registry.residency("qwen2.5:7b") is False
+    assert residency.warm_missing() == []
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Tests for AIRouter
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+
+from api.services import embeddings as embeddings_module
+from api.services.admission import AdmissionQueue
+from api.services.async_router import AsyncAIRouter
+from api.services.embeddings import AsyncEmbeddingBatcher
+from api.services.model_registry import ModelRegistry
+from api.services.ollama_pool import OllamaPool
+from api.services.residency import ModelResidency
+from api.services.router import AIRouter
+from bench.stubs import StubProfile, start_ollama_stub
+
+
+class FakeResponse:
+    """Respuesta upstream mínima con cuerpo por líneas"""
+
+    def __init__(self, lines, status_code=200):
+        self.lines = lines
+        self.status_code = status_code
+        self.closed = False
+
+    def iter_lines(self):
+        for line in self.lines:
+            yield line
+
+    def close(self):
+        self.closed = True
+
+
+def test_stream_from_ollama_emits_openai_chunks():
+    upstream = FakeResponse([
+        b'{"message": {"role": "assistant", "content": "Ho"}, "done": false}',
+        b'',
+        b'{"message": {"role": "assistant", "content": "la"}, "done": false}',
+        b'{"message": {"role": "assistant", "content": ""}, "done": true, "done_reason": "length"}',
+    ])
+    events = list(AIRouter()._stream_from_ollama(upstream, "qwen2.5:7b"))
+
+    assert events[-1] == b"data: [DONE]\n\n"
+    chunks = [json.loads(e[len(b"data: "):]) for e in events[:-1]]
+    assert chunks[0]['choices'][0]['delta'] == {"role": "assistant", "content": ""}
+    assert [c['choices'][0]['delta'].get('content') for c in chunks[1:3]] == ["Ho", "la"]
+    assert chunks[-1]['choices'][0]['finish_reason'] == "length"
+    assert all(c['object'] == "chat.completion.chunk" and c['model'] == "qwen2.5:7b" for c in chunks)
+    assert len({c['id'] for c in chunks}) == 1
+    assert upstream.closed
+
+
+def test_stream_from_deepseek_relays_events():
+    upstream = FakeResponse([b'data: {"id": "a"}', b'', b'data: [DONE]', b''])
+    events = list(AIRouter()._stream_from_deepseek(upstream))
+
+    assert events == [b'data: {"id": "a"}\n\n', b'data: [DONE]\n\n']
+    assert upstream.closed
+
+
+def test_stream_from_deepseek_hides_usage_only_chunk():
+    upstream = FakeResponse([
+        b'data: {"id": "a", "choices": [{"delta": {"content": "x"}}], "usage": null}',
+        b'data: {"id": "a", "choices": [], "usage": {"prompt_tokens": 3, "completion_tokens": 1}}',
+        b'data: [DONE]',
+    ])
+    events = list(AIRouter()._stream_from_deepseek(upstream))
+
+    assert len(events) == 2
+    assert b'"usage": {' not in b"".join(events)
+
+
+def test_async_stream_from_deepseek_relays_bytes():
+    class AsyncResponse:
+        closed = False
+
+        async def aiter_lines(self):
+            for line in ('data: {"id": "á"}', '', 'data: [DONE]'):
+                yield line
+
+        async def aclose(self):
+            self.closed = True
+
+    async def collect(upstream):
+        return [event async for event in AsyncAIRouter()._stream_from_deepseek(upstream)]
+
+    upstream = AsyncResponse()
+    events = asyncio.run(collect(upstream))
+    assert events == ['data: {"id": "á"}\n\n'.encode('utf-8'), b'data: [DONE]\n\n']
+    assert upstream.closed
+
+
+class ColdRegistry:
+    def resolve(self, model):
+        return model if model.startswith('qwen') else None
+
+    def residency(self, model):
+        return False
+
+
+def test_cold_model_goes_to_deepseek_with_cold_policy():
+    router = AIRouter()
+    router.models = ColdRegistry()
+    router.residency = ModelResidency(router.models, cold_policy='deepseek')
+    messages = [{"role": "user", "content": "hola"}]
+
+    decision, local_model = router.choose_backend("qwen2.5:7b", messages, 100)
+    assert (decision.backend, decision.reason, local_model) == ('deepseek', 'cold_model', "qwen2.5:7b")
+
+    router.residency.cold_policy = 'load'
+    decision, _ = router.choose_backend("qwen2.5:7b", messages, 100)
+    assert decision.reason != 'cold_model'
+
+
+def test_embeddings_count_as_in_flight_next_to_an_open_stream():
+    ollama = start_ollama_stub(StubProfile(latency=0.3, tokens=50, token_rate=20,
+                                           models=('qwen2.5:7b', 'nomic-embed-text')))
+    try:
+        registry = ModelRegistry(ollama.url)
+        assert registry.refresh()
+        # Sin hilo de refresco en los tests
+        registry._pid = os.getpid()
+        registry._ready.set()
+        router = AIRouter()
+        router.models = registry
+        router.pool = OllamaPool(registry)
+        router.residency = None
+        router.admission = AdmissionQueue(4, 8, {"interactive": 5, "batch": 5})
+
+        def in_flight():
+            return router.pool.stats()["nodes"][ollama.url]["in_flight"]
+
+        stream = router.call_ollama("qwen2.5:7b", [{"role": "user", "content": "hola"}], 0.7, 50, True)
+        next(iter(stream))
+        assert in_flight() == 1
+
+        embedded = []
+        worker = threading.Thread(target=lambda: embedded.append(router._embed_batch("nomic-embed-text", ["hola"])))
+        worker.start()
+        time.sleep(0.15)
+        assert in_flight() == 2 and router.admission.stats()["active"] == 2
+        worker.join()
+        assert len(embedded[0][0]) == 1
+        # El embedding no se lleva la cuenta del stream que sigue abierto
+        assert in_flight() == 1 and router.admission.stats()["active"] == 1
+
+        stream.close()
+        assert in_flight() == 0 and router.admission.stats()["active"] == 0
+    finally:
+        ollama.stop()
+
+
+def test_async_router_keeps_its_own_embedding_batcher(monkeypatch):
+    monkeypatch.setattr(embeddings_module, '_batcher', None)
+    router = AsyncAIRouter()
+    assert isinstance(router.embeddings, AsyncEmbeddingBatcher)
+    # El batcher síncrono del proceso no se crea con la corrutina de AsyncAIRouter
+    assert embeddings_module._batcher is None and embeddings_module.embedding_stats() is None
+    assert AIRouter().embeddings is embeddings_module._batcher
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Tests for the routing policies
+"""
+
+from api.services.routing_policy import (
+    BackendProfile, CostModelPolicy, ThresholdPolicy, estimate_tokens
+)
+
+MESSAGES = [{"role": "user", "content": "Resume este texto en una frase."}]
+
+
+def make_policy(max_cost=1.0):
+    return CostModelPolicy({
+        'ollama': BackendProfile('ollama', overhead=0.2, prefill_tps=100, decode_tps=10),
+        'deepseek': BackendProfile('deepseek', overhead=1.0, prefill_tps=2000, decode_tps=40,
+                                   input_cost=0.27, output_cost=1.10),
+    }, max_cost=max_cost, output_ratio=1.0)
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("hola que tal") == 3
+    # El código y el texto multibyte cuentan más que su número de palabras
+    assert estimate_tokens("f(x) = {a: [1, 2]};") > len("f(x) = {a: [1, 2]};".split())
+    assert estimate_tokens("日本語のテキスト") >= 8
+
+
+def test_cost_policy_picks_fastest_within_budget():
+    policy = make_policy()
+    assert policy.decide("qwen2.5:7b", MESSAGES, 5, "qwen2.5:7b").backend == 'ollama'
+
+    decision = policy.decide("qwen2.5:7b", MESSAGES, 1000, "qwen2.5:7b")
+    assert decision.backend == 'deepseek' and decision.reason == 'fastest'
+    assert decision.as_dict()["estimates"]["ollama"]["seconds"] > 100
+
+
+def test_cost_policy_respects_budget_and_availability():
+    assert make_policy(max_cost=0).decide("qwen2.5:7b", MESSAGES, 1000, "qwen2.5:7b").backend == 'ollama'
+    assert make_policy().decide("llama3", MESSAGES, 5, None).reason == 'not_local'
+
+
+def test_observed_throughput_changes_decision():
+    policy = make_policy()
+    for _ in range(30):
+        policy.observe('ollama', prompt_tokens=100, completion_tokens=1000, elapsed=11.0,
+                       prefill_seconds=0.1, decode_seconds=10.0)
+    assert policy.profiles['ollama'].decode_tps > 90
+    assert policy.decide("qwen2.5:7b", MESSAGES, 1000, "qwen2.5:7b").backend == 'ollama'
+
+
+def test_threshold_policy():
+    policy = ThresholdPolicy(10)
+    assert policy.decide("m", MESSAGES, 100, "m").reason == 'complex'
+    assert policy.decide("m", [{"role": "user", "content": "hola"}], 100, "m").backend == 'ollama'
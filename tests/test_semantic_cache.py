@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Tests for the semantic (near-duplicate) prompt cache
+"""
+
+import asyncio
+import threading
+import time
+
+from api.services.semantic_cache import SemanticCache
+from bench.stubs import stub_embedding
+
+SYSTEM = {"role": "system", "content": "Eres el soporte de TecnoTactil"}
+
+
+def ask(text, system=SYSTEM):
+    return ([system] if system else []) + [{"role": "user", "content": text}]
+
+
+def answer(content, finish_reason="stop", completion_tokens=10):
+    return {"object": "chat.completion",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                         "finish_reason": finish_reason}],
+            "usage": {"prompt_tokens": 5, "completion_tokens": completion_tokens, "total_tokens": 5 + completion_tokens}}
+
+
+def test_paraphrase_hits_and_unrelated_question_misses():
+    cache = SemanticCache(threshold=0.8)
+    probe = cache.probe("qwen2.5:7b", ask("cómo cambio mi contraseña"), stub_embedding)
+    assert probe.response is None
+    cache.store(probe, answer("password"))
+
+    hit = cache.probe("qwen2.5:7b", ask("Cómo cambio mi contraseña ahora"), stub_embedding)
+    assert hit.response == answer("password")
+    assert hit.similarity >= 0.8
+
+    miss = cache.probe("qwen2.5:7b", ask("precio del plan anual"), stub_embedding)
+    assert miss.response is None
+
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 2
+    assert stats["similarity"]["p50"] is not None
+    assert stats["lookup_seconds"]["p99"] is not None
+
+
+def test_scope_is_model_and_system_prompt():
+    cache = SemanticCache(threshold=0.5)
+    cache.store(cache.probe("qwen2.5:7b", ask("hola"), stub_embedding), answer("1"))
+    assert cache.probe("llama3:8b", ask("hola"), stub_embedding).response is None
+    assert cache.probe("qwen2.5:7b", ask("hola", system=None), stub_embedding).response is None
+    assert cache.probe("qwen2.5:7b", ask("hola"), stub_embedding).response == answer("1")
+
+
+def test_multi_turn_conversations_are_not_cached():
+    cache = SemanticCache()
+    messages = ask("hola") + [{"role": "assistant", "content": "¿Qué tal?"}, {"role": "user", "content": "bien"}]
+    assert cache.probe("qwen2.5:7b", messages, stub_embedding) is None
+    assert cache.stats()["lookups"] == 0
+
+
+def test_lru_and_ttl_eviction():
+    cache = SemanticCache(threshold=0.99, max_entries=2, ttl=3600)
+    for text in ("uno", "dos", "tres"):
+        cache.store(cache.probe("m", ask(text), stub_embedding), answer(text))
+    assert cache.stats()["entries"] == 2 and cache.stats()["evictions"] == 1
+    assert cache.probe("m", ask("uno"), stub_embedding).response is None
+
+    expiring = SemanticCache(threshold=0.99, ttl=0)
+    expiring.store(expiring.probe("m", ask("uno"), stub_embedding), answer("uno"))
+    time.sleep(0.01)
+    assert expiring.probe("m", ask("uno"), stub_embedding).response is None
+    assert expiring.stats()["entries"] == 0
+
+
+def test_embedding_failure_skips_the_cache():
+    cache = SemanticCache()
+
+    def down(text):
+        raise ConnectionError("ollama down")
+
+    assert cache.probe("m", ask("hola"), down) is None
+    assert cache.stats()["errors"] == 1
+
+
+def test_scope_keeps_its_most_recent_entries():
+    cache = SemanticCache(threshold=0.99, max_scope_entries=2)
+    for text in ("uno", "dos"):
+        cache.store(cache.probe("m", ask(text), stub_embedding), answer(text))
+    # Un acierto renueva la entrada también dentro del ámbito
+    assert cache.probe("m", ask("uno"), stub_embedding).response == answer("uno")
+    cache.store(cache.probe("m", ask("tres"), stub_embedding), answer("tres"))
+    cache.store(cache.probe("otro", ask("dos"), stub_embedding), answer("dos"))
+
+    assert cache.stats()["entries"] == 3 and cache.stats()["evictions"] == 1
+    assert cache.probe("m", ask("dos"), stub_embedding).response is None
+    assert cache.probe("m", ask("uno"), stub_embedding).response == answer("uno")
+    assert cache.probe("otro", ask("dos"), stub_embedding).response == answer("dos")
+
+
+def test_async_lookup_runs_off_the_event_loop():
+    cache = SemanticCache(threshold=0.8)
+    cache.store(cache.probe("m", ask("hola"), stub_embedding), answer("hola"))
+    threads = []
+    lookup = cache.lookup
+
+    def tracked(*args):
+        threads.append(threading.get_ident())
+        return lookup(*args)
+
+    cache.lookup = tracked
+
+    async def embed(text):
+        return stub_embedding(text)
+
+    async def scenario():
+        return await cache.probe_async("m", ask("hola"), embed), threading.get_ident()
+
+    probe, loop_thread = asyncio.run(scenario())
+    assert probe.response == answer("hola")
+    assert threads and threads[0] != loop_thread
+
+
+def test_truncated_responses_are_not_stored():
+    cache = SemanticCache(threshold=0.8)
+    cache.store(cache.probe("m", ask("resume el contrato"), stub_embedding), answer("El contrato", "length"))
+    assert cache.probe("m", ask("resume el contrato"), stub_embedding).response is None
+    assert cache.stats()["skipped"] == 1 and cache.stats()["entries"] == 0
+
+    cache.store(cache.probe("m", ask("resume el contrato"), stub_embedding), answer("El contrato dice..."))
+    assert cache.probe("m", ask("resume el contrato"), stub_embedding).response == answer("El contrato dice...")
+
+
+def test_sampled_requests_skip_the_cache():
+    cache = SemanticCache(threshold=0.8)
+    cache.store(cache.probe("m", ask("hola"), stub_embedding), answer("hola"))
+    assert cache.probe("m", ask("hola"), stub_embedding, temperature=0.7) is None
+    assert cache.probe("m", ask("hola"), stub_embedding, temperature="0").response == answer("hola")
+    assert cache.stats()["lookups"] == 2
+
+
+def test_hit_must_fit_in_max_tokens():
+    cache = SemanticCache(threshold=0.8)
+    cache.store(cache.probe("m", ask("explica la garantía"), stub_embedding, max_tokens=500),
+                answer("La garantía...", completion_tokens=40))
+
+    assert cache.probe("m", ask("explica la garantía"), stub_embedding, max_tokens=16).response is None
+    assert cache.stats()["over_limit"] == 1
+    hit = cache.probe("m", ask("explica la garantía"), stub_embedding, max_tokens=40)
+    assert hit.response["usage"]["completion_tokens"] == 40
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Tests for usage accounting and its SQLite rollups
+"""
+
+from api.services.router import AIRouter
+from api.services.usage import UsageRecorder, UsageStore
+
+
+def test_rollups_sum_into_minute_hour_and_day(tmp_path):
+    store = UsageStore(str(tmp_path / "usage.db"))
+    now = 1_700_000_000
+    minute = now // 60 * 60
+    store.add({(minute, "k1", "ollama", "qwen2.5:7b"): [2, 100, 40]}, now=now)
+    store.add({(minute + 60, "k1", "ollama", "qwen2.5:7b"): [1, 10, 5]}, now=now)
+
+    assert len(store.query(0, 'minute')) == 2
+    day = store.query(0, 'day')
+    assert len(day) == 1
+    assert (day[0]["requests"], day[0]["prompt_tokens"], day[0]["completion_tokens"]) == (3, 110, 45)
+    assert store.query(0, 'hour', api_key="other") == []
+
+
+def test_old_minute_rows_are_pruned(tmp_path):
+    store = UsageStore(str(tmp_path / "usage.db"), retention={"minute": 3600})
+    store.add({(0, "k1", "deepseek", "deepseek-chat"): [1, 1, 1]}, now=1_700_000_000)
+
+    assert store.query(0, 'minute') == []
+    assert len(store.query(0, 'day')) == 1
+
+
+def test_recorder_batches_until_flush(tmp_path):
+    store = UsageStore(str(tmp_path / "usage.db"))
+    recorder = UsageRecorder(store, flush_interval=3600)
+    recorder.record('ollama', 'qwen2.5:7b', 12, 30, api_key='')
+    recorder.record('ollama', 'qwen2.5:7b', 8, 10, api_key='')
+    assert store.query(0) == []
+
+    recorder.flush()
+    [row] = store.query(0)
+    assert (row["requests"], row["prompt_tokens"], row["completion_tokens"]) == (2, 20, 40)
+
+
+def test_ollama_response_reports_real_usage():
+    response = AIRouter()._convert_from_ollama(
+        {"message": {"content": "hola"}, "prompt_eval_count": 26, "eval_count": 7, "done_reason": "length"}, "qwen2.5:7b"
+    )
+    assert response["usage"] == {"prompt_tokens": 26, "completion_tokens": 7, "total_tokens": 33}
+    assert response["created"] != 1234567890
+    assert response["choices"][0]["finish_reason"] == "length"